@@ -5,4 +5,4 @@ Python Abstract Syntax Tree Viewer package.
 # IMPORTANT: this file is included in setup.py. Do not add 3rd party packages here, this
 # may break setup.py if users don't have the requirements installed!
 
-from astviewer.misc import PROGRAM_VERSION as __version__
+from astviewer.version import PROGRAM_VERSION as __version__
@@ -0,0 +1,192 @@
+""" Parses many files in parallel and writes their statistics or dumps.
+
+    The files are distributed over a pool of worker processes. Each file is processed
+    independently: an error in one file is reported in its result and doesn't stop the batch.
+    The results are written as soon as they arrive, in the order in which the files are done.
+    Every chunk of output therefore identifies its file.
+
+    IMPORTANT: this module must not import Qt so that it can be used without a display.
+"""
+from __future__ import print_function
+
+import errno, io, json, logging, multiprocessing, os, sys, time
+
+from astviewer.dump import DUMP_FORMATS, iter_dump, read_source
+from astviewer.parsing import parse_module
+from astviewer.statistics import table_statistics
+
+logger = logging.getLogger(__name__)
+
+SOURCE_EXTENSIONS = ('.py', '.pyw')
+DUMP_EXTENSIONS = {'json': '.json', 'ndjson': '.ndjson', 'text': '.txt'}
+DEFAULT_CHUNK_SIZE = 8 # Number of files that are sent to a worker process at once
+
+
+
+def iter_source_files(paths, extensions=SOURCE_EXTENSIONS):
+    """ Yields (file_path, relative_path) tuples of the Python files in the paths.
+
+        Directories are walked recursively (hidden directories and __pycache__ are skipped).
+        Files that are given explicitly are always included, whatever their extension. The
+        relative path is relative to the directory that was walked, or the base name of a file
+        that was given explicitly.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path, os.path.basename(path)
+            continue
+
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names[:] = sorted(name for name in dir_names
+                                  if not name.startswith('.') and name != '__pycache__')
+            for file_name in sorted(file_names):
+                if file_name.endswith(extensions):
+                    file_path = os.path.join(dir_path, file_name)
+                    yield file_path, os.path.relpath(file_path, path)
+
+
+def process_file(job):
+    """ Parses a file and returns a (result, chunk) tuple. Is executed in the worker processes.
+
+        The result is a dictionary with the file name, the statistics of the table and the
+        duration. If the file can't be processed it contains an 'error' item instead of the
+        statistics. The chunk is the dump of the file if a dump format is given and no output
+        directory. Otherwise it is None.
+
+        :param job: (file_name, relative_path, mode, dump_format, output_dir) tuple
+    """
+    file_name, relative_path, mode, dump_format, output_dir = job
+    start_time = time.time()
+    result = {'file': file_name}
+    chunk = None
+    try:
+        source = read_source(file_name)
+        table = parse_module(source, file_name=file_name, mode=mode, deep=True).table
+        del source
+        result.update(table_statistics(table))
+
+        if dump_format and output_dir:
+            out_path = os.path.join(output_dir, relative_path + DUMP_EXTENSIONS[dump_format])
+            _make_dirs(os.path.dirname(out_path))
+            with io.open(out_path, 'w', encoding='utf-8') as out_file:
+                for text in iter_dump(table, dump_format):
+                    out_file.write(text)
+        elif dump_format:
+            chunk = ''.join(iter_dump(table, dump_format))
+    except Exception as ex:
+        # Any error is isolated to the file; the other files are still processed.
+        result['error'] = "{}: {}".format(type(ex).__name__, ex)
+
+    result['seconds'] = round(time.time() - start_time, 6)
+    return result, chunk
+
+
+def _make_dirs(dir_name):
+    """ Creates a directory and its parents if they don't exist yet.
+
+        Other workers may create the same directory at the same time.
+    """
+    if dir_name and not os.path.isdir(dir_name):
+        try:
+            os.makedirs(dir_name)
+        except OSError:
+            if not os.path.isdir(dir_name):
+                raise
+
+
+class BatchReport(object):
+    """ Counts the processed files and nodes and reports the throughput.
+    """
+    def __init__(self):
+        """ Constructor
+        """
+        self.n_files = 0
+        self.n_errors = 0
+        self.n_nodes = 0
+        self.start_time = time.time()
+        self.duration = 0.0
+
+
+    def add(self, result):
+        """ Adds the result of a file.
+        """
+        self.n_files += 1
+        if 'error' in result:
+            self.n_errors += 1
+        else:
+            self.n_nodes += result['nodes']
+        self.duration = time.time() - self.start_time
+
+
+    def __str__(self):
+        """ Returns the report in a single line.
+        """
+        duration = max(self.duration, 1e-9)
+        return ("{} files ({} errors), {} nodes in {:.2f} seconds: {:.1f} files/s, {:.0f} nodes/s"
+                .format(self.n_files, self.n_errors, self.n_nodes, self.duration,
+                        self.n_files / duration, self.n_nodes / duration))
+
+
+def run_batch(paths, dump_format=None, output_dir=None, mode='exec', n_processes=None,
+              chunk_size=DEFAULT_CHUNK_SIZE, out_file=None):
+    """ Processes the Python files in the paths using a pool of worker processes.
+
+        Without dump format, a JSON line with the statistics of each file is written to out_file.
+        With dump format and output directory, the dump of each file is written to a file in the
+        output directory (with the same relative path) and the statistics are written to
+        out_file. With only a dump format, the dumps are written to out_file, one complete dump
+        after the other.
+
+        :param paths: list of file and directory names
+        :param dump_format: None, 'json', 'ndjson' or 'text'
+        :param output_dir: directory for the dump files
+        :param mode: the mode of ast.parse ('exec', 'eval' or 'single')
+        :param n_processes: number of worker processes. Default: the number of CPU cores. If 1,
+            the files are processed in this process.
+        :param chunk_size: number of files that are sent to a worker at once.
+        :param out_file: file-like object to write to. Default: sys.stdout
+        :return: BatchReport
+    """
+    if dump_format is not None and dump_format not in DUMP_FORMATS:
+        raise ValueError("Dump format must be one of {}, got: {!r}"
+                         .format(DUMP_FORMATS, dump_format))
+    if out_file is None:
+        out_file = sys.stdout
+    if n_processes is None:
+        n_processes = multiprocessing.cpu_count()
+
+    jobs = ((file_path, relative_path, mode, dump_format, output_dir)
+            for file_path, relative_path in iter_source_files(paths))
+
+    report = BatchReport()
+    pool = None
+    try:
+        if n_processes == 1:
+            results = (process_file(job) for job in jobs)
+        else:
+            pool = multiprocessing.Pool(n_processes)
+            results = pool.imap_unordered(process_file, jobs, chunk_size)
+
+        for result, chunk in results:
+            report.add(result)
+            if 'error' in result:
+                logger.warning("Unable to process {file}: {error}".format(**result))
+
+            if chunk is not None:
+                out_file.write(chunk)
+            elif not dump_format or output_dir:
+                out_file.write(json.dumps(result, sort_keys=True) + '\n')
+
+        out_file.flush()
+        if pool is not None:
+            pool.close()
+    except IOError as ex:
+        if ex.errno != errno.EPIPE:
+            raise
+        logger.debug("Output closed before the batch was complete.")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    return report
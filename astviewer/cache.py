@@ -0,0 +1,203 @@
+""" Persistent on-disk cache of parse results.
+
+    The node table and span index of a parsed module are stored in a compact binary form (the
+    arrays are stored as raw bytes, the rest is serialized with marshal and the result is
+    compressed with zlib). The cache is keyed by the hash of the source code, the Python version
+    and the parse mode. The least recently used entries are removed when the cache grows larger
+    than its maximum size.
+
+    IMPORTANT: this module must not import Qt so that it can be used without a display.
+"""
+from __future__ import print_function
+
+import hashlib, logging, marshal, os, sys, tempfile, zlib
+
+from astviewer.nodetable import NodeTable
+from astviewer.parsing import ParsedModule
+from astviewer.spanindex import SpanIndex
+from astviewer.version import PROGRAM_NAME
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMAT_VERSION = 1
+CACHE_MAGIC = b'ASTVIEWER-PARSE-CACHE\n'
+CACHE_FILE_EXTENSION = '.astc'
+
+DEFAULT_MAX_BYTES = 256 * 1024**2
+COMPRESSION_LEVEL = 1 # Fast compression, the arrays compress well anyway.
+
+
+
+def user_cache_dir(sub_dir=''):
+    """ Returns the directory where the program can store its cache files.
+
+        Uses the platform conventions: %LOCALAPPDATA% on Windows, ~/Library/Caches on macOS and
+        $XDG_CACHE_HOME (default: ~/.cache) on other systems.
+    """
+    if sys.platform.startswith('win'):
+        base_dir = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+        cache_dir = os.path.join(base_dir, PROGRAM_NAME, 'Cache')
+    elif sys.platform == 'darwin':
+        cache_dir = os.path.join(os.path.expanduser('~/Library/Caches'), PROGRAM_NAME)
+    else:
+        base_dir = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        cache_dir = os.path.join(base_dir, PROGRAM_NAME)
+
+    return os.path.join(cache_dir, sub_dir) if sub_dir else cache_dir
+
+
+
+class ParseCache(object):
+    """ Persistent cache of ParsedModules.
+    """
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        """ Constructor
+
+            :param directory: the cache directory. Default: the 'parse' directory in the user
+                cache directory. Is created when the first entry is stored.
+            :param max_bytes: maximum total size of the cache files.
+        """
+        self.directory = user_cache_dir('parse') if directory is None else directory
+        self.max_bytes = max_bytes
+
+
+    @staticmethod
+    def cache_key(source, mode):
+        """ Returns the cache key of a source string or of its UTF-8 bytes.
+
+            The key is a hash of the source, the Python version, the byte order and the parse mode.
+            Cache entries are therefore never shared between Python versions. A string and its
+            UTF-8 bytes have the same key.
+        """
+        hasher = hashlib.sha1()
+        hasher.update(source if isinstance(source, bytes) else
+                      source.encode('utf-8', 'surrogatepass'))
+        hasher.update("\0{}\0{}\0{}\0{}".format(
+            sys.version, sys.byteorder, mode, CACHE_FORMAT_VERSION).encode('ascii', 'replace'))
+        return hasher.hexdigest()
+
+
+    def _file_path(self, key):
+        """ Returns the path of the cache file for a key.
+        """
+        return os.path.join(self.directory, key + CACHE_FILE_EXTENSION)
+
+
+    def load(self, source, file_name, mode):
+        """ Returns the cached ParsedModule of the source, or None if it's not in the cache.
+
+            :param file_name: used as label of the root node (which doesn't need to be the file
+                name of the cached source).
+        """
+        file_path = self._file_path(self.cache_key(source, mode))
+        try:
+            with open(file_path, 'rb') as cache_file:
+                data = cache_file.read()
+        except (IOError, OSError):
+            return None
+
+        try:
+            if not data.startswith(CACHE_MAGIC):
+                raise ValueError("Not a cache file.")
+
+            state = marshal.loads(zlib.decompress(data[len(CACHE_MAGIC):]))
+            table = NodeTable.from_state(state['table'])
+            span_index = SpanIndex.from_state(state['span_index'])
+        except Exception as ex:
+            logger.warning("Removing invalid cache file {}: {}".format(file_path, ex))
+            self._remove(file_path)
+            return None
+
+        table.root_label = file_name
+        self._touch(file_path)
+        logger.debug("Cache hit: {} ({})".format(file_name, file_path))
+        return ParsedModule(file_name, mode, table, span_index)
+
+
+    def store(self, source, parsed_module):
+        """ Stores the parse result of the source in the cache. Evicts old entries if needed.
+        """
+        state = {'table': parsed_module.table.get_state(),
+                 'span_index': parsed_module.span_index.get_state()}
+        data = CACHE_MAGIC + zlib.compress(marshal.dumps(state), COMPRESSION_LEVEL)
+        file_path = self._file_path(self.cache_key(source, parsed_module.mode))
+
+        temp_path = None
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+
+            # Write to a temporary file first so that readers never see a partial file.
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as cache_file:
+                cache_file.write(data)
+            os.replace(temp_path, file_path)
+        except (IOError, OSError) as ex:
+            logger.warning("Unable to write cache file {}: {}".format(file_path, ex))
+            if temp_path is not None and os.path.exists(temp_path):
+                self._remove(temp_path)
+            return
+
+        logger.debug("Stored in cache: {} ({} bytes)".format(parsed_module.file_name, len(data)))
+        self.evict()
+
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache is smaller than max_bytes.
+        """
+        entries = []
+        total_bytes = 0
+        try:
+            file_names = os.listdir(self.directory)
+        except OSError:
+            return
+
+        for file_name in file_names:
+            if not file_name.endswith(CACHE_FILE_EXTENSION):
+                continue
+            file_path = os.path.join(self.directory, file_name)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue # Removed by another process
+            entries.append((stat.st_mtime, stat.st_size, file_path))
+            total_bytes += stat.st_size
+
+        entries.sort()
+        for _mtime, size, file_path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            logger.debug("Evicting from cache: {}".format(file_path))
+            self._remove(file_path)
+            total_bytes -= size
+
+
+    def clear(self):
+        """ Removes all entries from the cache.
+        """
+        max_bytes = self.max_bytes
+        try:
+            self.max_bytes = 0
+            self.evict()
+        finally:
+            self.max_bytes = max_bytes
+
+
+    @staticmethod
+    def _touch(file_path):
+        """ Updates the modification time of a file, which marks it as recently used.
+        """
+        try:
+            os.utime(file_path, None)
+        except OSError as ex:
+            logger.debug("Unable to touch {}: {}".format(file_path, ex))
+
+
+    @staticmethod
+    def _remove(file_path):
+        """ Removes a file. Does nothing if that fails.
+        """
+        try:
+            os.remove(file_path)
+        except OSError as ex:
+            logger.debug("Unable to remove {}: {}".format(file_path, ex))
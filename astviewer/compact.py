@@ -0,0 +1,139 @@
+""" Contains the compact layout: the rows of the tree without the nodes that carry little
+    information.
+
+    In compact mode the following nodes don't get a row:
+
+        - the expression contexts (e.g. 'ctx = Load'). They are folded into the row of their
+          parent, which is shown as e.g. 'targets[0] = Name (Store)'.
+        - empty lists (e.g. 'decorator_list = list').
+        - fields of AST nodes that are None (e.g. 'type_comment = None'). The value of a
+          constant (e.g. 'value = None' under 'value = Constant') is a literal, not an unset
+          field, so it is shown.
+
+    These are all leaves, so leaving them out doesn't change the parent of any of the rows. The
+    children of a node remain contiguous if the shown nodes are numbered in the order of their
+    node index, which is how the rows are mapped to nodes.
+
+    IMPORTANT: this module must not import Qt so that it can be used without a display.
+"""
+from __future__ import print_function
+
+import logging
+
+from array import array
+from itertools import accumulate, compress
+
+from astviewer.nodetable import KIND_AST, KIND_LIST, NO_FIELD, NO_NODE, INT_TYPE_CODE
+from astviewer.profiling import profiler
+
+logger = logging.getLogger(__name__)
+
+CTX_FIELD = 'ctx'
+VALUE_FIELD = 'value'
+LITERAL_CLASSES = ('Constant', 'MatchSingleton', 'NameConstant') # Their value is never hidden
+
+
+
+class CompactLayout(object):
+    """ Maps the rows of the tree in compact mode to the nodes of a NodeTable.
+    """
+    def __init__(self, table):
+        """ Constructor. Determines which nodes are hidden.
+        """
+        self.table = table
+        with profiler.phase('compact layout', items=len(table)):
+            self.hidden = self._find_hidden(table)
+
+            # n_shown_before[i] is the number of shown nodes with a lower index than i.
+            self.n_shown_before = array(INT_TYPE_CODE, [0])
+            self.n_shown_before.extend(accumulate(not hidden for hidden in self.hidden))
+            self.shown_nodes = array(INT_TYPE_CODE, compress(range(len(table)),
+                                                             (not h for h in self.hidden)))
+
+        logger.debug("Compact layout: {} of {} nodes hidden"
+                     .format(len(table) - len(self.shown_nodes), len(table)))
+
+
+    @staticmethod
+    def _find_hidden(table):
+        """ Returns a bytearray that is 1 for the nodes that are hidden in compact mode.
+        """
+        def field_index(field_name):
+            """ Returns the id of a field, or an id that matches no node if there is none.
+            """
+            try:
+                return table.field_names.index(field_name)
+            except ValueError:
+                return NO_FIELD - 1
+
+        ctx_field = field_index(CTX_FIELD)
+        value_field = field_index(VALUE_FIELD)
+
+        class_kinds = table.class_kinds
+        is_list = bytearray(kind == KIND_LIST for kind in class_kinds)
+        is_ast = bytearray(kind == KIND_AST for kind in class_kinds)
+        is_none = bytearray(name == 'NoneType' for name in table.class_names)
+        is_literal = bytearray(name in LITERAL_CLASSES for name in table.class_names)
+        class_id, parent = table.class_id, table.parent
+
+        hidden = bytearray(
+            field_id == ctx_field or
+            (n_children == 0 and is_list[cls_id] and field_id != NO_FIELD) or
+            (is_none[cls_id] and parent_idx != NO_NODE and is_ast[class_id[parent_idx]] and
+             not (field_id == value_field and is_literal[class_id[parent_idx]]))
+            for cls_id, field_id, n_children, parent_idx
+            in zip(class_id, table.field_id, table.child_count, parent))
+        return hidden
+
+
+    def nbytes(self):
+        """ Returns the (approximate) number of bytes used by the layout.
+        """
+        return (len(self.hidden) + len(self.n_shown_before) * self.n_shown_before.itemsize +
+                len(self.shown_nodes) * self.shown_nodes.itemsize)
+
+
+    def is_shown(self, idx):
+        """ Returns True if the node has a row in compact mode.
+        """
+        return not self.hidden[idx]
+
+
+    def row_count(self, idx):
+        """ Returns the number of rows under a node.
+        """
+        first = self.table.first_child[idx]
+        count = self.table.child_count[idx]
+        if count == 0:
+            return 0
+        return self.n_shown_before[first + count] - self.n_shown_before[first]
+
+
+    def child(self, idx, row):
+        """ Returns the node index of the child in a row under node idx.
+        """
+        return self.shown_nodes[self.n_shown_before[self.table.first_child[idx]] + row]
+
+
+    def row(self, idx):
+        """ Returns the row of a shown node within its parent.
+        """
+        parent_idx = self.table.parent[idx]
+        if parent_idx == NO_NODE:
+            return 0
+        return self.n_shown_before[idx] - self.n_shown_before[self.table.first_child[parent_idx]]
+
+
+    def folded_str(self, idx):
+        """ Returns the text that is appended to the Node column for the hidden children of a
+            node, e.g. ' (Load)'. Returns an empty string if there is none.
+        """
+        # The ctx is the last field of all node classes that have it.
+        table = self.table
+        count = table.child_count[idx]
+        if count == 0:
+            return ''
+        last_idx = table.first_child[idx] + count - 1
+        if table.field_names[table.field_id[last_idx]] != CTX_FIELD:
+            return ''
+        return " ({})".format(table.class_name(last_idx))
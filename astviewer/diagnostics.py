@@ -0,0 +1,62 @@
+""" Contains the dialog that shows diagnostic information that can be attached to bug reports.
+"""
+from __future__ import print_function
+
+import logging
+
+from astviewer.qtpy import QtGui, QtWidgets
+
+logger = logging.getLogger(__name__)
+
+# The dialog inherits from a Qt class, therefore it has many
+# ancestors public methods and attributes.
+# pylint: disable=R0901, R0902, R0904, W0201, R0913
+
+
+class DiagnosticsDialog(QtWidgets.QDialog):
+    """ Dialog with a read-only text that can be refreshed and copied to the clipboard.
+    """
+    def __init__(self, get_text, parent=None, title="Diagnostics"):
+        """ Constructor
+
+            :param get_text: function without parameters that returns the diagnostics text.
+            :param title: the window title.
+        """
+        super(DiagnosticsDialog, self).__init__(parent=parent)
+        self._get_text = get_text
+        self.setWindowTitle(title)
+        self.resize(700, 500)
+
+        font = QtGui.QFont()
+        font.setFamily('Courier')
+        font.setFixedPitch(True)
+
+        self.text_edit = QtWidgets.QPlainTextEdit()
+        self.text_edit.setReadOnly(True)
+        self.text_edit.setFont(font)
+        self.text_edit.setWordWrapMode(QtGui.QTextOption.NoWrap)
+
+        button_box = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Close)
+        copy_button = button_box.addButton("&Copy", QtWidgets.QDialogButtonBox.ActionRole)
+        refresh_button = button_box.addButton("&Refresh", QtWidgets.QDialogButtonBox.ActionRole)
+        copy_button.clicked.connect(self.copy_to_clipboard)
+        refresh_button.clicked.connect(self.refresh)
+        button_box.rejected.connect(self.reject)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.text_edit)
+        layout.addWidget(button_box)
+
+        self.refresh()
+
+
+    def refresh(self):
+        """ Gets the diagnostics text again and shows it.
+        """
+        self.text_edit.setPlainText(self._get_text())
+
+
+    def copy_to_clipboard(self):
+        """ Copies the diagnostics text to the clipboard.
+        """
+        QtWidgets.QApplication.clipboard().setText(self.text_edit.toPlainText())
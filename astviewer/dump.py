@@ -0,0 +1,155 @@
+""" Writes the syntax tree of a module as JSON, newline-delimited JSON or indented text.
+
+    The nodes are produced by generators and written as they are produced, so the output starts
+    as soon as the module has been parsed and no large strings are built in memory.
+
+    IMPORTANT: this module must not import Qt so that it can be used without a display.
+"""
+from __future__ import print_function
+
+import errno, json, logging, sys
+
+from astviewer.loader import decode_source, read_source_file
+from astviewer.nodetable import NO_NODE, NO_POS, NO_VALUE, iter_preorder, \
+    iter_preorder_with_depth
+from astviewer.parsing import parse_module
+
+logger = logging.getLogger(__name__)
+
+DUMP_FORMATS = ('json', 'ndjson', 'text')
+STDIN_FILE_NAME = '-'
+
+
+
+def node_record(table, node_idx):
+    """ Returns a dictionary with the properties of a node that can be serialized to JSON.
+
+        Primitive values are stored as their repr, as they are in the Value column of the tree.
+    """
+    line = table.line[node_idx]
+    start_pos, end_pos = table.span(node_idx)
+    parent_idx = table.parent[node_idx]
+    return {
+        'id': node_idx,
+        'parent': None if parent_idx == NO_NODE else parent_idx,
+        'field': table.field_label(node_idx),
+        'class': table.class_name(node_idx),
+        'value': None if table.value_idx[node_idx] == NO_VALUE else table.value_str(node_idx),
+        'pos': None if line == NO_POS else [line, table.col[node_idx]],
+        'span': None if start_pos is None or end_pos is None else [start_pos, end_pos],
+    }
+
+
+def iter_ndjson(table):
+    """ Yields the lines of the newline-delimited JSON dump: one object per node in pre-order.
+
+        The tree structure is given by the 'parent' field.
+    """
+    for node_idx in iter_preorder(table):
+        yield json.dumps(node_record(table, node_idx), sort_keys=True) + '\n'
+
+
+def iter_json(table):
+    """ Yields the chunks of a JSON document where each node contains its children in a
+        'children' list.
+
+        The document is written one node per line so that it can be produced incrementally.
+    """
+    if len(table) == 0:
+        yield 'null\n'
+        return
+
+    # An (idx, False) entry opens a node, an (idx, True) entry closes its children list.
+    stack = [(0, False)]
+    while stack:
+        node_idx, closing = stack.pop()
+        if closing:
+            yield ']}'
+            continue
+
+        separator = ',\n' if table.parent[node_idx] != NO_NODE and table.row(node_idx) > 0 \
+            else '\n'
+        record = json.dumps(node_record(table, node_idx), sort_keys=True)
+        yield separator + record[:-1] + ', "children": ['
+
+        stack.append((node_idx, True))
+        stack.extend((child_idx, False) for child_idx in reversed(table.children(node_idx)))
+    yield '\n'
+
+
+def iter_text(table):
+    """ Yields the lines of an indented text dump with the node, position and highlight columns.
+    """
+    for node_idx, depth in iter_preorder_with_depth(table):
+        columns = [table.node_str(node_idx)]
+        pos_str, span_str = table.pos_str(node_idx), table.span_str(node_idx)
+        if pos_str:
+            columns.append(pos_str)
+        if span_str:
+            columns.append("({})".format(span_str))
+        yield "{}{}\n".format("    " * depth, "  ".join(columns))
+
+
+def iter_dump(table, dump_format):
+    """ Returns the generator that produces the dump in the given format.
+    """
+    if dump_format == 'json':
+        return iter_json(table)
+    elif dump_format == 'ndjson':
+        return iter_ndjson(table)
+    elif dump_format == 'text':
+        return iter_text(table)
+    else:
+        raise ValueError("Dump format must be one of {}, got: {!r}"
+                         .format(DUMP_FORMATS, dump_format))
+
+
+def read_source(file_name):
+    """ Reads the source code of a file, or from stdin if the file name is '-'.
+
+        The encoding is detected from the byte order mark or coding cookie (PEP 263). Returns a
+        string, or UTF-8 bytes if these can be passed to ast.parse as they are.
+    """
+    if file_name == STDIN_FILE_NAME:
+        data = getattr(sys.stdin, 'buffer', sys.stdin).read()
+        return decode_source(data) if isinstance(data, bytes) else data
+    else:
+        return read_source_file(file_name).parse_source
+
+
+def dump_file(file_name, dump_format='json', mode='exec', out_file=None, cache=None):
+    """ Parses a file and writes its syntax tree to out_file.
+
+        :param file_name: the file to parse, or '-' to read the source from stdin
+        :param dump_format: 'json', 'ndjson' or 'text'
+        :param mode: the mode of ast.parse ('exec', 'eval' or 'single')
+        :param out_file: file-like object to write to. Default: sys.stdout
+        :param cache: optional ParseCache
+        :return: the exit code: 0 if successful, 1 if the file could not be read or parsed.
+    """
+    if dump_format not in DUMP_FORMATS:
+        raise ValueError("Dump format must be one of {}, got: {!r}"
+                         .format(DUMP_FORMATS, dump_format))
+    if out_file is None:
+        out_file = sys.stdout
+
+    label = '<stdin>' if file_name == STDIN_FILE_NAME else file_name
+    try:
+        source = read_source(file_name)
+        parsed_module = parse_module(source, file_name=label, mode=mode, cache=cache,
+                                     deep=True)
+    except (IOError, OSError, UnicodeDecodeError, SyntaxError, ValueError) as ex:
+        logger.error("Unable to parse {}: {}".format(label, ex))
+        return 1
+    del source
+
+    try:
+        for chunk in iter_dump(parsed_module.table, dump_format):
+            out_file.write(chunk)
+        out_file.flush()
+    except IOError as ex:
+        if ex.errno == errno.EPIPE:
+            logger.debug("Output closed before the dump was complete.")
+            return 0 # E.g. piped into head
+        raise
+    return 0
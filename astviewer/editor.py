@@ -4,6 +4,9 @@ from __future__ import print_function
 
 import logging, sys
 
+from astviewer.highlighter import PythonHighlighter
+from astviewer.lineindex import LineIndex
+from astviewer.profiling import profiler
 from astviewer.qtpy import QtCore, QtGui, QtWidgets
 
 
@@ -16,6 +19,12 @@ logger = logging.getLogger(__name__)
 
 class SourceEditor(QtWidgets.QPlainTextEdit):
     """ Source read-ony editor that can detect double clicks.
+
+        The positions of the ast have UTF-8 byte columns. They are converted to and from
+        document positions with a LineIndex, which is rebuilt when the text is set.
+
+        The source is highlighted by a PythonHighlighter, but only the lines that have been
+        visible. Setting the text therefore takes as long for large files as without highlighting.
     """
     sigTextClicked = QtCore.Signal(int, int)
     
@@ -38,6 +47,65 @@ class SourceEditor(QtWidgets.QPlainTextEdit):
         self.setWordWrapMode(QtGui.QTextOption.NoWrap)
         self.setCenterOnScroll(True)
         self.setStyleSheet("selection-color: black; selection-background-color: #FFE000;")
+        self.line_index = LineIndex()
+        self.highlighter = PythonHighlighter(self.document())
+        self.updateRequest.connect(self._update_requested)
+
+
+    def setPlainText(self, text):
+        """ Sets the text and builds its line index.
+        """
+        with profiler.phase('editor: line index', items=len(text)):
+            self.line_index = LineIndex(text)
+
+        # The highlighter would highlight all blocks when the document signals the change.
+        document = self.document()
+        document.blockSignals(True)
+        try:
+            super(SourceEditor, self).setPlainText(text)
+        finally:
+            document.blockSignals(False)
+        self.highlight_visible_blocks()
+
+
+    def highlight_visible_blocks(self):
+        """ Highlights the blocks in the viewport that haven't been highlighted yet.
+        """
+        first_block = last_block = self.firstVisibleBlock()
+        if not first_block.isValid():
+            return
+
+        offset = self.contentOffset()
+        height = self.viewport().height()
+        block = first_block
+        while block.isValid() and \
+                self.blockBoundingGeometry(block).translated(offset).top() < height:
+            last_block = block
+            block = block.next()
+
+        with profiler.phase('editor: highlight'):
+            self.highlighter.highlight_blocks(first_block, last_block)
+
+
+    def _update_requested(self, _rect, scrolled_pixels):
+        """ Highlights the blocks that have become visible when the viewport has scrolled.
+        """
+        if scrolled_pixels:
+            self.highlight_visible_blocks()
+
+
+    def resizeEvent(self, event):
+        """ Highlights the blocks that have become visible.
+        """
+        super(SourceEditor, self).resizeEvent(event)
+        self.highlight_visible_blocks()
+
+
+    def clear(self):
+        """ Removes the text.
+        """
+        super(SourceEditor, self).clear()
+        self.line_index = LineIndex()
 
 
     def sizeHint(self):
@@ -51,18 +119,21 @@ class SourceEditor(QtWidgets.QPlainTextEdit):
 
     def mousePressEvent(self, mouseEvent):
         """ On mouse press, the sigTextClicked(line_nr, column_nr) is emitted.
+
+            The column is a UTF-8 byte offset, like the column offsets of the ast.
         """
         if mouseEvent.button() == QtCore.Qt.LeftButton:
             cursor = self.cursorForPosition(mouseEvent.pos())
-            # Since the word wrap is off, there is one block per line. Block numbers are zero-based
-            # but code lines start at 1.
-            self.sigTextClicked.emit(cursor.blockNumber() + 1, cursor.positionInBlock())
+            line_nr, column_nr = self.line_index.line_col(cursor.position(),
+                                                          line=cursor.blockNumber() + 1)
+            self.sigTextClicked.emit(line_nr, column_nr)
 
 
     def select_text(self, from_pos, to_line_pos):
         """ Selects a text in the range from_line:col ... to_line:col
 
-            from_pos and to_line_pos should be a (line, column) tuple.
+            from_pos and to_line_pos should be a (line, column) tuple, where the column is a
+            UTF-8 byte offset.
             If from_pos is None, the selection starts at the beginning of the document.
             If to_line_pos is None, the selection goes to the end of the document.
         """
@@ -72,27 +143,20 @@ class SourceEditor(QtWidgets.QPlainTextEdit):
         if to_line_pos is None:
             text_cursor.movePosition(QtGui.QTextCursor.End, QtGui.QTextCursor.MoveAnchor)
         else:
-            to_line, to_col = to_line_pos
-            to_text_block = self.document().findBlockByLineNumber(to_line - 1)
-            to_pos = to_text_block.position() + to_col
-            text_cursor.setPosition(to_pos, QtGui.QTextCursor.MoveAnchor)
+            text_cursor.setPosition(self.line_index.position(*to_line_pos),
+                                    QtGui.QTextCursor.MoveAnchor)
 
         if from_pos is None:
             text_cursor.movePosition(QtGui.QTextCursor.Start, QtGui.QTextCursor.KeepAnchor)
         else:
-            from_line, from_col = from_pos
-            # findBlockByLineNumber seems to be 0-based.
-            from_text_block = self.document().findBlockByLineNumber(from_line - 1)
-            from_pos = from_text_block.position() + from_col
-            text_cursor.setPosition(from_pos, QtGui.QTextCursor.KeepAnchor)
+            text_cursor.setPosition(self.line_index.position(*from_pos),
+                                    QtGui.QTextCursor.KeepAnchor)
 
         self.setTextCursor(text_cursor)
         self.ensureCursorVisible()
 
 
     def get_last_pos(self):
-        """ Gets the linenr and column of the last character.
+        """ Gets the linenr and column of the last character. The column is a UTF-8 byte offset.
         """
-        text_cursor = self.textCursor()
-        text_cursor.movePosition(QtGui.QTextCursor.End, QtGui.QTextCursor.MoveAnchor)
-        return (text_cursor.blockNumber() + 1, text_cursor.positionInBlock())
+        return self.line_index.last_pos()
@@ -0,0 +1,216 @@
+""" Contains the TreeExpander that expands the nodes of a large tree without freezing the GUI.
+
+    Expanding a node that is visible makes the view insert its rows in its layout, which takes
+    time proportional to the number of visible rows. The expander therefore collapses the tree
+    first and keeps the root node collapsed while it expands the other nodes. These are then
+    hidden, and expanding them is cheap. The root node is expanded at the end, so that the view
+    lays out its rows only once.
+
+    The nodes are expanded in time slices between which the event loop runs, so the program
+    stays responsive and the operation can be cancelled with the Escape key. The view isn't
+    repainted while the expander runs.
+"""
+from __future__ import print_function
+
+import logging, time
+
+from collections import deque
+
+from astviewer.profiling import profiler
+from astviewer.qtpy import QtCore, QtWidgets
+
+logger = logging.getLogger(__name__)
+
+# Expansion modes
+EXPAND_RESET, EXPAND_ALL, EXPAND_DEPTH, EXPAND_ROWS = range(4)
+
+PHASE_NAMES = {
+    EXPAND_RESET: 'tree: expand_reset',
+    EXPAND_ALL: 'tree: expand_all',
+    EXPAND_DEPTH: 'tree: expand_to_depth',
+    EXPAND_ROWS: 'tree: expand_to_rows',
+}
+
+SLICE_DURATION = 0.02 # Seconds of expanding between two passes of the event loop
+CHECK_INTERVAL = 256  # Number of nodes expanded between two time checks
+
+
+
+def is_expanded_at_start(table, node_idx):
+    """ Returns True if the node is expanded when a file has been opened.
+    """
+    return (table.field_label(node_idx) == 'body' or
+            table.class_name(node_idx) in ('Module', 'ClassDef'))
+
+
+def iter_nodes_to_expand(table, mode, limit=0, top_idx=0):
+    """ Yields the nodes of a subtree that must be expanded. Nodes without children are skipped.
+
+        The parent of a node is always yielded before the node.
+
+        :param table: NodeTable
+        :param mode: EXPAND_RESET: the nodes that are expanded when a file has been opened.
+            EXPAND_ALL: all nodes.
+            EXPAND_DEPTH: the nodes that are less than limit levels below the top node.
+            EXPAND_ROWS: nodes in breadth-first order, for as long as the number of rows of
+            the subtree doesn't exceed the limit.
+        :param limit: the depth or number of rows (see mode)
+        :param top_idx: the node at the top of the subtree.
+    """
+    first_child, child_count = table.first_child, table.child_count
+
+    if mode == EXPAND_ROWS:
+        n_rows = 1
+        queue = deque([top_idx])
+        while queue:
+            node_idx = queue.popleft()
+            count = child_count[node_idx]
+            if count == 0:
+                continue
+            n_rows += count
+            if n_rows > limit:
+                return
+            yield node_idx
+            queue.extend(range(first_child[node_idx], first_child[node_idx] + count))
+        return
+
+    stack = [(top_idx, 0)]
+    while stack:
+        node_idx, depth = stack.pop()
+        count = child_count[node_idx]
+        if count == 0:
+            continue
+
+        if mode == EXPAND_ALL:
+            expand = True
+        elif mode == EXPAND_DEPTH:
+            expand = depth < limit
+        else:
+            expand = is_expanded_at_start(table, node_idx)
+
+        if expand:
+            yield node_idx
+            first = first_child[node_idx]
+            stack.extend((child_idx, depth + 1)
+                         for child_idx in range(first + count - 1, first - 1, -1))
+
+
+
+class TreeExpander(QtCore.QObject):
+    """ Expands the nodes of a SyntaxTreeWidget or SyntaxTreeView in time slices.
+
+        The tree must have a table attribute and a set_node_expanded(node_idx, expanded) method.
+    """
+    sigProgress = QtCore.Signal(int)   # Number of nodes that have been expanded so far
+    sigFinished = QtCore.Signal(bool)  # True if all nodes were expanded, False if cancelled
+
+    def __init__(self, tree):
+        """ Constructor
+
+            :param tree: the SyntaxTreeWidget or SyntaxTreeView. Is also the parent QObject.
+        """
+        super(TreeExpander, self).__init__(parent=tree)
+        self._tree = tree
+        self._table = None
+        self._nodes = None         # Iterator over the nodes that still have to be expanded
+        self._expand_root = False
+        self._n_expanded = 0
+        self._phase_name = ''
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._run_slice)
+
+
+    @property
+    def running(self):
+        """ True while the expander is expanding nodes.
+        """
+        return self._nodes is not None
+
+
+    def start(self, mode, limit=0):
+        """ Collapses the tree and starts expanding nodes. Stops a running expansion first.
+
+            The first time slice is done immediately, so small trees are expanded when this
+            method returns.
+
+            :param mode: EXPAND_RESET, EXPAND_ALL, EXPAND_DEPTH or EXPAND_ROWS. See
+                iter_nodes_to_expand.
+            :param limit: the depth or number of rows for EXPAND_DEPTH and EXPAND_ROWS.
+        """
+        self.cancel()
+        table = self._tree.table
+        if not table:
+            return
+
+        self._tree.setUpdatesEnabled(False)
+        self._tree.collapseAll()
+        self._table = table
+        self._nodes = iter_nodes_to_expand(table, mode, limit=limit)
+        self._expand_root = False
+        self._n_expanded = 0
+        self._phase_name = PHASE_NAMES[mode]
+        QtWidgets.QApplication.instance().installEventFilter(self)
+        self._run_slice()
+
+
+    def finish(self):
+        """ Expands the remaining nodes without returning to the event loop.
+        """
+        while self.running:
+            self._run_slice(max_duration=None)
+
+
+    def cancel(self):
+        """ Stops expanding. The nodes that have been expanded so far stay expanded.
+        """
+        if self.running:
+            logger.debug("Expansion cancelled after {} nodes.".format(self._n_expanded))
+            self._stop(completed=False)
+
+
+    def _run_slice(self, max_duration=SLICE_DURATION):
+        """ Expands nodes during at most about max_duration seconds (no maximum if None).
+        """
+        set_node_expanded = self._tree.set_node_expanded
+        end_time = None if max_duration is None else time.time() + max_duration
+        with profiler.phase(self._phase_name):
+            for node_idx in self._nodes:
+                if node_idx == 0:
+                    self._expand_root = True # Expanded last, see the module docstring.
+                    continue
+                set_node_expanded(node_idx, True)
+                self._n_expanded += 1
+                if (end_time is not None and self._n_expanded % CHECK_INTERVAL == 0 and
+                        time.time() >= end_time):
+                    self.sigProgress.emit(self._n_expanded)
+                    self._timer.start()
+                    return
+
+        self._stop(completed=True)
+
+
+    def _stop(self, completed):
+        """ Expands the root, restores the view updates and emits sigFinished.
+        """
+        self._timer.stop()
+        self._nodes = None
+        QtWidgets.QApplication.instance().removeEventFilter(self)
+
+        # The tree may have been cleared or repopulated in the meantime.
+        if self._expand_root and self._tree.table is self._table:
+            with profiler.phase(self._phase_name):
+                self._tree.set_node_expanded(0, True)
+        self._table = None
+        self._tree.setUpdatesEnabled(True)
+        self.sigFinished.emit(completed)
+
+
+    def eventFilter(self, watched, event):
+        """ Cancels the expansion when the Escape key is pressed.
+        """
+        if event.type() == QtCore.QEvent.KeyPress and event.key() == QtCore.Qt.Key_Escape:
+            self.cancel()
+            return True
+        return super(TreeExpander, self).eventFilter(watched, event)
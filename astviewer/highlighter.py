@@ -0,0 +1,245 @@
+""" Contains the syntax highlighter of the source editor.
+
+    The lines are highlighted with the tokenize module. Only triple-quoted strings can span
+    several lines, so the tokenizer state at the end of a line is one of three values, which is
+    stored as the user state of its text block. A line can therefore be tokenized on its own,
+    given the state of the line before it.
+
+    Lines are only highlighted when they become visible (see SourceEditor). Blocks that have
+    never been visible keep the unknown state (-1). When a block is highlighted and the state of
+    the block above it is unknown, the states are computed with a fast regular expression scan
+    from the nearest block with a known state. These states are stored in the blocks as well, so
+    no line is scanned twice.
+"""
+from __future__ import print_function
+
+import io, keyword, logging, re, tokenize
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins # Python 2
+
+from astviewer.qtpy import QtGui
+
+logger = logging.getLogger(__name__)
+
+# The tokenizer state at the end of a line. Is the user state of a block.
+STATE_UNKNOWN = -1     # The state of a block that has never been scanned. Qt's default.
+STATE_CODE = 0
+STATE_SINGLE_TRIPLE_QUOTED = 1  # Inside a ''' string
+STATE_DOUBLE_TRIPLE_QUOTED = 2  # Inside a """ string
+STATE_MASK = 3
+HIGHLIGHTED = 4        # Flag that is added to the state of blocks that have been highlighted
+
+_QUOTES = {STATE_SINGLE_TRIPLE_QUOTED: "'''", STATE_DOUBLE_TRIPLE_QUOTED: '"""'}
+_STATES = {"'''": STATE_SINGLE_TRIPLE_QUOTED, '"""': STATE_DOUBLE_TRIPLE_QUOTED}
+
+# The end of a string, skipping backslash escapes. Raw strings can't end with a backslash
+# either, so this also holds for them.
+_STRING_END_RE = {
+    "'''": re.compile(r"(?:[^\\]|\\.)*?'''", re.DOTALL),
+    '"""': re.compile(r'(?:[^\\]|\\.)*?"""', re.DOTALL),
+    "'": re.compile(r"(?:[^\\'\n]|\\.)*'"),
+    '"': re.compile(r'(?:[^\\"\n]|\\.)*"'),
+}
+_CODE_RE = re.compile(r"""#|'''|\"\"\"|'|\"""")       # Start of a comment or string
+_NON_BMP_RE = re.compile(u'[\U00010000-\U0010FFFF]') # Characters with two UTF-16 code units
+
+BUILTIN_NAMES = frozenset(name for name in dir(builtins) if not name.startswith('_'))
+
+
+
+def line_end_state(line, state):
+    """ Returns the tokenizer state at the end of a line.
+
+        :param line: the line (without line break)
+        :param state: the state at the end of the previous line
+    """
+    pos = 0
+    if state != STATE_CODE:
+        match = _STRING_END_RE[_QUOTES[state]].match(line)
+        if match is None:
+            return state
+        pos = match.end()
+
+    while True:
+        match = _CODE_RE.search(line, pos)
+        if match is None or match.group() == '#':
+            return STATE_CODE
+        quote = match.group()
+        end_match = _STRING_END_RE[quote].match(line, match.end())
+        if end_match is None:
+            # Single-quoted strings end at the line break (continuation lines aren't supported).
+            return _STATES.get(quote, STATE_CODE)
+        pos = end_match.end()
+
+
+def _make_format(color, bold=False, italic=False):
+    """ Returns a QTextCharFormat with a foreground color.
+    """
+    text_format = QtGui.QTextCharFormat()
+    text_format.setForeground(QtGui.QColor(color))
+    if bold:
+        text_format.setFontWeight(QtGui.QFont.Bold)
+    text_format.setFontItalic(italic)
+    return text_format
+
+
+
+class PythonHighlighter(QtGui.QSyntaxHighlighter):
+    """ Highlights Python source code with the tokenize module.
+
+        Only the blocks that are passed to highlight_blocks are highlighted, and the blocks that
+        have been highlighted before (when Qt asks to highlight them again).
+    """
+    def __init__(self, document):
+        """ Constructor
+
+            :param document: the QTextDocument. Should be empty, otherwise the whole document is
+                highlighted when the event loop runs.
+        """
+        super(PythonHighlighter, self).__init__(document)
+        self._requested = None # Block numbers (first, last) that highlight_blocks highlights
+
+        self.formats = {
+            'keyword': _make_format('#000080', bold=True),
+            'builtin': _make_format('#900090'),
+            'definition': _make_format('#0000FF', bold=True),
+            'decorator': _make_format('#AA22FF'),
+            'number': _make_format('#0000FF'),
+            'string': _make_format('#008000'),
+            'comment': _make_format('#808080', italic=True),
+        }
+
+
+    def highlight_blocks(self, first_block, last_block):
+        """ Highlights the blocks from first_block up to and including last_block, if they
+            haven't been highlighted yet.
+        """
+        self._requested = (first_block.blockNumber(), last_block.blockNumber())
+        try:
+            block = first_block
+            while block.isValid() and block.blockNumber() <= self._requested[1]:
+                # rehighlightBlock continues with the next blocks while their states change,
+                # which is the case for all blocks that haven't been highlighted yet.
+                if block.userState() < HIGHLIGHTED:
+                    self.rehighlightBlock(block)
+                block = block.next()
+        finally:
+            self._requested = None
+
+
+    def _is_requested(self, block_nr):
+        """ Returns True if highlight_blocks has been asked to highlight the block.
+        """
+        return self._requested is not None and \
+            self._requested[0] <= block_nr <= self._requested[1]
+
+
+    def _scan_states(self, block):
+        """ Computes the states of the block and of the blocks above it with unknown states.
+
+            Returns the state of the block.
+        """
+        blocks = []
+        while block.isValid() and block.userState() == STATE_UNKNOWN:
+            blocks.append(block)
+            block = block.previous()
+
+        state = block.userState() & STATE_MASK if block.isValid() else STATE_CODE
+        for block in reversed(blocks):
+            state = line_end_state(block.text(), state)
+            block.setUserState(state)
+        return state
+
+
+    def highlightBlock(self, text):
+        """ Highlights a block. Called by Qt.
+
+            Blocks that have not been requested and weren't highlighted before keep their state
+            and aren't formatted.
+        """
+        block = self.currentBlock()
+        current_state = self.currentBlockState()
+        highlight = current_state >= HIGHLIGHTED or self._is_requested(block.blockNumber())
+        if current_state == STATE_UNKNOWN and not highlight:
+            # Keeps Qt from continuing with the next block.
+            self.setCurrentBlockState(STATE_UNKNOWN)
+            return
+
+        previous_state = self.previousBlockState()
+        if previous_state == STATE_UNKNOWN and block.blockNumber() > 0:
+            previous_state = self._scan_states(block.previous())
+        start_state = max(previous_state, STATE_CODE) & STATE_MASK
+
+        state = line_end_state(text, start_state)
+        if highlight:
+            self._format_line(text, start_state)
+            state |= HIGHLIGHTED
+        self.setCurrentBlockState(state)
+
+
+    def _format_line(self, text, start_state):
+        """ Sets the formats of the tokens of a line.
+
+            :param text: the text of the block
+            :param start_state: the state at the end of the previous line
+        """
+        if _NON_BMP_RE.search(text):
+            # Qt positions count UTF-16 code units.
+            positions = [0]
+            for char in text:
+                positions.append(positions[-1] + (2 if ord(char) > 0xFFFF else 1))
+        else:
+            positions = None
+
+        def set_format(start, end, format_name):
+            """ Formats the characters start ... end of the text.
+            """
+            if positions is not None:
+                start, end = positions[start], positions[end]
+            self.setFormat(start, end - start, self.formats[format_name])
+
+        code_start = 0
+        if start_state != STATE_CODE:
+            match = _STRING_END_RE[_QUOTES[start_state]].match(text)
+            code_start = len(text) if match is None else match.end()
+            set_format(0, code_start, 'string')
+
+        code = text[code_start:]
+        if not code.strip():
+            return
+
+        previous_token = None
+        try:
+            for token in tokenize.generate_tokens(io.StringIO(code).readline):
+                token_type, token_string = token[0], token[1]
+                start, end = code_start + token[2][1], code_start + token[3][1]
+                if token_type == tokenize.NAME:
+                    if keyword.iskeyword(token_string):
+                        set_format(start, end, 'keyword')
+                    elif previous_token in ('def', 'class'):
+                        set_format(start, end, 'definition')
+                    elif previous_token == '@':
+                        set_format(start, end, 'decorator')
+                    elif token_string in BUILTIN_NAMES:
+                        set_format(start, end, 'builtin')
+                elif token_type == tokenize.OP and token_string == '@' and previous_token is None:
+                    set_format(start, end, 'decorator')
+                elif token_type == tokenize.NUMBER:
+                    set_format(start, end, 'number')
+                elif token_type == tokenize.STRING:
+                    set_format(start, end, 'string')
+                elif token_type == tokenize.COMMENT:
+                    set_format(start, end, 'comment')
+
+                if token_type not in (tokenize.INDENT, tokenize.DEDENT):
+                    previous_token = token_string
+        except tokenize.TokenError as ex:
+            # The line ends inside a triple-quoted string or a bracket.
+            _message, (_line_nr, col) = ex.args
+            if line_end_state(code, STATE_CODE) != STATE_CODE:
+                set_format(code_start + col, len(text), 'string')
+        except SyntaxError as ex: # E.g. an IndentationError
+            logger.debug("Unable to tokenize line: {}".format(ex))
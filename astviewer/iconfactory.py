@@ -3,14 +3,210 @@
 """ Miscellaneous Qt routines.
 """
 from __future__ import print_function
-import logging, os
+import hashlib, logging, os, tempfile, threading
 
-from astviewer.qtpy import QtCore, QtGui, QtSvg
+from astviewer.cache import user_cache_dir
+from astviewer.qtpy import QtCore, QtGui, QtSvg, QtWidgets
 from astviewer.misc import program_directory, log_dictionary
+from astviewer.profiling import profiler, COUNT_ICONS_FETCHED
 from astviewer.version import DEBUGGING
 
 logger = logging.getLogger(__name__)
 
+ICON_CACHE_FORMAT_VERSION = 1
+
+
+
+class PixmapDiskCache(object):
+    """ Stores rendered icon images as PNG files so that the SVG files don't need to be parsed
+        and rendered again when the program is restarted.
+
+        May be used from several threads. Files are written to a temporary file first and then
+        renamed, so that readers never see a partial file.
+    """
+    def __init__(self, directory=None):
+        """ Constructor
+
+            :param directory: the cache directory. Default: the 'icons' directory in the user
+                cache directory. Is created when the first image is stored.
+        """
+        self.directory = user_cache_dir('icons') if directory is None else directory
+
+
+    def filePath(self, svgHash, width, height, color):
+        """ Returns the path of the cache file of an image.
+        """
+        colorStr = color.lstrip('#') if color else 'orig'
+        return os.path.join(self.directory, "{}-{}-{}x{}-v{}.png".format(
+            svgHash, colorStr, width, height, ICON_CACHE_FORMAT_VERSION))
+
+
+    def load(self, filePath):
+        """ Returns the cached QImage, or None if it's not in the cache.
+        """
+        if not os.path.exists(filePath):
+            return None
+        image = QtGui.QImage()
+        if not image.load(filePath, 'PNG'):
+            logger.debug("Unable to read cached icon: {}".format(filePath))
+            return None
+        return image
+
+
+    def store(self, filePath, image):
+        """ Stores an image in the cache. Does nothing if that fails.
+        """
+        tempPath = None
+        try:
+            if not os.path.isdir(self.directory):
+                try:
+                    os.makedirs(self.directory)
+                except OSError:
+                    if not os.path.isdir(self.directory):
+                        raise
+            fd, tempPath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            os.close(fd)
+            if not image.save(tempPath, 'PNG'):
+                raise IOError("QImage.save failed")
+            os.replace(tempPath, filePath)
+        except (IOError, OSError) as ex:
+            logger.debug("Unable to write cached icon {}: {}".format(filePath, ex))
+            if tempPath is not None and os.path.exists(tempPath):
+                os.remove(tempPath)
+
+
+
+class SvgRasterizer(object):
+    """ Renders an SVG image into QImages of the sizes that are requested.
+
+        The images are cached in memory and on disk. Rendering to QImage (not QPixmap) is
+        allowed outside the GUI thread, so images can be prepared by a thread pool.
+    """
+    def __init__(self, svg, color=None, diskCache=None):
+        """ Constructor
+
+            :param svg: string containing Scalable Vector Graphics XML, with the colors already
+                replaced.
+            :param color: the color that has replaced the original colors. Part of the cache key.
+            :param diskCache: optional PixmapDiskCache
+        """
+        self.svg = svg.encode('utf-8') if not isinstance(svg, bytes) else svg
+        self.svgHash = hashlib.sha1(self.svg).hexdigest()[:20]
+        self.color = color
+        self.diskCache = diskCache
+        self._images = {}
+        self._lock = threading.Lock()
+
+
+    def image(self, size):
+        """ Returns a QImage of the SVG with the given size (a QSize in device pixels).
+
+            Reads the image from the disk cache or renders it if it isn't in the memory cache.
+        """
+        key = (size.width(), size.height())
+        with self._lock:
+            image = self._images.get(key)
+        if image is not None:
+            return image
+
+        filePath = None
+        if self.diskCache is not None:
+            filePath = self.diskCache.filePath(self.svgHash, key[0], key[1], self.color)
+            image = self.diskCache.load(filePath)
+
+        if image is None:
+            image = self.render(size)
+            if filePath is not None:
+                self.diskCache.store(filePath, image)
+
+        with self._lock:
+            return self._images.setdefault(key, image)
+
+
+    def render(self, size):
+        """ Renders the SVG into a new QImage of the given size.
+        """
+        with profiler.phase('icons: render svg'):
+            svgRenderer = QtSvg.QSvgRenderer(QtCore.QByteArray(self.svg))
+            image = QtGui.QImage(size, QtGui.QImage.Format_ARGB32_Premultiplied)
+            image.fill(QtCore.Qt.transparent)
+            painter = QtGui.QPainter(image)
+            painter.setRenderHint(QtGui.QPainter.TextAntialiasing, True)
+            painter.setRenderHint(QtGui.QPainter.Antialiasing, True)
+            svgRenderer.render(painter)
+            painter.end()
+        return image
+
+
+
+class SvgIconEngine(QtGui.QIconEngine):
+    """ Icon engine that only creates the pixmaps of the sizes that are actually painted.
+
+        The pixmaps are made from the QImages of an SvgRasterizer.
+    """
+    def __init__(self, rasterizer):
+        """ Constructor
+        """
+        super(SvgIconEngine, self).__init__()
+        self.rasterizer = rasterizer
+        self._pixmaps = {}
+
+
+    def clone(self):
+        """ Returns a copy of the engine that shares the rasterizer.
+        """
+        return SvgIconEngine(self.rasterizer)
+
+
+    def pixmap(self, size, mode, state):
+        """ Returns the pixmap for the requested size (in device pixels), mode and state.
+        """
+        key = (size.width(), size.height(), mode)
+        pixmap = self._pixmaps.get(key)
+        if pixmap is None:
+            pixmap = QtGui.QPixmap.fromImage(self.rasterizer.image(size))
+            if mode != QtGui.QIcon.Normal:
+                option = QtWidgets.QStyleOption()
+                option.palette = QtWidgets.QApplication.palette()
+                pixmap = QtWidgets.QApplication.style().generatedIconPixmap(mode, pixmap, option)
+            self._pixmaps[key] = pixmap
+        return pixmap
+
+
+    def paint(self, painter, rect, mode, state):
+        """ Paints the icon in the rectangle. Uses a pixmap with the device pixel ratio of the
+            painter.
+        """
+        device = painter.device()
+        ratio = device.devicePixelRatioF() if hasattr(device, 'devicePixelRatioF') else 1.0
+        size = QtCore.QSize(int(round(rect.width() * ratio)), int(round(rect.height() * ratio)))
+        if size.isEmpty():
+            return
+        pixmap = self.pixmap(size, mode, state)
+        painter.drawPixmap(rect, pixmap)
+
+
+
+class _PrerenderTask(QtCore.QRunnable):
+    """ Renders the images of a list of rasterizers in a thread pool.
+    """
+    def __init__(self, rasterizers, size):
+        """ Constructor
+        """
+        super(_PrerenderTask, self).__init__()
+        self.rasterizers = rasterizers
+        self.size = QtCore.QSize(size)
+
+
+    def run(self):
+        """ Renders the images. Is executed in a thread of the pool.
+        """
+        for rasterizer in self.rasterizers:
+            try:
+                rasterizer.image(self.size)
+            except Exception as ex:
+                logger.warning("Unable to prerender icon: {}".format(ex))
+
 
 
 class IconFactory(object):
@@ -22,6 +218,9 @@ class IconFactory(object):
 
         The getIcon method can optionally set the fill color of the icons. It also caches the
         generated QItem objects to that they only have to be created once.
+
+        The icons are rendered on demand by an SvgIconEngine: only the sizes that are painted are
+        rendered, and the rendered images are stored in a disk cache.
     """
 
     ICONS_DIRECTORY = os.path.join(program_directory(), 'icons')
@@ -38,9 +237,10 @@ class IconFactory(object):
         """ Constructor
         """
         self._icons = {}
+        self._rasterizers = {}
         self._registry = {}
         self.colorsToBeReplaced = ('#008BFF', '#00AAFF')
-        self.renderSizes = [16, 24, 32, 64]
+        self.diskCache = PixmapDiskCache()
 
         self.registerIcon(None, None) # no icon
         self.registerIcon("",   None) # no icon
@@ -81,6 +281,7 @@ class IconFactory(object):
             :param color: '#RRGGBB' string (e.g. '#FF0000' for red)
             :return: QtGui.QIcon
         """
+        profiler.count(COUNT_ICONS_FETCHED)
         try:
             fileName = self._registry[glyph]
         except KeyError:
@@ -137,23 +338,28 @@ class IconFactory(object):
         if colorsToBeReplaced is None:
             colorsToBeReplaced = self.colorsToBeReplaced
 
+        # From http://stackoverflow.com/questions/15123544/change-the-color-of-an-svg-in-qt
         if color:
             for oldColor in colorsToBeReplaced:
                 svg = svg.replace(oldColor, color)
 
-        # From http://stackoverflow.com/questions/15123544/change-the-color-of-an-svg-in-qt
-        qByteArray = QtCore.QByteArray()
-        qByteArray.append(svg)
-        svgRenderer = QtSvg.QSvgRenderer(qByteArray)
-        icon = QtGui.QIcon()
-        for size in self.renderSizes:
-            pixMap = QtGui.QPixmap(QtCore.QSize(size, size))
-            pixMap.fill(QtCore.Qt.transparent)
-            pixPainter = QtGui.QPainter(pixMap)
-            pixPainter.setRenderHint(QtGui.QPainter.TextAntialiasing, True)
-            pixPainter.setRenderHint(QtGui.QPainter.Antialiasing, True)
-            svgRenderer.render(pixPainter)
-            pixPainter.end()
-            icon.addPixmap(pixMap)
-
-        return icon
+        rasterizer = SvgRasterizer(svg, color=color, diskCache=self.diskCache)
+        self._rasterizers[(rasterizer.svgHash, color)] = rasterizer
+        return QtGui.QIcon(SvgIconEngine(rasterizer))
+
+
+    def prerenderIcons(self, size, glyphs=None):
+        """ Renders the images of the icons in a thread pool so that they are ready when the
+            icons are first painted.
+
+            :param size: QSize in device pixels (i.e. including the device pixel ratio).
+            :param glyphs: list of glyph names. Default: all registered glyphs.
+        """
+        if glyphs is None:
+            glyphs = [glyph for glyph, fileName in self._registry.items() if fileName]
+
+        for glyph in glyphs:
+            self.getIcon(glyph) # Creates the rasterizers
+
+        rasterizers = list(self._rasterizers.values())
+        QtCore.QThreadPool.globalInstance().start(_PrerenderTask(rasterizers, size))
@@ -0,0 +1,191 @@
+""" Contains the line index: maps (line, col) positions of the ast to positions in a text document.
+
+    The column offsets of the ast are UTF-8 byte offsets, while the positions of a QTextDocument
+    count UTF-16 code units. For every line the index stores the document position of its start.
+    Lines with non-ASCII characters get two extra tables that convert the byte offsets into
+    UTF-16 offsets and back. Both conversions are then array lookups. The tables of a line are
+    made when the line is first looked up, so building the index only costs a pass over the
+    lines. The lines that only have ASCII characters are flagged; their columns are the same in
+    both units and need no lookup at all.
+
+    IMPORTANT: this module must not import Qt so that it can be used without a display.
+"""
+from __future__ import print_function
+
+import logging, re
+
+from array import array
+from bisect import bisect_right
+
+logger = logging.getLogger(__name__)
+
+_NEWLINE_RE = re.compile(r'\r\n|\r|\n') # The line breaks of the Python tokenizer
+NO_LINE = -1
+
+
+
+def _is_ascii(text):
+    """ Returns True if the text only contains ASCII characters.
+    """
+    try:
+        text.encode('ascii')
+    except UnicodeError:
+        return False
+    return True
+
+
+
+def line_offsets(data):
+    """ Returns an array with the offsets of the line starts in a bytes-like object.
+
+        Only b'\\n' is a line break, so a line may end with b'\\r'. The array has an extra element
+        at the end, which is the length of the data plus one, so that the length of line i
+        (including its line break) is offsets[i + 1] - offsets[i].
+
+        :param data: bytes or a memory map.
+    """
+    offsets = array('q', [0])
+    offsets.extend(match.end() for match in re.finditer(b'\n', data))
+    offsets.append(len(data) + 1)
+    return offsets
+
+
+
+class LineIndex(object):
+    """ Converts between (line, byte col) positions and the positions in a document.
+
+        Line numbers start at 1, like those of the ast. A document position counts the UTF-16
+        code units of the characters before it, plus one for every line break (like the
+        positions of a QTextDocument).
+    """
+    def __init__(self, source=''):
+        """ Constructor. Builds the index.
+
+            :param source: the source code that is shown in the document.
+        """
+        self.line_starts = array('q')  # document position of the start of every line
+        self._ascii_lines = bytearray() # 1 for the lines that only have ASCII characters
+        self._non_ascii_lines = {}     # the text of the lines with non-ASCII, per line index
+        self._byte_to_col = {}         # byte offset to UTF-16 offset, per non-ASCII line index
+        self._col_to_byte = {}         # UTF-16 offset to byte offset, per non-ASCII line index
+        self._build(source)
+
+
+    def __len__(self):
+        """ Returns the number of lines.
+        """
+        return len(self.line_starts) - 1
+
+
+    def _build(self, source):
+        """ Builds the table of line starts and keeps the lines that have non-ASCII characters.
+        """
+        line_starts = self.line_starts
+        if '\r' not in source and _is_ascii(source):
+            # Fast path: the document positions are the string offsets.
+            line_starts.append(0)
+            line_starts.extend(match.end() for match in re.finditer('\n', source))
+            line_starts.append(len(source) + 1)
+            self._ascii_lines = bytearray(b'\x01') * (len(line_starts) - 1)
+            return
+
+        lines = _NEWLINE_RE.split(source) if '\r' in source else source.split('\n')
+        ascii_lines = self._ascii_lines
+        pos = 0
+        for line_idx, line in enumerate(lines):
+            line_starts.append(pos)
+            is_ascii = _is_ascii(line)
+            ascii_lines.append(is_ascii)
+            if is_ascii:
+                pos += len(line) + 1
+            else:
+                self._non_ascii_lines[line_idx] = line
+                pos += len(line.encode('utf-16-le', 'surrogatepass')) // 2 + 1
+        line_starts.append(pos)
+
+
+    def _line_tables(self, line_idx):
+        """ Returns the (byte_to_col, col_to_byte) conversion tables of a line. Returns
+            (None, None) if the line only has ASCII characters.
+
+            Bytes in the middle of a character are mapped to the start of the character, and so
+            is the second code unit of a surrogate pair.
+        """
+        line = self._non_ascii_lines.get(line_idx)
+        if line is None:
+            return (None, None)
+        byte_to_col = self._byte_to_col.get(line_idx)
+        if byte_to_col is not None:
+            return (byte_to_col, self._col_to_byte[line_idx])
+
+        byte_to_col = array('i')
+        col_to_byte = array('i')
+        col = byte = 0
+        for char in line:
+            n_bytes = len(char.encode('utf-8', 'surrogatepass'))
+            n_units = 2 if ord(char) > 0xFFFF else 1
+            byte_to_col.extend([col] * n_bytes)
+            col_to_byte.extend([byte] * n_units)
+            col += n_units
+            byte += n_bytes
+        byte_to_col.append(col)
+        col_to_byte.append(byte)
+        self._byte_to_col[line_idx] = byte_to_col
+        self._col_to_byte[line_idx] = col_to_byte
+        return (byte_to_col, col_to_byte)
+
+
+    def line_length(self, line):
+        """ Returns the length of a line in UTF-8 bytes.
+        """
+        line_idx = line - 1
+        line_text = self._non_ascii_lines.get(line_idx)
+        if line_text is not None:
+            return len(line_text.encode('utf-8', 'surrogatepass'))
+        return self.line_starts[line_idx + 1] - self.line_starts[line_idx] - 1
+
+
+    def position(self, line, col):
+        """ Returns the document position of a (line, byte col) position.
+
+            Positions after the end of a line are moved to the end of that line. Positions after
+            the last line are moved to the end of the document.
+        """
+        line_idx = line - 1
+        if line_idx < 0:
+            return 0
+        if line_idx >= len(self):
+            return self.line_starts[-1] - 1
+
+        line_start = self.line_starts[line_idx]
+        line_end = self.line_starts[line_idx + 1] - 1
+        if not self._ascii_lines[line_idx]:
+            byte_to_col, _col_to_byte = self._line_tables(line_idx)
+            col = byte_to_col[min(max(col, 0), len(byte_to_col) - 1)]
+        return min(line_start + max(col, 0), line_end)
+
+
+    def line_col(self, position, line=None):
+        """ Returns the (line, byte col) position of a document position.
+
+            :param line: the line of the position, if it is known (e.g. from the block number of
+                a text cursor). The line is then not searched for.
+        """
+        line_starts = self.line_starts
+        position = min(max(position, 0), line_starts[-1] - 1)
+        line_idx = NO_LINE if line is None else line - 1
+        if not 0 <= line_idx < len(self) or \
+                not line_starts[line_idx] <= position < line_starts[line_idx + 1]:
+            line_idx = bisect_right(line_starts, position) - 1
+
+        col = position - line_starts[line_idx]
+        if not self._ascii_lines[line_idx]:
+            _byte_to_col, col_to_byte = self._line_tables(line_idx)
+            col = col_to_byte[col]
+        return (line_idx + 1, col)
+
+
+    def last_pos(self):
+        """ Returns the (line, byte col) position of the end of the document.
+        """
+        return (len(self), self.line_length(len(self)))
@@ -0,0 +1,127 @@
+""" Reads Python source files.
+
+    The file is memory mapped and decoded in one step, using the encoding of its byte order mark
+    or coding cookie (PEP 263), as Python itself does. UTF-8 sources with non-ASCII characters
+    are also kept as bytes so that ast.parse doesn't need to encode the text again.
+
+    IMPORTANT: this module must not import Qt so that it can be used without a display.
+"""
+from __future__ import print_function
+
+import logging, mmap, os, time, tokenize
+
+logger = logging.getLogger(__name__)
+
+
+
+class SourceFile(object):
+    """ The contents of a source file and how they were read.
+    """
+    def __init__(self, file_name, text, encoding, n_bytes, load_seconds=0.0, data=None,
+                 mtime=0.0):
+        """ Constructor
+
+            :param file_name: the name of the file
+            :param text: the decoded source with '\\n' line breaks
+            :param encoding: the encoding of the file (e.g. 'utf-8', 'utf-8-sig', 'iso-8859-1')
+            :param n_bytes: the size of the file
+            :param load_seconds: the duration of reading and decoding the file
+            :param data: the source as UTF-8 bytes, or None. Only set if these equal the
+                contents of the file and differ from the text; that is, if the file is UTF-8
+                without byte order mark, has non-ASCII characters and only '\\n' line breaks.
+            :param mtime: the modification time of the file when it was read.
+        """
+        self.file_name = file_name
+        self.text = text
+        self.encoding = encoding
+        self.n_bytes = n_bytes
+        self.load_seconds = load_seconds
+        self.data = data
+        self.mtime = mtime
+
+
+    def is_modified(self):
+        """ Returns True if the size or modification time of the file has changed since it was
+            read, or if it can't be accessed anymore.
+        """
+        try:
+            stat = os.stat(self.file_name)
+        except OSError:
+            return True
+        return stat.st_size != self.n_bytes or stat.st_mtime != self.mtime
+
+
+    @property
+    def parse_source(self):
+        """ The source in the form that is best passed to ast.parse: the bytes if available,
+            otherwise the text.
+        """
+        return self.text if self.data is None else self.data
+
+
+
+def detect_encoding(buffer):
+    """ Returns the encoding of Python source code from its byte order mark or coding cookie.
+
+        Returns 'utf-8' if there is neither. Only the first two lines are examined.
+
+        :param buffer: bytes or memory map with the source
+        :raises SyntaxError: if the encoding is unknown or conflicts with the byte order mark.
+    """
+    lines = []
+    start = 0
+    for _ in range(2):
+        end = buffer.find(b'\n', start)
+        end = len(buffer) if end < 0 else end + 1
+        lines.append(buffer[start:end])
+        start = end
+    line_iter = iter(lines)
+    encoding, _lines = tokenize.detect_encoding(lambda: next(line_iter, b''))
+    return encoding
+
+
+def decode_source(buffer, encoding=None):
+    """ Decodes Python source code and converts the line breaks to '\\n'.
+
+        :param buffer: bytes or memory map with the source
+        :param encoding: the encoding. Detected with detect_encoding if None.
+    """
+    if encoding is None:
+        encoding = detect_encoding(buffer)
+    text = str(buffer, encoding) # Decodes without copying the buffer into a bytes object
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def read_source_file(file_name):
+    """ Reads and decodes a Python source file.
+
+        :return: SourceFile
+        :raises IOError: if the file can't be read
+        :raises SyntaxError: if the encoding is unknown
+        :raises UnicodeDecodeError: if the file isn't valid in its encoding
+    """
+    start_time = time.time()
+    with open(file_name, 'rb') as source_file:
+        stat = os.fstat(source_file.fileno())
+        n_bytes = stat.st_size
+        # An empty file can't be mapped.
+        buffer = b'' if n_bytes == 0 else \
+            mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            encoding = detect_encoding(buffer)
+            text = decode_source(buffer, encoding)
+            data = None
+            if encoding == 'utf-8' and len(text) != n_bytes and len(buffer) == n_bytes and \
+                    buffer.find(b'\r') < 0:
+                data = buffer[:]
+        finally:
+            if n_bytes != 0:
+                buffer.close()
+
+    load_seconds = time.time() - start_time
+    logger.debug("Read {} ({} bytes, {}) in {:.3f} s"
+                 .format(file_name, n_bytes, encoding, load_seconds))
+    return SourceFile(file_name, text, encoding, n_bytes, load_seconds=load_seconds, data=data,
+                      mtime=stat.st_mtime)
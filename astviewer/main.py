@@ -3,18 +3,42 @@
 """
 from __future__ import print_function
                 
-import sys, logging, ast, traceback
+import logging, os.path, sys
 
 from astviewer.misc import get_qapplication_instance, get_qsettings, ABOUT_MESSAGE
+from astviewer.cache import ParseCache
+from astviewer.diagnostics import DiagnosticsDialog
 from astviewer.editor import SourceEditor
+from astviewer.loader import read_source_file
+from astviewer.nodetable import NO_NODE, NO_VALUE
+from astviewer.profiling import profiler
 from astviewer.qtpy import QtCore, QtWidgets
+from astviewer.querypanel import QueryPanel
+from astviewer.searchbar import SearchBar
+from astviewer.sourceviewer import SourceViewer
+from astviewer.statistics import table_statistics
 from astviewer.version import PROGRAM_NAME, DEBUGGING
 
 from astviewer.tree import SyntaxTreeWidget
+from astviewer.treemodel import SyntaxTreeView
+from astviewer.worker import ParseThread, WorkspaceLoadThread
+from astviewer.workspace import ModuleLRU, WorkspaceModule, DEFAULT_MAX_BYTES
 
 
 logger = logging.getLogger(__name__)
 
+RELOAD_DELAY = 200 # Milliseconds between a file change and the reload. Editors may write in steps.
+
+# Sources that are larger, or have longer lines on average, are shown in the SourceViewer.
+LARGE_SOURCE_SIZE = 8 * 1024 * 1024
+LONG_AVERAGE_LINE_LENGTH = 1000
+
+# The SourceViewer shows UTF-8 bytes, so only files in these encodings are mapped into memory.
+MAPPED_ENCODINGS = ('utf-8', 'utf-8-sig')
+
+# Trees with more nodes are shown in compact mode, unless the user has chosen a mode in the menu.
+COMPACT_TREE_SIZE = 100000
+
 
 def view(*args, **kwargs):
     """ Opens an AstViewer window
@@ -43,7 +67,8 @@ class AstViewer(QtWidgets.QMainWindow):
     """ The main application.
     """
 
-    def __init__(self, file_name = '', source_code = '', mode='exec', reset=False):
+    def __init__(self, file_name = '', source_code = '', mode='exec', reset=False, lazy=False,
+                 use_cache=True, file_names=None, max_workspace_bytes=DEFAULT_MAX_BYTES):
         """ Constructor
             
             AST browser windows that displays the Abstract Syntax Tree
@@ -63,6 +88,16 @@ class AstViewer(QtWidgets.QMainWindow):
             
             If reset is True, the persistent settings (e.g. window size) are
             reset to their default values.
+
+            If lazy is True, the tree is shown in a SyntaxTreeView, which only creates the rows
+            of a node when it is expanded. Use this for large files.
+
+            If use_cache is True, parse results are stored in a persistent cache so that files
+            that have been opened before don't need to be parsed again.
+
+            More files can be opened at once with the file_names parameter. They are read and
+            parsed in parallel and shown in tabs. The parse results of the open files are kept
+            in memory, up to max_workspace_bytes, so that switching between them is fast.
         """
         super(AstViewer, self).__init__()
         
@@ -73,7 +108,29 @@ class AstViewer(QtWidgets.QMainWindow):
         # Models
         self._file_name = '<source>'
         self._source_code = source_code
+        self._source_file = None   # The SourceFile the source code was read from (if any)
         self._mode = mode
+        self._lazy = lazy
+        self._compact_tree = None  # True/False if chosen in the menu, None to depend on the size
+        self._parse_cache = ParseCache() if use_cache else None
+        self._parse_thread = None  # The thread of the current parse job
+        self._parse_threads = []   # All running threads, including cancelled ones
+        self._file_on_disk = ''    # The file that is reloaded when it changes
+
+        self._workspace = ModuleLRU(max_workspace_bytes)
+        self._module = None        # The WorkspaceModule of the current file (if parsed)
+        self._load_threads = []    # The running WorkspaceLoadThreads
+        self._loading_files = set() # Files that are being loaded by a WorkspaceLoadThread
+        self._awaited_file = ''    # The current file if it is being loaded by such a thread
+
+        self._file_watcher = QtCore.QFileSystemWatcher(self)
+        self._file_watcher.fileChanged.connect(self._file_changed)
+        self._file_watcher.directoryChanged.connect(self._directory_changed)
+
+        self._reload_timer = QtCore.QTimer(self)
+        self._reload_timer.setSingleShot(True)
+        self._reload_timer.setInterval(RELOAD_DELAY)
+        self._reload_timer.timeout.connect(self.reload_file)
 
         # Views
         self._setup_views()
@@ -81,13 +138,18 @@ class AstViewer(QtWidgets.QMainWindow):
         self.setWindowTitle('{}'.format(PROGRAM_NAME))
         
         # Update views
-        if file_name and source_code:
-            logger.warning("Both the file_name and source_code are defined: source_code ignored.")
-
+        file_names = list(file_names or [])
         if file_name:
-            self._load_file(file_name)
+            file_names.insert(0, file_name)
 
-        self._update_widgets()
+        if file_names and source_code:
+            logger.warning("Both the file_name and source_code are defined: source_code ignored.")
+
+        if file_names:
+            self._source_code = ''
+            self.open_files(file_names)
+        else:
+            self._update_widgets()
 
         # Read persistent settings
         self._readViewSettings(reset)
@@ -99,7 +161,17 @@ class AstViewer(QtWidgets.QMainWindow):
         """
         file_menu = self.menuBar().addMenu("&File")
         file_menu.addAction("&Open File...", self.open_file, "Ctrl+O")
-        file_menu.addAction("&Close File", self.close_file)
+        file_menu.addAction("&Reload File", self.reload_file, "Ctrl+R")
+        file_menu.addAction("&Close File", self.close_file, "Ctrl+W")
+        file_menu.addAction("Next File", self.next_file, "Ctrl+PgDown")
+        file_menu.addAction("Previous File", self.previous_file, "Ctrl+PgUp")
+
+        self.auto_reload_action = file_menu.addAction("&Auto Reload")
+        self.auto_reload_action.setCheckable(True)
+        self.auto_reload_action.setChecked(True)
+        self.auto_reload_action.toggled.connect(lambda _checked: self._watch_file())
+
+        file_menu.addSeparator()
         file_menu.addAction("E&xit", self.quit_application, "Ctrl+Q")
         
         if DEBUGGING is True:
@@ -108,6 +180,7 @@ class AstViewer(QtWidgets.QMainWindow):
         
         self.view_menu = self.menuBar().addMenu("&View")
         self.view_menu.addAction(self.editorDock.toggleViewAction())
+        self.view_menu.addAction(self.queryDock.toggleViewAction())
 
         self.header_menu = self.view_menu.addMenu("&Tree Columns")
 
@@ -115,13 +188,30 @@ class AstViewer(QtWidgets.QMainWindow):
         for action in self.ast_tree.get_header_context_menu_actions():
             self.header_menu.addAction(action)
 
+        self.compact_tree_action = self.view_menu.addAction("&Compact Tree")
+        self.compact_tree_action.setCheckable(True)
+        self.compact_tree_action.setStatusTip(
+            "Hides the ctx nodes, empty lists and fields that are None. The ctx is shown "
+            "in the row of the parent, e.g. 'targets[0] = Name (Store)'.")
+        self.compact_tree_action.triggered.connect(self.set_compact_tree)
+
         self.expand_menu = self.view_menu.addMenu("&Expand")
         self.expand_menu.addAction('Reset', self.ast_tree.expand_reset, "Ctrl+=")
-        self.expand_menu.addAction('Collapse all', self.ast_tree.collapseAll, "Ctrl+-")
-        self.expand_menu.addAction('Expand all', self.ast_tree.expandAll, "Ctrl++")
+        self.expand_menu.addAction('Collapse all', self.ast_tree.collapse_all, "Ctrl+-")
+        self.expand_menu.addAction('Expand all', self.ast_tree.expand_all, "Ctrl++")
+        self.expand_menu.addAction('Expand to Depth...', self.expand_to_depth)
+        self.expand_menu.addAction('Expand until Rows...', self.expand_to_rows)
+
+        self.view_menu.addSeparator()
+        self.view_menu.addAction("&Find...", self.search_bar.open_bar, "Ctrl+F")
+        self.view_menu.addAction("Find &Next", self.search_bar.find_next, "F3")
+        self.view_menu.addAction("Find &Previous", self.search_bar.find_previous, "Shift+F3")
+        self.view_menu.addAction("&Query...", self.open_query_panel, "Ctrl+Shift+F")
+        self.view_menu.addAction("Show Full &Value...", self.show_full_value)
 
         self.menuBar().addSeparator()
         help_menu = self.menuBar().addMenu("&Help")
+        help_menu.addAction('&Diagnostics...', self.show_diagnostics)
         help_menu.addAction('&About...', self.about)
 
 
@@ -129,21 +219,79 @@ class AstViewer(QtWidgets.QMainWindow):
         """ Creates the UI widgets. 
         """
         self.file_dialog = QtWidgets.QFileDialog(parent=self, caption="Open File")
-        self.file_dialog.setFileMode(QtWidgets.QFileDialog.ExistingFile)
+        self.file_dialog.setFileMode(QtWidgets.QFileDialog.ExistingFiles)
         self.file_dialog.setNameFilter("Python Files (*.py);;All Files (*)")
 
-        self.ast_tree = SyntaxTreeWidget()
-        self.setCentralWidget(self.ast_tree)
+        if self._lazy:
+            self.ast_tree = SyntaxTreeView()
+        else:
+            self.ast_tree = SyntaxTreeWidget()
+
+        self.search_bar = SearchBar()
+        self.search_bar.hide()
+
+        self.file_tabs = QtWidgets.QTabBar()
+        self.file_tabs.setDocumentMode(True)
+        self.file_tabs.setTabsClosable(True)
+        self.file_tabs.setMovable(True)
+        self.file_tabs.setExpanding(False)
+        self.file_tabs.setElideMode(QtCore.Qt.ElideMiddle)
+        self.file_tabs.setUsesScrollButtons(True)
+
+        central_widget = QtWidgets.QWidget()
+        central_layout = QtWidgets.QVBoxLayout(central_widget)
+        central_layout.setContentsMargins(0, 0, 0, 0)
+        central_layout.setSpacing(0)
+        central_layout.addWidget(self.file_tabs)
+        central_layout.addWidget(self.search_bar)
+        central_layout.addWidget(self.ast_tree)
+        self.setCentralWidget(central_widget)
+
+        # The editor is the source_editor, or the source_viewer for large sources.
+        self.source_editor = SourceEditor()
+        self.source_viewer = SourceViewer()
+        self.editor = self.source_editor
+        self.editor_stack = QtWidgets.QStackedWidget()
+        self.editor_stack.addWidget(self.source_editor)
+        self.editor_stack.addWidget(self.source_viewer)
 
-        self.editor = SourceEditor()
         self.editorDock = QtWidgets.QDockWidget("Source code", self)
         self.editorDock.setObjectName("editor_dock") # needed for saveState
-        self.editorDock.setWidget(self.editor)
+        self.editorDock.setWidget(self.editor_stack)
         self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.editorDock)
 
+        self.query_panel = QueryPanel()
+        self.queryDock = QtWidgets.QDockWidget("Query", self)
+        self.queryDock.setObjectName("query_dock") # needed for saveState
+        self.queryDock.setWidget(self.query_panel)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.queryDock)
+        self.queryDock.hide()
+
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setMaximumWidth(200)
+        self.progress_bar.hide()
+        self.statusBar().addPermanentWidget(self.progress_bar)
+
         # Connect signals
-        self.ast_tree.currentItemChanged.connect(self.highlight_node)
-        self.editor.sigTextClicked.connect(self.ast_tree.select_node)
+        self._current_changed_signal().connect(self.highlight_node)
+        self.source_editor.sigTextClicked.connect(self.ast_tree.select_node)
+        self.source_viewer.sigTextClicked.connect(self.ast_tree.select_node)
+        self.search_bar.sigNodeFound.connect(self.ast_tree.set_current_node)
+        self.search_bar.sigClosed.connect(self.ast_tree.setFocus)
+        self.query_panel.sigNodeFound.connect(self.ast_tree.set_current_node)
+        self.ast_tree.expander.sigProgress.connect(self._show_expand_progress)
+        self.ast_tree.expander.sigFinished.connect(self._expand_finished)
+        self.file_tabs.currentChanged.connect(self._current_tab_changed)
+        self.file_tabs.tabCloseRequested.connect(self.close_file_tab)
+
+
+    def _current_changed_signal(self):
+        """ Returns the signal that the tree emits when the current node changes.
+        """
+        if self._lazy:
+            return self.ast_tree.selectionModel().currentChanged
+        else:
+            return self.ast_tree.currentItemChanged
 
 
     def finalize(self):
@@ -151,106 +299,627 @@ class AstViewer(QtWidgets.QMainWindow):
         """
         logger.debug("Cleaning up resources.")
 
-        self.ast_tree.currentItemChanged.disconnect(self.highlight_node)
+        self._cancel_parsing()
+        for thread in list(self._parse_threads):
+            thread.wait()
+        for thread in list(self._load_threads):
+            thread.cancel()
+            thread.wait()
 
+        self._current_changed_signal().disconnect(self.highlight_node)
 
-    def close_file(self):
+
+    def _clear_widgets(self):
         """ Clears the widgets
         """
+        self._cancel_parsing()
+        self._reload_timer.stop()
+        self._file_on_disk = ''
+        self._watch_file()
         self._file_name = ""
         self._source_code = ""
+        self._source_file = None
+        self._module = None
+        self._awaited_file = ''
         self.editor.clear()
         self.ast_tree.clear()
+        self.search_bar.set_index(None)
+        self.query_panel.set_index(None)
         self.setWindowTitle('{}'.format(PROGRAM_NAME))
 
+
+    def close_file(self):
+        """ Closes the current file. The next file of the workspace (if any) becomes current.
+        """
+        index = self.file_tabs.currentIndex()
+        if index < 0:
+            self._clear_widgets()
+        else:
+            self.close_file_tab(index)
+
+
+    def close_file_tab(self, index):
+        """ Closes the file of a tab and removes its module from the workspace.
+        """
+        file_name = self.file_tabs.tabData(index)
+        logger.debug("Closing {!r}".format(file_name))
+        self._workspace.remove(file_name)
+        self._loading_files.discard(file_name)
+        if index == self.file_tabs.currentIndex():
+            self._clear_widgets()
+        self.file_tabs.removeTab(index) # Emits currentChanged if the current tab is removed.
+
+
+    def next_file(self):
+        """ Shows the file of the next tab.
+        """
+        if self.file_tabs.count() > 1:
+            self.file_tabs.setCurrentIndex(
+                (self.file_tabs.currentIndex() + 1) % self.file_tabs.count())
+
+
+    def previous_file(self):
+        """ Shows the file of the previous tab.
+        """
+        if self.file_tabs.count() > 1:
+            self.file_tabs.setCurrentIndex(
+                (self.file_tabs.currentIndex() - 1) % self.file_tabs.count())
+
     
     def open_file(self, file_name=None):
         """ Opens a Python file. Show the open file dialog if file_name is None.
+
+            If the file is already open, its tab becomes current.
         """
         if not file_name:
-            file_name = self._get_file_name_from_dialog()
+            file_names = self._get_file_names_from_dialog()
 
-            if not file_name:
+            if not file_names:
                 logger.debug("Open file canceled.")
                 return # user pressed cancel
 
-        self.close_file() # Close any old file.
-        self._load_file(file_name)
+            self.open_files(file_names)
+            return
 
+        index = self._find_file_tab(file_name)
+        if index >= 0:
+            self._select_file_tab(index)
+            return
+
+        self._save_view_state()
+        if not self._load_file(file_name):
+            return
+
+        self._select_file_tab(self._add_file_tab(file_name), show=False)
         self._update_widgets()
 
 
-    def _get_file_name_from_dialog(self):
-        """ Opens a file dialog and returns the file name selected by the user
+    def open_files(self, file_names):
+        """ Opens several files. The first one becomes the current file.
+
+            The files are read and parsed in parallel in a WorkspaceLoadThread.
+        """
+        file_names = [file_name for idx, file_name in enumerate(file_names)
+                      if file_name not in file_names[:idx]]
+        if len(file_names) == 1:
+            self.open_file(file_names[0])
+            return
+
+        new_file_names = [file_name for file_name in file_names
+                          if self._find_file_tab(file_name) < 0]
+        for file_name in new_file_names:
+            self._add_file_tab(file_name)
+
+        if new_file_names:
+            thread = WorkspaceLoadThread(new_file_names, self._mode, cache=self._parse_cache,
+                                         parent=self)
+            thread.sigModuleLoaded.connect(self._module_loaded)
+            thread.finished.connect(lambda: self._load_thread_finished(thread))
+            self._loading_files.update(new_file_names)
+            self._load_threads.append(thread)
+            thread.start()
+
+        self._select_file_tab(self._find_file_tab(file_names[0]))
+
+
+    def _get_file_names_from_dialog(self):
+        """ Opens a file dialog and returns the file names selected by the user
         """
-        logger.debug("_get_file_name_from_dialog, directory: {}"
+        logger.debug("_get_file_names_from_dialog, directory: {}"
                      .format(self.file_dialog.directory().path()))
 
         self.file_dialog.exec_()
-        files = self.file_dialog.selectedFiles()
+        return self.file_dialog.selectedFiles()
 
-        if len(files) == 0:
-            return None
-        elif len(files) == 1:
-            return files[0]
+
+    def _find_file_tab(self, file_name):
+        """ Returns the index of the tab of a file, or -1 if the file isn't open.
+        """
+        abs_path = os.path.abspath(file_name)
+        for index in range(self.file_tabs.count()):
+            if os.path.abspath(self.file_tabs.tabData(index)) == abs_path:
+                return index
+        return -1
+
+
+    def _add_file_tab(self, file_name):
+        """ Adds a tab for the file without making it current. Returns its index.
+        """
+        self.file_tabs.blockSignals(True) # Adding the first tab makes it current.
+        try:
+            index = self.file_tabs.addTab(os.path.basename(file_name))
+        finally:
+            self.file_tabs.blockSignals(False)
+        self.file_tabs.setTabData(index, file_name)
+        self.file_tabs.setTabToolTip(index, os.path.abspath(file_name))
+        return index
+
+
+    def _select_file_tab(self, index, show=True):
+        """ Makes a tab current and shows its file if show is True.
+        """
+        self.file_tabs.blockSignals(True)
+        try:
+            self.file_tabs.setCurrentIndex(index)
+        finally:
+            self.file_tabs.blockSignals(False)
+        if show:
+            self._show_file(self.file_tabs.tabData(index))
+
+
+    def _current_tab_changed(self, index):
+        """ Shows the file of the tab that has become current.
+        """
+        if index < 0:
+            self._clear_widgets()
+        else:
+            self._show_file(self.file_tabs.tabData(index))
+
+
+    def _show_file(self, file_name):
+        """ Shows a file of the workspace.
+
+            If the parse result of the file is still in the workspace, and the file hasn't been
+            modified since, the tree is populated with it right away. Otherwise the file is read
+            and parsed again, unless a WorkspaceLoadThread is still busy with it.
+        """
+        if self._module is not None and self._module.file_name == file_name:
+            return # Already shown.
+
+        self._save_view_state()
+        module = self._workspace.get(file_name)
+        if module is not None and module.source_file.is_modified():
+            logger.debug("File has been modified since it was parsed: {}".format(file_name))
+            self._workspace.remove(file_name)
+            module = None
+
+        if module is not None:
+            self._show_module(module)
+        elif file_name in self._loading_files:
+            self._clear_widgets()
+            self._awaited_file = file_name
+            self.setWindowTitle('{} - {}'.format(file_name, PROGRAM_NAME))
+            self.statusBar().showMessage("Loading: {}...".format(file_name))
+        elif self._load_file(file_name):
+            self._update_widgets()
+        else:
+            self._clear_widgets()
+
+
+    def _show_module(self, module):
+        """ Shows the source and tree of a workspace module and restores its view state.
+        """
+        self._cancel_parsing()
+        self._reload_timer.stop()
+        self._module = module
+        self._awaited_file = ''
+        self._file_name = module.file_name
+        self._source_file = module.source_file
+        self._source_code = module.source_file.text
+        self._file_on_disk = module.file_name
+        self._watch_file()
+
+        self.setWindowTitle('{} - {}'.format(self._file_name, PROGRAM_NAME))
+        self._set_editor_text(self._source_code)
+        self._populate_tree(module.parsed_module, current_node=module.current_node)
+        self.editor.verticalScrollBar().setValue(module.scroll_pos)
+
+
+    def _save_view_state(self):
+        """ Stores the current node and scroll position in the module of the current file.
+        """
+        module = self._module
+        if module is None or self.ast_tree.table is not module.parsed_module.table:
+            return
+        module.current_node = self.ast_tree.current_node()
+        module.scroll_pos = self.editor.verticalScrollBar().value()
+
+
+    def _module_loaded(self, file_name, module, error):
+        """ Adds a module that a WorkspaceLoadThread has loaded to the workspace.
+
+            The module is shown if its file is the current file.
+        """
+        if file_name not in self._loading_files:
+            return # The file has been closed in the meantime.
+        self._loading_files.discard(file_name)
+
+        if module is None:
+            logger.warning("Unable to load {}: {}".format(file_name, error))
         else:
-            assert False, "Bug: more than one file selected."
+            self._workspace.put(module)
+
+        if file_name == self._awaited_file:
+            self.statusBar().clearMessage()
+            if module is not None:
+                self._show_module(module)
+            elif self._load_file(file_name): # Shows why the file can't be opened or parsed.
+                self._update_widgets()
+
+
+    def _load_thread_finished(self, thread):
+        """ Removes a WorkspaceLoadThread that has finished.
+        """
+        self._load_threads.remove(thread)
+        thread.deleteLater()
+        for file_name in thread.file_names: # Not loaded if the thread was cancelled.
+            self._loading_files.discard(file_name)
 
     
-    def _update_widgets(self):
+    def _update_widgets(self, reload=False):
         """ Updates the tree and editor widgets.
-        """            
+
+            The source is parsed in a background thread. The tree is populated when the thread
+            has finished (see _parse_thread_finished).
+
+            :param reload: if True, the source is a new version of the current file. The tree
+                keeps the items of the unchanged statements and the editor its scroll position.
+        """
         self.setWindowTitle('{} - {}'.format(self._file_name, PROGRAM_NAME))
-        self.editor.setPlainText(self._source_code)
+        scroll_pos = self.editor.verticalScrollBar().value()
+        self._set_editor_text(self._source_code)
+        if reload:
+            self.editor.verticalScrollBar().setValue(scroll_pos)
+
+        self._cancel_parsing()
+        if not reload or not self._source_code:
+            self.ast_tree.clear()
+            self.search_bar.set_index(None)
+            self.query_panel.set_index(None)
 
         if not self._source_code:
             logger.debug("Empty source code, use empty tree.")
-            self.ast_tree.clear()
             return
 
-        try:
-            syntax_tree = ast.parse(self._source_code, filename=self._file_name, mode=self._mode)
-            ast.fix_missing_locations(syntax_tree) # Doesn't seem to do anything.
-        except Exception as ex:
+        source = self._source_code
+        if self._source_file is not None and self._source_file.data is not None:
+            source = self._source_file.data  # Saves ast.parse from encoding the text again.
+            self._source_file.data = None    # The bytes are only needed for parsing.
+
+        thread = ParseThread(source, self._file_name, self._mode,
+                             cache=self._parse_cache, parent=self)
+        thread.sigProgress.connect(
+            lambda phase, percentage: self._show_parse_progress(thread, phase, percentage))
+        thread.finished.connect(lambda: self._parse_thread_finished(thread, reload))
+
+        self._parse_thread = thread
+        self._parse_threads.append(thread)
+        self._show_parse_progress(thread, 'Parsing', -1)
+        thread.start()
+
+
+    @staticmethod
+    def _is_large_source(source_code):
+        """ Returns True if the source should be shown in the SourceViewer instead of the
+            SourceEditor: if it is large or has very long lines (e.g. generated code).
+        """
+        if len(source_code) >= LARGE_SOURCE_SIZE:
+            return True
+        return len(source_code) / (source_code.count('\n') + 1) > LONG_AVERAGE_LINE_LENGTH
+
+
+    def _set_editor_text(self, source_code):
+        """ Shows the source in the source editor, or in the source viewer if it is large.
+
+            The viewer maps the file on disk into memory if the source has been read from it and
+            the file is UTF-8 encoded. Otherwise its columns wouldn't match those of the ast.
+        """
+        editor = self.source_viewer if self._is_large_source(source_code) else self.source_editor
+        if editor is not self.editor:
+            self.editor.clear()
+            self.editor = editor
+            self.editor_stack.setCurrentWidget(editor)
+
+        with profiler.phase('editor: setPlainText', items=len(source_code)):
+            if editor is self.source_viewer and self._file_on_disk and \
+                    self._source_file is not None and \
+                    self._source_file.encoding in MAPPED_ENCODINGS:
+                if not editor.load_file(self._file_on_disk):
+                    editor.setPlainText(source_code)
+            else:
+                editor.setPlainText(source_code)
+
+
+    def _cancel_parsing(self):
+        """ Cancels the parse job that is in progress (if any).
+
+            The thread will stop at its next progress report. Its result is ignored.
+        """
+        if self._parse_thread is not None:
+            logger.debug("Cancelling parsing of: {}".format(self._parse_thread.file_name))
+            self._parse_thread.cancel()
+            self._parse_thread = None
+            self.statusBar().clearMessage()
+            self.progress_bar.hide()
+
+
+    def _show_parse_progress(self, thread, phase, percentage):
+        """ Shows the progress of the parse thread in the status bar.
+
+            :param percentage: percentage done, or -1 if unknown (shows a busy indicator).
+        """
+        if thread is not self._parse_thread:
+            return # Progress of a cancelled thread.
+
+        self.statusBar().showMessage("{}: {}...".format(phase, thread.file_name))
+        if percentage < 0:
+            self.progress_bar.setRange(0, 0)
+        else:
+            self.progress_bar.setRange(0, 100)
+            self.progress_bar.setValue(percentage)
+        self.progress_bar.show()
+
+
+    def _parse_thread_finished(self, thread, reload):
+        """ Populates the tree with the result of the parse thread. Is executed in the GUI thread.
+
+            :param reload: if True, the tree is updated with repopulate().
+        """
+        self._parse_threads.remove(thread)
+        thread.deleteLater()
+
+        if thread is not self._parse_thread:
+            logger.debug("Ignoring result of cancelled parse job: {}".format(thread.file_name))
+            return
+
+        self._parse_thread = None
+        self.statusBar().clearMessage()
+        self.progress_bar.hide()
+
+        if thread.error is not None:
             if DEBUGGING:
-                raise
+                raise thread.error
+            elif reload:
+                # Don't interrupt the user with a dialog while they are editing the file.
+                msg = "Unable to parse file: {}: {}".format(thread.file_name, thread.error)
+                logger.warning(msg)
+                self.statusBar().showMessage(msg)
             else:
-                stack_trace = traceback.format_exc()
                 msg = "Unable to parse file: {}\n\n{}\n\n{}" \
-                    .format(self._file_name, ex, stack_trace)
-                logger.exception(ex)
+                    .format(thread.file_name, thread.error, thread.stack_trace)
+                logger.error(msg)
                 QtWidgets.QMessageBox.warning(self, 'error', msg)
+        elif reload:
+            parsed_module = thread.parsed_module
+            root_item = self.ast_tree.repopulate(parsed_module.table,
+                                                 span_index=parsed_module.span_index)
+            if self._lazy:
+                current_item = self.ast_tree.currentIndex()
+                if not current_item.isValid():
+                    current_item = root_item
+                    self.ast_tree.setCurrentIndex(root_item)
+            else:
+                current_item = self.ast_tree.currentItem()
+                if current_item is None:
+                    current_item = root_item
+                    self.ast_tree.setCurrentItem(root_item)
+
+            # The position of the current node may have changed.
+            self.highlight_node(current_item, None)
+            self.search_bar.set_index(parsed_module.search_index)
+            self.query_panel.set_index(parsed_module.query_index)
+            self._add_to_workspace(parsed_module)
+        else:
+            self._populate_tree(thread.parsed_module)
+            self._add_to_workspace(thread.parsed_module)
+
+
+    def _populate_tree(self, parsed_module, current_node=NO_NODE):
+        """ Populates the tree with a parsed module and makes current_node, or the root node if
+            it is NO_NODE, the current node.
+        """
+        self._show_table(parsed_module.table, parsed_module.span_index, current_node=current_node)
+        self.search_bar.set_index(parsed_module.search_index)
+        self.query_panel.set_index(parsed_module.query_index)
+
+
+    def _show_table(self, table, span_index, current_node=NO_NODE):
+        """ Populates the tree with a node table, in compact mode if the table is large or the
+            user has chosen so.
+        """
+        compact = len(table) >= COMPACT_TREE_SIZE if self._compact_tree is None \
+            else self._compact_tree
+        self.compact_tree_action.setChecked(compact)
+        self.ast_tree.compact = compact
+
+        root_item = self.ast_tree.populate(table, span_index=span_index)
+        if self._lazy:
+            self.ast_tree.setCurrentIndex(root_item)
         else:
-            last_pos = self.editor.get_last_pos()
-            root_item = self.ast_tree.populate(syntax_tree, last_pos, root_label=self._file_name)
             self.ast_tree.setCurrentItem(root_item)
-            self.ast_tree.expand_reset()
+        self.ast_tree.expand_reset()
+        if current_node != NO_NODE:
+            self.ast_tree.set_current_node(current_node)
+
+
+    def set_compact_tree(self, compact):
+        """ Shows the tree in compact or full mode, also for the files that are opened later.
+        """
+        self._compact_tree = compact
+        table = self.ast_tree.table
+        if table is not None and self.ast_tree.compact != compact:
+            self._show_table(table, self.ast_tree.span_index,
+                             current_node=self.ast_tree.current_node())
+
+
+    def _add_to_workspace(self, parsed_module):
+        """ Stores the parse result of the current file in the workspace.
+        """
+        if self._source_file is None or not self._file_on_disk:
+            return # Source code that wasn't read from a file.
+        self._module = WorkspaceModule(self._source_file, parsed_module)
+        self._workspace.put(self._module)
 
                 
     def _load_file(self, file_name):
-        """ Opens a file and sets self._file_name and self._source code if successful
+        """ Opens a file and sets self._file_name and self._source code if successful.
+
+            Returns True if successful.
         """
         logger.debug("Opening {!r}".format(file_name))
-        
-        in_file = QtCore.QFile(file_name)
-        if in_file.open(QtCore.QFile.ReadOnly | QtCore.QFile.Text):
-            text = in_file.readAll()
-            try:
-                source_code = str(text, encoding='utf-8')  # Python 3
-            except TypeError:
-                source_code = str(text)                    # Python 2
-                
-            self._file_name = file_name
-            self._source_code = source_code
-        else:
-            msg = "Unable to open file: {}".format(file_name)
+
+        try:
+            source_file = self._read_file(file_name)
+        except (IOError, OSError, SyntaxError, UnicodeError) as ex:
+            msg = "Unable to open file: {}\n\n{}".format(file_name, ex)
             logger.warning(msg)
             QtWidgets.QMessageBox.warning(self, 'error', msg)
+            return False
+
+        self._file_name = file_name
+        self._source_file = source_file
+        self._source_code = source_file.text
+        self._file_on_disk = file_name
+        self._module = None
+        self._awaited_file = ''
+        self._watch_file()
+        return True
+
+
+    @staticmethod
+    def _read_file(file_name):
+        """ Reads and decodes a file. Returns a SourceFile.
+
+            The encoding is detected from the byte order mark or coding cookie (PEP 263).
+        """
+        with profiler.phase('load file', items=os.path.getsize(file_name)):
+            return read_source_file(file_name)
+
+
+    def reload_file(self):
+        """ Reads the current file again and updates the widgets if it has changed.
+
+            Only the tree items of the top-level statements that have changed are rebuilt.
+        """
+        if not self._file_on_disk:
+            return
+
+        self._watch_file() # Re-add the file in case it was replaced (which stops the watching).
+        try:
+            source_file = self._read_file(self._file_on_disk)
+        except (IOError, OSError, SyntaxError, UnicodeError) as ex:
+            logger.debug("Unable to reload {}: {}".format(self._file_on_disk, ex))
+            return
+
+        if source_file.text == self._source_code:
+            logger.debug("File has not changed: {}".format(self._file_on_disk))
+            return
+
+        logger.debug("Reloading: {}".format(self._file_on_disk))
+        self._source_file = source_file
+        self._source_code = source_file.text
+        self._update_widgets(reload=True)
+
+
+    def _watch_file(self):
+        """ Updates the paths of the file watcher.
+
+            The directory of the file is watched as well. Many editors save a file by writing a
+            new file and renaming it, after which the watcher no longer watches the file.
+        """
+        paths = []
+        if self._file_on_disk and self.auto_reload_action.isChecked():
+            abs_path = os.path.abspath(self._file_on_disk)
+            paths = [path for path in (abs_path, os.path.dirname(abs_path))
+                     if os.path.exists(path)]
+
+        watched_paths = self._file_watcher.files() + self._file_watcher.directories()
+        if sorted(watched_paths) == sorted(paths):
+            return
+
+        if watched_paths:
+            self._file_watcher.removePaths(watched_paths)
+        if paths:
+            self._file_watcher.addPaths(paths)
+
+
+    def _file_changed(self, _path):
+        """ Called when the watched file has changed. Schedules a reload.
+        """
+        if self.editor is self.source_viewer and self.source_viewer.is_truncated():
+            # Reading a memory map beyond the end of a truncated file crashes the program.
+            self.source_viewer.clear()
+        self._reload_timer.start()
+
+
+    def _directory_changed(self, _path):
+        """ Called when the directory of the watched file has changed.
+
+            Schedules a reload if the file has been (re)created.
+        """
+        abs_path = os.path.abspath(self._file_on_disk) if self._file_on_disk else ''
+        if abs_path and abs_path not in self._file_watcher.files() and os.path.exists(abs_path):
+            self._reload_timer.start()
+
+
+    def open_query_panel(self):
+        """ Shows the query panel and gives the keyboard focus to the query box.
+        """
+        self.queryDock.show()
+        self.queryDock.raise_()
+        self.query_panel.open_panel()
+
+
+    def expand_to_depth(self):
+        """ Asks for a depth and expands the tree so that the nodes up to that depth are visible.
+        """
+        depth, ok = QtWidgets.QInputDialog.getInt(
+            self, "Expand to Depth", "Number of levels below the root:", value=3, min=1)
+        if ok:
+            self.ast_tree.expand_to_depth(depth)
+
+
+    def expand_to_rows(self):
+        """ Asks for a number of rows and expands the tree breadth-first until it has that many
+            visible rows.
+        """
+        n_rows, ok = QtWidgets.QInputDialog.getInt(
+            self, "Expand until Rows", "Maximum number of visible rows:", value=1000, min=1)
+        if ok:
+            self.ast_tree.expand_to_rows(n_rows)
+
+
+    def _show_expand_progress(self, n_expanded):
+        """ Shows the number of expanded nodes while the tree expander runs.
+        """
+        self.statusBar().showMessage("Expanding: {} nodes (press Esc to cancel)..."
+                                     .format(n_expanded))
+
+
+    def _expand_finished(self, completed):
+        """ Removes the progress message of the tree expander.
+        """
+        if completed:
+            if self.statusBar().currentMessage().startswith("Expanding"):
+                self.statusBar().clearMessage()
+        else:
+            self.statusBar().showMessage("Expanding cancelled.", 3000)
 
 
-    @QtCore.Slot(QtWidgets.QTreeWidgetItem, QtWidgets.QTreeWidgetItem)
     def highlight_node(self, current_item, _previous_item):
         """ Highlights the node if it has line:col information.
+
+            The items are QTreeWidgetItems, or QModelIndexes if the lazy tree view is used.
         """
         from_pos = to_pos = (0, 0) # unselect
 
@@ -263,7 +932,8 @@ class AstViewer(QtWidgets.QMainWindow):
         if from_pos is None or to_pos is None:
             pass # unselecting text
         else:
-            self.editor.select_text(from_pos, to_pos)
+            with profiler.phase('editor: select_text'):
+                self.editor.select_text(from_pos, to_pos)
 
 
     def _readViewSettings(self, reset):
@@ -351,6 +1021,49 @@ class AstViewer(QtWidgets.QMainWindow):
 
 
 
+    def diagnostics_text(self):
+        """ Returns a text with the program versions, the statistics of the current node table
+            and the profiling summary.
+        """
+        lines = [ABOUT_MESSAGE, '', "File: {}".format(self._file_name)]
+        source_file = self._source_file
+        if source_file is not None:
+            lines.append("Encoding: {}".format(source_file.encoding))
+            lines.append("Size: {} bytes, {} characters".format(source_file.n_bytes,
+                                                              len(self._source_code)))
+            lines.append("Load time: {:.3f} s".format(source_file.load_seconds))
+        lines.append("Workspace: {} modules, {} of {} bytes".format(
+            len(self._workspace), self._workspace.n_bytes, self._workspace.max_bytes))
+        table = self.ast_tree.table
+        if table is not None:
+            for key, value in table_statistics(table).items():
+                lines.append("{:<32s} {:>10d}".format(key, value))
+        lines.append('')
+        lines.append(profiler.summary())
+        return "\n".join(lines)
+
+
+    def show_full_value(self):
+        """ Shows the complete value of the current node. The tree cuts off long values.
+        """
+        table = self.ast_tree.table
+        node_idx = self.ast_tree.current_node()
+        if table is None or node_idx == NO_NODE or table.value_idx[node_idx] == NO_VALUE:
+            self.statusBar().showMessage("The current node has no value.", 3000)
+            return
+
+        dialog = DiagnosticsDialog(lambda: table.value_str(node_idx), parent=self,
+                                   title=table.field_label(node_idx))
+        dialog.exec_()
+
+
+    def show_diagnostics(self):
+        """ Shows the diagnostics dialog.
+        """
+        dialog = DiagnosticsDialog(self.diagnostics_text, parent=self)
+        dialog.exec_()
+
+
     def about(self):
         """ Shows the about message window.
         """
@@ -0,0 +1,636 @@
+""" Contains the node table: a compact, Qt-free representation of a parsed module.
+
+    Every AST node, list and primitive value of the syntax tree becomes a row in the table. The
+    columns are stored in arrays of C integers so that a node takes a few dozen bytes instead of
+    the hundreds of bytes of a QTreeWidgetItem. The children of a node are stored contiguously,
+    so that the child at row r of node i is simply: first_child[i] + r.
+
+    IMPORTANT: this module must not import Qt so that it can be used without a display.
+"""
+from __future__ import print_function
+
+import ast, logging, sys
+
+from array import array
+
+from astviewer.profiling import profiler
+
+logger = logging.getLogger(__name__)
+
+NO_NODE = -1    # Used in the parent, first_child and next_sibling columns
+NO_FIELD = -1   # Field id of the root node
+NO_VALUE = -1   # Value index of AST nodes and lists
+NO_POS = -1     # Used in the position and span columns for undefined positions
+
+KIND_AST, KIND_LIST, KIND_PRIMITIVE = range(3)
+
+INT_TYPE_CODE = 'i'
+
+# Since Python 3.8 the AST nodes have end_lineno and end_col_offset attributes.
+HAS_END_POSITIONS = sys.version_info >= (3, 8)
+
+PROGRESS_INTERVAL = 10000 # Number of nodes between calls to the progress function
+
+
+def cmpIdx(idx0, idx1):
+    """ Returns negative if idx0 < idx1, zero if idx0 == idx1 and strictly positive if idx0 > idx1.
+
+        If an idx0 or idx1 equals -1 or None, it is interpreted as the last element in a list
+        and thus larger than a positive integer
+
+        :param idx0: positive int, -1 or None
+        :param idx2: positive int, -1 or None
+        :return: int
+    """
+    assert idx0 is None or idx0 == -1 or idx0 >=0, \
+        "Idx0 should be None, -1 or >= 0. Got: {!r}".format(idx0)
+    assert idx1 is None or idx1 == -1 or idx1 >=0, \
+        "Idx1 should be None, -1 or >= 0. Got: {!r}".format(idx1)
+
+    # Handle -1 the same way as None
+    if idx0 == -1:
+        idx0 = None
+    if idx1 == -1:
+        idx1 = None
+
+    if idx0 == idx1:
+        return 0
+    elif idx1 is None:
+        return -1
+    elif idx0 is None:
+        return 1
+    else:
+        return -1 if idx0 < idx1 else 1
+
+
+def cmpPos(pos0, pos1):
+    """ Returns negative if pos0 < pos1, zero if pos0 == pos1 and strictly positive if pos0 > pos1.
+
+        If an index equals -1 or None, it is interpreted as the last element in a list and
+        therefore larger than a positive integer
+
+        :param pos0: positive int, -1 or None
+        :param pos2: positive int, -1 or None
+        :return: int
+    """
+    cmpLineNr = cmpIdx(pos0[0], pos1[0])
+    if cmpLineNr != 0:
+        return cmpLineNr
+    else:
+        return cmpIdx(pos0[1], pos1[1])
+
+
+def value_repr(value, max_length=None):
+    """ Returns the repr of a primitive value.
+
+        :param max_length: if not None, longer reprs are cut off and end with '...'. Long strings
+            are cut off before they are converted, so that no huge repr is made.
+    """
+    if max_length is not None and isinstance(value, (str, bytes)) and len(value) > max_length:
+        return repr(value[:max_length]) + '...'
+    try:
+        text = repr(value)
+    except ValueError:
+        # Integers with more digits than sys.get_int_max_str_digits() can't be converted.
+        text = hex(value)
+    if max_length is not None and len(text) > max_length:
+        return text[:max_length] + '...'
+    return text
+
+
+def _int_array(size=0, fill=0):
+    """ Returns an integer array of a given size, filled with the fill value.
+    """
+    return array(INT_TYPE_CODE, [fill]) * size
+
+
+
+class NodeTable(object):
+    """ Array-backed table that holds the nodes of a syntax tree.
+
+        The nodes are numbered in breadth-first order, the root node has index 0. Nodes are
+        referred to by their index; the columns are arrays that are indexed by it.
+    """
+    COLUMNS = ('parent', 'first_child', 'child_count', 'next_sibling', 'class_id', 'field_id',
+               'value_idx', 'line', 'col', 'start_line', 'start_col', 'end_line', 'end_col')
+
+    def __init__(self, root_label='', last_pos=(1, 0), exact_spans=HAS_END_POSITIONS):
+        """ Constructor. Creates an empty table. Use build_node_table to fill it.
+
+            :param root_label: the label of the root node (e.g. the file name)
+            :param last_pos: (line, col) tuple of the last character in the source
+            :param exact_spans: if True, the spans are taken from the end positions of the nodes.
+        """
+        self.root_label = root_label
+        self.last_pos = tuple(last_pos)
+        self.exact_spans = exact_spans
+
+        for column in self.COLUMNS:
+            setattr(self, column, _int_array())
+
+        self.class_names = []   # class_id -> class name
+        self.class_kinds = []   # class_id -> KIND_AST, KIND_LIST or KIND_PRIMITIVE
+        self.field_names = []   # field_id -> field name
+        self.values = []        # value_idx -> primitive value
+
+        self._class_ids = {}
+        self._field_ids = {}
+
+
+    def __len__(self):
+        """ Returns the number of nodes in the table.
+        """
+        return len(self.parent)
+
+
+    def nbytes(self):
+        """ Returns the (approximate) number of bytes used by the columns of the table.
+        """
+        return sum(len(col) * col.itemsize for col in (getattr(self, c) for c in self.COLUMNS))
+
+
+    def get_state(self):
+        """ Returns the contents of the table as a dictionary of built-in types.
+
+            The result can be serialized with marshal. Use NodeTable.from_state to restore it.
+        """
+        state = dict((column, getattr(self, column).tobytes()) for column in self.COLUMNS)
+        state.update({
+            'int_type_code': INT_TYPE_CODE,
+            'root_label': self.root_label,
+            'last_pos': self.last_pos,
+            'exact_spans': self.exact_spans,
+            'class_names': self.class_names,
+            'class_kinds': self.class_kinds,
+            'field_names': self.field_names,
+            'values': self.values})
+        return state
+
+
+    @classmethod
+    def from_state(cls, state):
+        """ Creates a table from the result of get_state.
+        """
+        if state['int_type_code'] != INT_TYPE_CODE:
+            raise ValueError("Unexpected type code: {!r}".format(state['int_type_code']))
+
+        table = cls(root_label=state['root_label'], last_pos=state['last_pos'],
+                    exact_spans=state['exact_spans'])
+        for column in cls.COLUMNS:
+            getattr(table, column).frombytes(state[column])
+
+        table.class_names = list(state['class_names'])
+        table.class_kinds = list(state['class_kinds'])
+        table.field_names = list(state['field_names'])
+        table.values = list(state['values'])
+        table._field_ids = dict((name, idx) for idx, name in enumerate(table.field_names))
+        return table
+
+
+    def _get_class_id(self, obj):
+        """ Returns the class id of an object. Registers the class if it's new.
+        """
+        cls = type(obj)
+        try:
+            return self._class_ids[cls]
+        except KeyError:
+            if issubclass(cls, ast.AST):
+                kind = KIND_AST
+            elif issubclass(cls, (list, tuple)):
+                kind = KIND_LIST
+            else:
+                kind = KIND_PRIMITIVE
+            class_id = len(self.class_names)
+            self.class_names.append(cls.__name__)
+            self.class_kinds.append(kind)
+            self._class_ids[cls] = class_id
+            return class_id
+
+
+    def _get_field_id(self, field_name):
+        """ Returns the id of a field name. Registers the field if it's new.
+        """
+        try:
+            return self._field_ids[field_name]
+        except KeyError:
+            field_id = len(self.field_names)
+            self.field_names.append(field_name)
+            self._field_ids[field_name] = field_id
+            return field_id
+
+
+    def _append_node(self, obj, parent_idx, field_id):
+        """ Appends a node for a Python object to the table. Its children are not added.
+
+            :return: the index of the new node
+        """
+        idx = len(self.parent)
+        class_id = self._get_class_id(obj)
+        self.parent.append(parent_idx)
+        self.first_child.append(NO_NODE)
+        self.child_count.append(0)
+        self.next_sibling.append(NO_NODE)
+        self.class_id.append(class_id)
+        self.field_id.append(field_id)
+
+        if self.class_kinds[class_id] == KIND_PRIMITIVE:
+            self.value_idx.append(len(self.values))
+            self.values.append(obj)
+        else:
+            self.value_idx.append(NO_VALUE)
+
+        line = getattr(obj, 'lineno', None)
+        if line is None:
+            self.line.append(NO_POS)
+            self.col.append(NO_POS)
+        else:
+            self.line.append(line)
+            self.col.append(obj.col_offset)
+
+        end_line = getattr(obj, 'end_lineno', None) if self.exact_spans else None
+        if line is None or end_line is None:
+            self.start_line.append(NO_POS)
+            self.start_col.append(NO_POS)
+            self.end_line.append(NO_POS)
+            self.end_col.append(NO_POS)
+        else:
+            self.start_line.append(line)
+            self.start_col.append(obj.col_offset)
+            self.end_line.append(end_line)
+            self.end_col.append(obj.end_col_offset)
+        return idx
+
+
+    ##################
+    # Node structure #
+    ##################
+
+    def kind(self, idx):
+        """ Returns KIND_AST, KIND_LIST or KIND_PRIMITIVE
+        """
+        return self.class_kinds[self.class_id[idx]]
+
+
+    def children(self, idx):
+        """ Returns the range of node indices of the children of node idx.
+        """
+        first = self.first_child[idx]
+        return range(first, first + self.child_count[idx])
+
+
+    def row(self, idx):
+        """ Returns the row of the node within its parent.
+        """
+        parent_idx = self.parent[idx]
+        if parent_idx == NO_NODE:
+            return 0
+        return idx - self.first_child[parent_idx]
+
+
+    def depth(self, idx):
+        """ Returns the number of ancestors of the node. The root node has depth 0.
+        """
+        depth = 0
+        idx = self.parent[idx]
+        while idx != NO_NODE:
+            depth += 1
+            idx = self.parent[idx]
+        return depth
+
+
+    def value(self, idx):
+        """ Returns the primitive value of a node. Returns None for AST nodes and lists.
+        """
+        value_idx = self.value_idx[idx]
+        return None if value_idx == NO_VALUE else self.values[value_idx]
+
+
+    def pos(self, idx):
+        """ Returns the (line, col) position of the node or None if it has no position.
+        """
+        line = self.line[idx]
+        return None if line == NO_POS else (line, self.col[idx])
+
+
+    def span(self, idx):
+        """ Returns the (start_pos, end_pos) highlight span of the node.
+
+            start_pos and end_pos are (line, col) tuples or None if undefined.
+        """
+        start_line, end_line = self.start_line[idx], self.end_line[idx]
+        start_pos = None if start_line == NO_POS else (start_line, self.start_col[idx])
+        end_pos = None if end_line == NO_POS else (end_line, self.end_col[idx])
+        return (start_pos, end_pos)
+
+
+    ##############
+    # Node texts #
+    ##############
+
+    def class_name(self, idx):
+        """ Returns the class name of the node.
+        """
+        return self.class_names[self.class_id[idx]]
+
+
+    def field_label(self, idx):
+        """ Returns the label of how this node is known to the parent (e.g. 'body[3]').
+        """
+        # The elements of (nested) lists are labeled with their rows, e.g. 'elts[2][0]'.
+        rows = []
+        parent_idx = self.parent[idx]
+        while parent_idx != NO_NODE and self.kind(parent_idx) == KIND_LIST:
+            rows.append(self.row(idx))
+            idx = parent_idx
+            parent_idx = self.parent[idx]
+
+        label = self.root_label if parent_idx == NO_NODE else self.field_names[self.field_id[idx]]
+        return label + ''.join("[{:d}]".format(row) for row in reversed(rows))
+
+
+    def value_str(self, idx, max_length=None):
+        """ Returns the repr of primitive values. Returns an empty string for AST nodes and lists.
+
+            :param max_length: if not None, longer reprs are cut off. See value_repr.
+        """
+        value_idx = self.value_idx[idx]
+        return '' if value_idx == NO_VALUE else value_repr(self.values[value_idx], max_length)
+
+
+    def node_str(self, idx, max_length=None):
+        """ Returns the text of the Node column (e.g. 'body[3] = Assign' or 'id = 'x'')
+
+            :param max_length: if not None, longer values are cut off. See value_repr.
+        """
+        if self.value_idx[idx] == NO_VALUE:
+            return "{} = {}".format(self.field_label(idx), self.class_name(idx))
+        else:
+            return "{} = {}".format(self.field_label(idx), self.value_str(idx, max_length))
+
+
+    def pos_str(self, idx):
+        """ Returns the text of the Line : Col column.
+        """
+        line = self.line[idx]
+        return "" if line == NO_POS else "{}:{}".format(line, self.col[idx])
+
+
+    def span_str(self, idx):
+        """ Returns the text of the Highlight column.
+        """
+        start_pos, end_pos = self.span(idx)
+        text = ""
+        if start_pos is not None:
+            text += "{0[0]}:{0[1]}".format(start_pos)
+        if end_pos is not None:
+            text += " : {0[0]}:{0[1]}".format(end_pos)
+        return text
+
+
+
+#############
+# Traversal #
+#############
+
+# The walks over the tree use an explicit stack instead of recursion, so that they work for any
+# nesting depth and don't have the overhead of a Python call per node.
+
+def iter_preorder(table, top_idx=0):
+    """ Yields the node indices of a subtree in depth-first pre-order (parents before children).
+    """
+    if len(table) == 0:
+        return
+    first_child, child_count = table.first_child, table.child_count
+    stack = [top_idx]
+    while stack:
+        idx = stack.pop()
+        yield idx
+        first = first_child[idx]
+        stack.extend(range(first + child_count[idx] - 1, first - 1, -1))
+
+
+def iter_preorder_with_depth(table, top_idx=0):
+    """ Yields (node_idx, depth) tuples of a subtree in depth-first pre-order.
+
+        The depth is relative to the top node, which has depth 0.
+    """
+    if len(table) == 0:
+        return
+    first_child, child_count = table.first_child, table.child_count
+    stack = [(top_idx, 0)]
+    while stack:
+        idx, depth = stack.pop()
+        yield idx, depth
+        first = first_child[idx]
+        stack.extend((child_idx, depth + 1)
+                     for child_idx in range(first + child_count[idx] - 1, first - 1, -1))
+
+
+def iter_postorder(table, top_idx=0):
+    """ Yields the node indices of a subtree in depth-first post-order (children before parents).
+    """
+    if len(table) == 0:
+        return
+    first_child, child_count = table.first_child, table.child_count
+    stack = [(top_idx, False)]
+    while stack:
+        idx, children_done = stack.pop()
+        if children_done:
+            yield idx
+        else:
+            stack.append((idx, True))
+            first = first_child[idx]
+            stack.extend((child_idx, False)
+                         for child_idx in range(first + child_count[idx] - 1, first - 1, -1))
+
+
+def depth_limit(table, max_depth):
+    """ Returns the index of the first node that is more than max_depth levels below the root.
+
+        Because the nodes are stored breadth-first, the depth never decreases with the node index,
+        so the nodes up to max_depth levels deep are exactly the nodes with a lower index.
+        Returns len(table) if no node is deeper than that.
+    """
+    n_nodes = len(table)
+    if n_nodes == 0 or table.depth(n_nodes - 1) <= max_depth:
+        return n_nodes
+
+    first_child, child_count = table.first_child, table.child_count
+    level_end = 1 # One past the last node of the current level
+    for _ in range(max_depth):
+        # The next level ends with the last child of the last node of this level that has children.
+        idx = level_end - 1
+        while child_count[idx] == 0:
+            idx -= 1
+        level_end = first_child[idx] + child_count[idx]
+    return level_end
+
+
+
+def build_node_table(syntax_tree, last_pos, root_label='', exact_spans=HAS_END_POSITIONS,
+                     progress=None):
+    """ Builds a node table from a syntax tree and computes the highlight spans.
+
+        If exact_spans is True, the spans of the nodes that have a position are taken from their
+        end_lineno and end_col_offset attributes while the table is built. Otherwise they are
+        estimated from the position of the next node (see _compute_heuristic_spans), which is
+        only needed for Python versions before 3.8.
+
+        :param syntax_tree: result of the ast.parse() function
+        :param last_pos: (line, col) tuple of the last character in the source
+        :param root_label: used to set the label of the root node
+        :param exact_spans: use the end positions of the nodes to determine the spans.
+        :param progress: optional function that is called as progress(n_done, n_found) every
+            PROGRESS_INTERVAL nodes. It may raise an exception to abort the build.
+        :return: NodeTable
+    """
+    table = NodeTable(root_label=root_label, last_pos=last_pos, exact_spans=exact_spans)
+
+    # Nodes are appended in breadth-first order. All children of a node are appended when the
+    # node is processed, so that they are stored contiguously.
+    objects = [syntax_tree]
+    table._append_node(syntax_tree, NO_NODE, NO_FIELD)
+
+    idx = 0
+    while idx < len(objects):
+        obj = objects[idx]
+        if isinstance(obj, ast.AST):
+            children = [(table._get_field_id(key), val) for key, val in ast.iter_fields(obj)]
+        elif isinstance(obj, (list, tuple)):
+            field_id = table.field_id[idx]
+            children = [(field_id, elem) for elem in obj]
+        else:
+            children = []
+
+        if children:
+            first_child = len(objects)
+            table.first_child[idx] = first_child
+            table.child_count[idx] = len(children)
+            for field_id, child in children:
+                table._append_node(child, idx, field_id)
+                objects.append(child)
+            for child_idx in range(first_child, first_child + len(children) - 1):
+                table.next_sibling[child_idx] = child_idx + 1
+
+        objects[idx] = None # Release the reference, the table holds what's needed.
+        idx += 1
+
+        if progress is not None and idx % PROGRESS_INTERVAL == 0:
+            progress(idx, len(objects))
+
+    if exact_spans:
+        with profiler.phase('spans: merge children', items=len(table)):
+            _merge_spans_of_children(table)
+    else:
+        with profiler.phase('spans: heuristic', items=len(table)):
+            _compute_heuristic_spans(table)
+    with profiler.phase('spans: inherit from parents', items=len(table)):
+        _inherit_spans_of_parents(table)
+    return table
+
+
+def _merge_spans_of_children(table):
+    """ Sets the span of nodes that have no position (e.g. lists) to the union of the spans of
+        their children.
+    """
+    start_line, start_col = table.start_line, table.start_col
+    end_line, end_col = table.end_line, table.end_col
+    parent = table.parent
+    has_own_span = bytearray(line != NO_POS for line in start_line)
+
+    # Since the nodes are stored in breadth-first order, walking backwards visits the children
+    # before their parent.
+    for idx in range(len(table) - 1, 0, -1):
+        parent_idx = parent[idx]
+        if start_line[idx] == NO_POS or has_own_span[parent_idx]:
+            continue
+
+        if (start_line[parent_idx] == NO_POS or
+                (start_line[idx], start_col[idx]) < (start_line[parent_idx], start_col[parent_idx])):
+            start_line[parent_idx] = start_line[idx]
+            start_col[parent_idx] = start_col[idx]
+
+        if (end_line[parent_idx] == NO_POS or
+                (end_line[idx], end_col[idx]) > (end_line[parent_idx], end_col[parent_idx])):
+            end_line[parent_idx] = end_line[idx]
+            end_col[parent_idx] = end_col[idx]
+
+
+def _inherit_spans_of_parents(table):
+    """ Fills in the nodes that don't have a span with the span from their parent.
+    """
+    # Since the nodes are stored in breadth-first order, the parent has been filled in before its
+    # children.
+    start_line, start_col = table.start_line, table.start_col
+    end_line, end_col, parent = table.end_line, table.end_col, table.parent
+    for idx in range(1, len(table)):
+        if start_line[idx] == NO_POS and end_line[idx] == NO_POS:
+            parent_idx = parent[idx]
+            start_line[idx] = start_line[parent_idx]
+            start_col[idx] = start_col[parent_idx]
+            end_line[idx] = end_line[parent_idx]
+            end_col[idx] = end_col[parent_idx]
+
+
+def _compute_heuristic_spans(table):
+    """ Estimates the spans of the nodes that have a position for when the end positions are
+        not available.
+
+        Nodes that have a position get the span from their position to the position of the
+        next node. This is not always correct since the nodes are not always in increasing
+        order when traversing the tree.
+    """
+    if len(table) == 0:
+        return
+
+    decorator_list_id = table._field_ids.get('decorator_list', NO_FIELD)
+    first_child = table.first_child
+
+    # Walk depth-first and backwards through the nodes, so that we can keep track of the end of
+    # the span (last_pos). Every frame on the stack is a list of: the node index, the last_pos
+    # when the node was entered (the end of its span), the current last_pos, whether the node
+    # is a decorator list and the index of the next child to visit.
+    #
+    # Decorator nodes seem to be out-of order in the tree. They occur after the body but their
+    # line number is smaller. This messes up the highlight spans so we don't propagate their
+    # value.
+    def new_frame(idx, last_pos):
+        """ Returns the stack frame of a node that is entered with last_pos.
+        """
+        is_decorator_list = (table.field_id[idx] == decorator_list_id and
+                             table.kind(idx) == KIND_LIST)
+        return [idx, last_pos, last_pos, is_decorator_list,
+                first_child[idx] + table.child_count[idx] - 1]
+
+    stack = [new_frame(0, table.last_pos)]
+    children_last_pos = None # The last_pos of the child that has just been done.
+    while stack:
+        frame = stack[-1]
+        idx, max_last_pos, last_pos, is_decorator_list, next_child = frame
+        if children_last_pos is not None:
+            if not is_decorator_list:
+                frame[2] = last_pos = children_last_pos
+            children_last_pos = None
+
+        if next_child >= first_child[idx] and next_child != NO_NODE:
+            frame[4] = next_child - 1
+            stack.append(new_frame(next_child, last_pos))
+            continue
+
+        stack.pop()
+        line = table.line[idx]
+        if line != NO_POS:
+            last_pos = (line, table.col[idx])
+
+        cmp = cmpPos(last_pos, max_last_pos)
+        if cmp != 0:
+            if cmp > 0:
+                # The node positions (line-nr, col) are not always in increasing order when
+                # traversing the tree. This may result in spans where start pos > end pos.
+                logger.info("Nodes out of order. Invalid highlighting {}:{} : {}:{} ({})"
+                            .format(last_pos[0], last_pos[1], max_last_pos[0], max_last_pos[1],
+                                    table.node_str(idx)))
+            table.start_line[idx], table.start_col[idx] = last_pos
+            table.end_line[idx], table.end_col[idx] = max_last_pos
+
+        children_last_pos = last_pos
@@ -0,0 +1,219 @@
+""" Parses source code into a node table and span index.
+
+    IMPORTANT: this module must not import Qt so that it can be used in worker threads and
+    processes, and without a display.
+"""
+from __future__ import print_function
+
+import ast, logging, sys, threading
+
+from astviewer.nodetable import build_node_table
+from astviewer.profiling import profiler
+from astviewer.query import QueryIndex
+from astviewer.searchindex import SearchIndex
+from astviewer.spanindex import SpanIndex
+
+logger = logging.getLogger(__name__)
+
+PHASE_CACHE = 'Reading cache'
+PHASE_PARSE = 'Parsing'
+PHASE_BUILD = 'Building tree'
+PHASE_INDEX = 'Indexing spans'
+PHASE_SEARCH = 'Indexing text'
+PHASE_QUERY = 'Indexing classes'
+
+# ast.parse converts the parse tree to Python objects recursively in C, and gives up when the
+# nesting depth exceeds (a multiple of) the recursion limit. Long generated expressions, such as
+# a + b + c + ..., easily exceed that. A deep parse therefore runs in a thread with a large C
+# stack and a raised recursion limit. A level takes less than 100 bytes of stack; the depth is
+# limited to about three times the recursion limit.
+#
+# The recursion limit is process wide: while it is raised, a runaway recursion in any other thread
+# overflows the C stack of that thread instead of raising a RecursionError. Deep parses must
+# therefore only be done in processes without other threads that run Python code, e.g. worker
+# processes or the command line tools, but not in the GUI.
+PARSE_STACK_SIZE = 256 * 1024**2
+PARSE_RECURSION_LIMIT = 500000
+
+_parse_lock = threading.Lock() # The recursion limit and thread stack size are process wide.
+
+
+
+class NestingTooDeepError(RecursionError):
+    """ Raised when the source is nested too deeply to be parsed without a deep parse.
+    """
+    pass
+
+
+
+class ParsedModule(object):
+    """ The result of parsing a module.
+    """
+    def __init__(self, file_name, mode, table, span_index, search_index=None, query_index=None):
+        """ Constructor
+
+            :param file_name: the file name, used as label of the root node
+            :param mode: the mode of ast.parse ('exec', 'eval' or 'single')
+            :param table: the NodeTable with the nodes of the syntax tree
+            :param span_index: the SpanIndex of the table
+            :param search_index: the SearchIndex of the table. Is None unless it was requested.
+            :param query_index: the QueryIndex of the table. Is None unless it was requested.
+        """
+        self.file_name = file_name
+        self.mode = mode
+        self.table = table
+        self.span_index = span_index
+        self.search_index = search_index
+        self.query_index = query_index
+
+
+    def nbytes(self):
+        """ Returns the (approximate) number of bytes used by the table and indices.
+        """
+        n_bytes = self.table.nbytes() + self.span_index.nbytes()
+        if self.search_index is not None:
+            n_bytes += self.search_index.nbytes()
+        if self.query_index is not None:
+            n_bytes += self.query_index.nbytes()
+        return n_bytes
+
+
+
+def get_last_pos(source):
+    """ Returns the (line, col) position of the end of the source.
+
+        Like the ast positions, the column is an UTF-8 byte offset.
+
+        :param source: the source code as string, or as UTF-8 bytes with '\\n' line breaks.
+    """
+    if isinstance(source, bytes):
+        return (source.count(b'\n') + 1, len(source) - source.rfind(b'\n') - 1)
+    line_nr = source.count('\n') + 1
+    last_line = source[source.rfind('\n') + 1:]
+    return (line_nr, len(last_line.encode('utf-8')))
+
+
+def parse_ast(source, file_name='<source>', mode='exec', deep=False):
+    """ Returns the result of ast.parse.
+
+        :param deep: if True, sources of any nesting depth that the parser accepts are parsed.
+            ast.parse is then called in a thread with a stack of PARSE_STACK_SIZE bytes while the
+            recursion limit is raised to PARSE_RECURSION_LIMIT. Exceptions are raised in the
+            calling thread. Deeper sources raise a RecursionError or MemoryError, as they would
+            otherwise. Only use this in processes without other Python threads, see
+            PARSE_RECURSION_LIMIT.
+        :raises NestingTooDeepError: if deep is False and the source is nested too deeply for
+            the current recursion limit.
+    """
+    if not deep:
+        try:
+            return ast.parse(source, filename=file_name, mode=mode)
+        except RecursionError as ex:
+            raise NestingTooDeepError("The source is nested too deeply to be parsed with a "
+                                      "recursion limit of {}: {}"
+                                      .format(sys.getrecursionlimit(), ex))
+
+    result = {}
+
+    def run():
+        """ Parses the source. Is executed in the parse thread.
+        """
+        try:
+            result['syntax_tree'] = ast.parse(source, filename=file_name, mode=mode)
+        except BaseException as ex:
+            result['error'] = ex
+
+    with _parse_lock:
+        old_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(old_limit, PARSE_RECURSION_LIMIT))
+        try:
+            old_stack_size = threading.stack_size()
+            try:
+                threading.stack_size(PARSE_STACK_SIZE)
+            except (ValueError, RuntimeError) as ex:
+                logger.debug("Unable to set the stack size of the parse thread: {}".format(ex))
+                sys.setrecursionlimit(old_limit) # The default stack may not be large enough.
+            try:
+                thread = threading.Thread(target=run, name='ast.parse')
+                thread.start()
+            finally:
+                threading.stack_size(old_stack_size)
+            thread.join()
+        finally:
+            sys.setrecursionlimit(old_limit)
+
+    if 'error' in result:
+        raise result['error']
+    return result['syntax_tree']
+
+
+def parse_module(source, file_name='<source>', mode='exec', progress=None, cache=None,
+                 search=False, deep=False):
+    """ Parses the source code and builds the node table and span index.
+
+        :param source: the source code. Either a string, or UTF-8 bytes with '\\n' line breaks
+            (see loader.SourceFile.parse_source), which ast.parse doesn't need to encode.
+        :param file_name: used in error messages and as label of the root node
+        :param mode: the mode of ast.parse ('exec', 'eval' or 'single')
+        :param progress: optional function that is called as progress(phase, n_done, n_total)
+            when a phase starts and regularly during the phases. n_total is 0 if unknown. The
+            function may raise an exception to abort parsing.
+        :param cache: optional ParseCache. If the source is in the cache, parsing is skipped.
+            Otherwise the result is stored in the cache.
+        :param search: if True, the SearchIndex and QueryIndex are built as well. They are not
+            stored in the cache.
+        :param deep: if True, sources of any nesting depth are parsed. See parse_ast.
+        :return: ParsedModule
+    """
+    def report(phase, n_done=0, n_total=0):
+        """ Calls the progress function if it is defined.
+        """
+        if progress is not None:
+            progress(phase, n_done, n_total)
+
+    if cache is not None:
+        report(PHASE_CACHE)
+        with profiler.phase('parse: cache lookup'):
+            parsed_module = cache.load(source, file_name, mode)
+        if parsed_module is not None:
+            if search:
+                _add_search_indices(parsed_module, report)
+            return parsed_module
+
+    report(PHASE_PARSE)
+    with profiler.phase('parse: ast.parse'):
+        syntax_tree = parse_ast(source, file_name=file_name, mode=mode, deep=deep)
+
+    report(PHASE_BUILD)
+    with profiler.phase('parse: build table'):
+        table = build_node_table(syntax_tree, get_last_pos(source), root_label=file_name,
+                                 progress=lambda n_done, n_total: report(PHASE_BUILD, n_done,
+                                                                         n_total))
+    del syntax_tree
+
+    report(PHASE_INDEX)
+    with profiler.phase('parse: span index', items=len(table)):
+        span_index = SpanIndex(table)
+
+    parsed_module = ParsedModule(file_name, mode, table, span_index)
+    if cache is not None:
+        with profiler.phase('parse: cache store'):
+            cache.store(source, parsed_module)
+    if search:
+        _add_search_indices(parsed_module, report)
+    return parsed_module
+
+
+def _add_search_indices(parsed_module, report):
+    """ Builds the search index and query index of the parsed module.
+    """
+    table = parsed_module.table
+    report(PHASE_SEARCH)
+    with profiler.phase('parse: search index', items=len(table)):
+        parsed_module.search_index = SearchIndex(
+            table, progress=lambda n_done, n_total: report(PHASE_SEARCH, n_done, n_total))
+
+    report(PHASE_QUERY)
+    with profiler.phase('parse: query index', items=len(table)):
+        parsed_module.query_index = QueryIndex(
+            table, progress=lambda n_done, n_total: report(PHASE_QUERY, n_done, n_total))
@@ -0,0 +1,134 @@
+""" Wall-time and counter instrumentation of the phases of loading a file.
+
+    The instrumentation is disabled by default and then costs next to nothing. It is enabled with
+    the --profile command line option. The phases and counters are recorded in the profiler
+    singleton, which may be used from several threads.
+
+    IMPORTANT: this module must not import Qt so that it can be used without a display.
+"""
+from __future__ import print_function
+
+import logging, threading, time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Counter names
+COUNT_ITEMS_CREATED = 'tree items created'
+COUNT_ICONS_FETCHED = 'icons fetched'
+COUNT_FIND_ITEM_VISITS = 'find_item nodes visited'
+COUNT_SPAN_LOOKUPS = 'span index lookups'
+
+
+
+class PhaseStats(object):
+    """ Number of calls and total duration of a phase.
+    """
+    def __init__(self):
+        """ Constructor
+        """
+        self.calls = 0
+        self.seconds = 0.0
+        self.items = 0
+
+
+
+class Profiler(object):
+    """ Records the durations of named phases and the values of named counters.
+
+        Phases are recorded with the phase() context manager. They may be nested, e.g. the span
+        passes are part of building the table. The duration of the outer phase then includes
+        that of the inner phases.
+    """
+    def __init__(self, enabled=False):
+        """ Constructor
+        """
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._phases = OrderedDict()
+        self._counters = OrderedDict()
+
+
+    def reset(self):
+        """ Removes all recorded phases and counters.
+        """
+        with self._lock:
+            self._phases.clear()
+            self._counters.clear()
+
+
+    @contextmanager
+    def phase(self, name, items=0):
+        """ Context manager that records the wall time of the code in its block.
+
+            :param name: name of the phase
+            :param items: number of items (e.g. nodes) that are processed in the phase.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.time() - start_time, items=items)
+
+
+    def add_phase(self, name, seconds, items=0):
+        """ Adds a call with a duration to a phase.
+        """
+        with self._lock:
+            stats = self._phases.get(name)
+            if stats is None:
+                stats = self._phases[name] = PhaseStats()
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.items += items
+
+
+    def count(self, name, n=1):
+        """ Adds n to a counter. Does nothing if the profiler is disabled.
+        """
+        if self.enabled:
+            with self._lock:
+                self._counters[name] = self._counters.get(name, 0) + n
+
+
+    def phases(self):
+        """ Returns a list of (name, calls, seconds, items) tuples in the order of first use.
+        """
+        with self._lock:
+            return [(name, stats.calls, stats.seconds, stats.items)
+                    for name, stats in self._phases.items()]
+
+
+    def counters(self):
+        """ Returns a list of (name, value) tuples in the order of first use.
+        """
+        with self._lock:
+            return list(self._counters.items())
+
+
+    def summary(self):
+        """ Returns the recorded phases and counters as a text table.
+        """
+        if not self.enabled:
+            return "Profiling is disabled. Start the program with --profile to enable it."
+
+        lines = ["{:<32s} {:>7s} {:>11s} {:>11s} {:>10s}"
+                     .format('Phase', 'Calls', 'Total (s)', 'Mean (s)', 'Items')]
+        for name, calls, seconds, items in self.phases():
+            lines.append("{:<32s} {:>7d} {:>11.4f} {:>11.4f} {:>10s}"
+                         .format(name, calls, seconds, seconds / calls, str(items) if items else ''))
+        lines.append('')
+        lines.append("{:<32s} {:>10s}".format('Counter', 'Value'))
+        for name, value in self.counters():
+            lines.append("{:<32s} {:>10d}".format(name, value))
+        return "\n".join(lines)
+
+
+
+profiler = Profiler() # Process wide singleton
@@ -0,0 +1,566 @@
+""" Contains the query engine: finds the nodes that match a structural selector.
+
+    The selector language resembles CSS selectors. A selector is a chain of steps separated by
+    combinators; the nodes that match the last step are the result.
+
+        ClassDef Lambda                      Lambda nodes anywhere below a ClassDef
+        For > Expr                           Expr nodes that are direct children of a For
+        For Call[func=Attribute][func.attr=execute]
+                                             calls of an execute method inside a for loop
+        FunctionDef[name~='^test_']          functions whose name matches a regular expression
+        body:Return, orelse:*                Return nodes in a body, all nodes in an orelse
+        ClassDef[decorator_list]             classes with at least one decorator
+
+    A step is a class name, or * for any AST node, that may be prefixed by a field name and a
+    colon, and may be followed by [path], [path=literal], [path!=literal] or [path~=regex]
+    predicates. The path is a field name, or a chain of field names separated by dots. A
+    predicate holds if one of the nodes at the path (lists are unpacked) exists and satisfies the
+    test. Primitive values are compared with the literal, AST nodes by their class name. A
+    literal is a quoted string, a number, True, False, None or a bare word, which is a string.
+
+    Only AST nodes count as ancestors: the lists between them (e.g. the body of a For) are
+    skipped, so For > Expr matches the statements in the body of a for loop.
+
+    A selector is evaluated right to left against a QueryIndex, which has the nodes of every
+    class: the candidates are the nodes of the class of the last step, and their ancestors are
+    matched against the previous steps by following the parent column of the NodeTable. Whether
+    a node, or one of its ancestors, matches a step is memoized, so every ancestor is checked at
+    most once per step.
+
+    IMPORTANT: this module must not import Qt so that it can be used without a display.
+"""
+from __future__ import print_function
+
+import ast, logging, re
+
+from array import array
+
+from astviewer.nodetable import KIND_AST, KIND_LIST, KIND_PRIMITIVE, NO_NODE, INT_TYPE_CODE, \
+    PROGRESS_INTERVAL, value_repr
+
+logger = logging.getLogger(__name__)
+
+COMBINATOR_DESCENDANT = ' '
+COMBINATOR_CHILD = '>'
+
+OP_EXISTS, OP_EQUAL, OP_NOT_EQUAL, OP_MATCH = None, '=', '!=', '~='
+
+_TOKEN_REGEX = re.compile(r"""
+      (?P<space>\s+)
+    | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    | (?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<op>!=|~=|=)
+    | (?P<punct>[*>,\[\].:])
+""", re.VERBOSE)
+
+
+
+class QuerySyntaxError(ValueError):
+    """ Raised when a query can't be parsed.
+    """
+    def __init__(self, message, position):
+        """ Constructor
+
+            :param position: the character offset in the query where the error was found.
+        """
+        super(QuerySyntaxError, self).__init__("{} (at position {})".format(message, position))
+        self.position = position
+
+
+
+class Predicate(object):
+    """ A [path], [path=literal], [path!=literal] or [path~=regex] test of a step.
+    """
+    def __init__(self, path, op=OP_EXISTS, literal=None):
+        """ Constructor
+
+            :param path: list of field names
+            :param op: OP_EXISTS, OP_EQUAL, OP_NOT_EQUAL or OP_MATCH
+            :param literal: the value to compare with. A string with a regular expression if
+                op is OP_MATCH.
+        """
+        self.path = path
+        self.op = op
+        self.literal = literal
+        self.regex = re.compile(literal) if op == OP_MATCH else None
+
+
+    def __str__(self):
+        """ Returns the predicate in the query language.
+        """
+        path = '.'.join(self.path)
+        if self.op == OP_EXISTS:
+            return "[{}]".format(path)
+        return "[{}{}{!r}]".format(path, self.op, self.literal)
+
+
+    def test_value(self, table, node_idx):
+        """ Returns True if a node at the end of the path satisfies the test.
+        """
+        if table.kind(node_idx) == KIND_PRIMITIVE:
+            value = table.value(node_idx)
+        else:
+            value = table.class_name(node_idx)
+
+        if self.op == OP_EXISTS:
+            return value is not None # None is an unset field, e.g. the returns of a FunctionDef
+        elif self.op == OP_MATCH:
+            return self.regex.search(value if isinstance(value, str) else value_repr(value)) is not None
+
+        # Don't consider True equal to 1.
+        equal = value == self.literal and isinstance(value, bool) == isinstance(self.literal, bool)
+        return equal if self.op == OP_EQUAL else not equal
+
+
+
+class Step(object):
+    """ One step of a selector: a class name or *, an optional field and the predicates.
+    """
+    def __init__(self, class_name=None, field=None, predicates=None):
+        """ Constructor
+
+            :param class_name: the class of the nodes, or None for any AST node.
+            :param field: the field of the parent that contains the node, or None for any field.
+        """
+        self.class_name = class_name
+        self.field = field
+        self.predicates = predicates or []
+
+
+    def __str__(self):
+        """ Returns the step in the query language.
+        """
+        text = '*' if self.class_name is None else self.class_name
+        if self.field is not None:
+            text = "{}:{}".format(self.field, text)
+        return text + ''.join(str(predicate) for predicate in self.predicates)
+
+
+
+class Selector(object):
+    """ A chain of steps and the combinators between them.
+    """
+    def __init__(self, steps, combinators):
+        """ Constructor
+
+            :param steps: list of Steps
+            :param combinators: list of COMBINATOR_DESCENDANT or COMBINATOR_CHILD. Has one
+                element less than steps.
+        """
+        assert len(combinators) == len(steps) - 1, "Bug: one combinator per pair of steps"
+        self.steps = steps
+        self.combinators = combinators
+
+
+    def __str__(self):
+        """ Returns the selector in the query language.
+        """
+        parts = [str(self.steps[0])]
+        for combinator, step in zip(self.combinators, self.steps[1:]):
+            parts.append(' > ' if combinator == COMBINATOR_CHILD else ' ')
+            parts.append(str(step))
+        return ''.join(parts)
+
+
+
+class _Parser(object):
+    """ Recursive descent parser of the query language.
+    """
+    def __init__(self, text):
+        """ Constructor. Splits the text in tokens.
+
+            The tokens are (kind, text, position, preceded_by_space) tuples.
+        """
+        self.text = text
+        self.tokens = []
+        self.pos = 0
+
+        preceded_by_space = False
+        offset = 0
+        while offset < len(text):
+            match = _TOKEN_REGEX.match(text, offset)
+            if match is None:
+                raise QuerySyntaxError("Unexpected character {!r}".format(text[offset]), offset)
+            kind = match.lastgroup
+            if kind == 'space':
+                preceded_by_space = True
+            else:
+                self.tokens.append((kind, match.group(), offset, preceded_by_space))
+                preceded_by_space = False
+            offset = match.end()
+
+
+    def peek(self):
+        """ Returns the next token, or an ('end', '', position, True) token at the end.
+        """
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return ('end', '', len(self.text), True)
+
+
+    def take(self, kind=None, text=None):
+        """ Returns the next token and advances. Raises QuerySyntaxError if it isn't of the
+            expected kind or text.
+        """
+        token = self.peek()
+        if (kind is not None and token[0] != kind) or (text is not None and token[1] != text):
+            if text is not None:
+                expected = repr(text)
+            elif kind == 'end':
+                expected = "the end of the query"
+            else:
+                expected = "a {}".format(kind)
+            found = "the end" if token[0] == 'end' else repr(token[1])
+            raise QuerySyntaxError("Expected {} but found {}".format(expected, found), token[2])
+        self.pos += 1
+        return token
+
+
+    def parse_query(self):
+        """ query := selector (',' selector)*
+        """
+        selectors = [self.parse_selector()]
+        while self.peek()[1] == ',':
+            self.take()
+            selectors.append(self.parse_selector())
+        self.take('end')
+        return selectors
+
+
+    def parse_selector(self):
+        """ selector := step (('>' | whitespace) step)*
+        """
+        steps = [self.parse_step()]
+        combinators = []
+        while True:
+            kind, text, _pos, preceded_by_space = self.peek()
+            if text == '>':
+                self.take()
+                combinators.append(COMBINATOR_CHILD)
+            elif (kind == 'name' or text == '*') and preceded_by_space:
+                combinators.append(COMBINATOR_DESCENDANT)
+            else:
+                break
+            steps.append(self.parse_step())
+        return Selector(steps, combinators)
+
+
+    def parse_step(self):
+        """ step := [field ':'] (name | '*') predicate*
+        """
+        field = None
+        token = self.peek()
+        if token[0] == 'name' and self.pos + 1 < len(self.tokens) and \
+                self.tokens[self.pos + 1][1] == ':':
+            field = self.take()[1]
+            self.take(text=':')
+            token = self.peek()
+
+        if token[1] == '*':
+            self.take()
+            class_name = None
+        else:
+            class_name = self.take('name')[1]
+
+        predicates = []
+        while self.peek()[1] == '[':
+            predicates.append(self.parse_predicate())
+        return Step(class_name, field, predicates)
+
+
+    def parse_predicate(self):
+        """ predicate := '[' name ('.' name)* [op literal] ']'
+        """
+        self.take(text='[')
+        path = [self.take('name')[1]]
+        while self.peek()[1] == '.':
+            self.take()
+            path.append(self.take('name')[1])
+
+        op, literal = OP_EXISTS, None
+        if self.peek()[0] == 'op':
+            op = self.take()[1]
+            literal, position = self.parse_literal()
+            if op == OP_MATCH:
+                if not isinstance(literal, str):
+                    literal = repr(literal)
+                try:
+                    re.compile(literal)
+                except re.error as ex:
+                    raise QuerySyntaxError("Invalid regular expression: {}".format(ex), position)
+        self.take(text=']')
+        return Predicate(path, op, literal)
+
+
+    def parse_literal(self):
+        """ literal := string | number | name. Returns (value, position) tuple.
+        """
+        kind, text, position, _ = self.peek()
+        if kind in ('string', 'number'):
+            self.take()
+            try:
+                return ast.literal_eval(text), position
+            except (SyntaxError, ValueError) as ex:
+                raise QuerySyntaxError("Invalid literal {}: {}".format(text, ex), position)
+        elif kind == 'name':
+            self.take()
+            return {'True': True, 'False': False, 'None': None}.get(text, text), position
+        else:
+            self.take('literal')
+
+
+
+def parse_query(text):
+    """ Parses a query. Returns a list of Selectors.
+
+        Raises QuerySyntaxError if the text isn't a valid query.
+    """
+    return _Parser(text).parse_query()
+
+
+
+class QueryIndex(object):
+    """ Index of the nodes of a NodeTable per class, to evaluate queries with.
+    """
+    def __init__(self, table, progress=None):
+        """ Constructor. Builds the index.
+
+            :param table: NodeTable
+            :param progress: optional function that is called as progress(n_done, n_total) every
+                PROGRESS_INTERVAL nodes. It may raise an exception to abort the build.
+        """
+        self.table = table
+        self.class_nodes = [array(INT_TYPE_CODE) for _ in table.class_names] # per class id
+        self._build(progress)
+
+
+    def nbytes(self):
+        """ Returns the (approximate) number of bytes used by the index.
+        """
+        return sum(len(nodes) * nodes.itemsize for nodes in self.class_nodes)
+
+
+    def _build(self, progress):
+        """ Appends every node to the array of its class. The arrays are thus sorted.
+        """
+        appenders = [nodes.append for nodes in self.class_nodes]
+        class_id = self.table.class_id
+        n_nodes = len(self.table)
+        for start in range(0, n_nodes, PROGRESS_INTERVAL):
+            for node_idx in range(start, min(start + PROGRESS_INTERVAL, n_nodes)):
+                appenders[class_id[node_idx]](node_idx)
+            if progress is not None:
+                progress(min(start + PROGRESS_INTERVAL, n_nodes), n_nodes)
+
+
+    def query(self, text):
+        """ Returns the node indices of the nodes that match the query, in source order.
+
+            Raises QuerySyntaxError if the text isn't a valid query.
+        """
+        selectors = parse_query(text)
+        if len(selectors) == 1:
+            matches = _SelectorMatcher(self, selectors[0]).matches()
+        else:
+            matches = set()
+            for selector in selectors:
+                matches.update(_SelectorMatcher(self, selector).matches())
+
+        # Sort by start position, and by node index so that parents precede their children.
+        # An integer key sorts much faster than a tuple.
+        table = self.table
+        start_line, start_col, n_nodes = table.start_line, table.start_col, len(table)
+        return sorted(matches, key=lambda idx: ((start_line[idx] << 32) + start_col[idx]) *
+                      n_nodes + idx)
+
+
+
+class _SelectorMatcher(object):
+    """ Evaluates one selector against a QueryIndex.
+    """
+    def __init__(self, query_index, selector):
+        """ Constructor. Resolves the class and field names of the steps to ids.
+        """
+        self.query_index = query_index
+        self.table = table = query_index.table
+        self.selector = selector
+
+        field_ids = dict((name, idx) for idx, name in enumerate(table.field_names))
+        self._class_ids = []  # set of class ids per step, or None for any AST class
+        self._field_ids = []  # field id per step, or None for any field
+        self._paths = []      # list of field id paths per step (None if a field is unknown)
+        for step in selector.steps:
+            if step.class_name is None:
+                self._class_ids.append(None)
+            else:
+                self._class_ids.append(set(class_id for class_id, name
+                                           in enumerate(table.class_names)
+                                           if name == step.class_name))
+            self._field_ids.append(None if step.field is None else field_ids.get(step.field, -2))
+            self._paths.append([None if any(field not in field_ids for field in pred.path)
+                                else [field_ids[field] for field in pred.path]
+                                for pred in step.predicates])
+
+        # True per step if every node of the class of the step matches the step.
+        self._class_only = [step.field is None and not step.predicates
+                            for step in selector.steps]
+
+        # Memoized results, per step: does a node match the steps up to this one.
+        self._matches_memo = [{} for _ in selector.steps]
+        # Memoized results, per step: does a node or one of its ancestors match.
+        self._inclusive_memo = [{} for _ in selector.steps]
+
+
+    def matches(self):
+        """ Returns the list of nodes that match the selector.
+        """
+        return self._chain_matches(len(self.selector.steps) - 1)
+
+
+    def _chain_matches(self, step_nr):
+        """ Returns the list of nodes that match the steps up to step_nr.
+
+            The candidates are the nodes of the class of the step. If the step is * and its
+            parent must match the previous step, the candidates are the children of the matches
+            of the previous step instead, which are usually far fewer.
+        """
+        table = self.table
+        class_ids = self._class_ids[step_nr]
+        if class_ids is None and step_nr > 0 and \
+                self.selector.combinators[step_nr - 1] == COMBINATOR_CHILD:
+            candidates = []
+            for parent_idx in self._chain_matches(step_nr - 1):
+                for child_idx in table.children(parent_idx):
+                    kind = table.kind(child_idx)
+                    if kind == KIND_LIST:
+                        candidates.extend(child for child in table.children(child_idx)
+                                          if table.kind(child) == KIND_AST)
+                    elif kind == KIND_AST:
+                        candidates.append(child_idx)
+            if self._class_only[step_nr]:
+                return candidates
+            return [node_idx for node_idx in candidates if self._matches_step(step_nr, node_idx)]
+
+        if class_ids is None:
+            class_ids = [class_id for class_id, kind in enumerate(table.class_kinds)
+                         if kind == KIND_AST]
+        class_nodes = self.query_index.class_nodes
+        if step_nr == 0 and self._class_only[0]:
+            return [node_idx for class_id in class_ids for node_idx in class_nodes[class_id]]
+
+        check_step = not self._class_only[step_nr] # The class is known to match.
+        matches = []
+        for class_id in class_ids:
+            matches.extend(node_idx for node_idx in class_nodes[class_id]
+                           if self._matches_chain(step_nr, node_idx, memoize=False,
+                                                  check_step=check_step))
+        return matches
+
+
+    def _ast_parent(self, node_idx):
+        """ Returns the nearest AST ancestor of a node, skipping lists.
+        """
+        table = self.table
+        parent_idx = table.parent[node_idx]
+        if parent_idx != NO_NODE and table.kind(parent_idx) == KIND_LIST:
+            parent_idx = table.parent[parent_idx]
+        return parent_idx
+
+
+    def _matches_step(self, step_nr, node_idx):
+        """ Returns True if the node matches one step, disregarding its ancestors.
+        """
+        table = self.table
+        class_ids = self._class_ids[step_nr]
+        if class_ids is None:
+            if table.kind(node_idx) != KIND_AST:
+                return False
+        elif table.class_id[node_idx] not in class_ids:
+            return False
+
+        field_id = self._field_ids[step_nr]
+        if field_id is not None and table.field_id[node_idx] != field_id:
+            return False
+
+        for predicate, path in zip(self.selector.steps[step_nr].predicates,
+                                   self._paths[step_nr]):
+            if path is None:
+                return False
+            if not any(predicate.test_value(table, idx) for idx in self._follow(node_idx, path)):
+                return False
+        return True
+
+
+    def _follow(self, node_idx, path):
+        """ Returns the nodes at the end of a path of field ids, unpacking lists.
+        """
+        table = self.table
+        class_kinds, class_id = table.class_kinds, table.class_id
+        first_child, child_count, child_field_id = \
+            table.first_child, table.child_count, table.field_id
+        nodes = [node_idx]
+        for field_id in path:
+            next_nodes = []
+            for idx in nodes:
+                if class_kinds[class_id[idx]] != KIND_AST:
+                    continue
+                first = first_child[idx]
+                for child_idx in range(first, first + child_count[idx]):
+                    if child_field_id[child_idx] != field_id:
+                        continue
+                    if class_kinds[class_id[child_idx]] == KIND_LIST:
+                        next_nodes.extend(table.children(child_idx))
+                    else:
+                        next_nodes.append(child_idx)
+            nodes = next_nodes
+        return nodes
+
+
+    def _matches_chain(self, step_nr, node_idx, memoize=True, check_step=True):
+        """ Returns True if the node matches the step and its ancestors the previous steps.
+
+            If check_step is False, the node is assumed to match the step itself.
+        """
+        memo = self._matches_memo[step_nr]
+        if memoize and node_idx in memo:
+            return memo[node_idx]
+
+        result = self._matches_step(step_nr, node_idx) if check_step else True
+        if result and step_nr > 0:
+            parent_idx = self._ast_parent(node_idx)
+            if parent_idx == NO_NODE:
+                result = False
+            elif self.selector.combinators[step_nr - 1] == COMBINATOR_CHILD:
+                result = self._matches_chain(step_nr - 1, parent_idx)
+            else:
+                result = self._inclusive_matches(step_nr - 1, parent_idx)
+
+        if memoize:
+            memo[node_idx] = result
+        return result
+
+
+    def _inclusive_matches(self, step_nr, node_idx):
+        """ Returns True if the node, or one of its AST ancestors, matches the steps up to
+            step_nr.
+
+            Walks up until a node with a known result, and stores the result for the nodes on
+            the way, so that their descendants don't walk up again.
+        """
+        memo = self._inclusive_memo[step_nr]
+        path = []
+        result = False
+        while node_idx != NO_NODE:
+            if node_idx in memo:
+                result = memo[node_idx]
+                break
+            path.append(node_idx)
+            if self._matches_chain(step_nr, node_idx):
+                result = True
+                break
+            node_idx = self._ast_parent(node_idx)
+
+        for idx in path:
+            memo[idx] = result
+        return result
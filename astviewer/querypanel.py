@@ -0,0 +1,158 @@
+""" Contains the query panel: a query box and the list of the nodes that match the query.
+"""
+from __future__ import print_function
+
+import logging, time
+
+from astviewer.qtpy import QtCore, QtWidgets
+from astviewer.query import QuerySyntaxError
+from astviewer.tree import MAX_VALUE_LENGTH
+
+logger = logging.getLogger(__name__)
+
+# The widgets inherit from a Qt class, therefore they have many
+# ancestors public methods and attributes.
+# pylint: disable=R0901, R0902, R0904, W0201, R0913
+
+
+class QueryResultsModel(QtCore.QAbstractListModel):
+    """ List model of the nodes that match a query.
+
+        Only the node indices are stored; the texts are produced by data() when a row is shown,
+        so that a query with many matches doesn't create a string per match.
+    """
+    def __init__(self, parent=None):
+        """ Constructor
+        """
+        super(QueryResultsModel, self).__init__(parent=parent)
+        self.table = None
+        self.matches = []
+
+
+    def set_matches(self, table, matches):
+        """ Sets the node table and the node indices of the matches.
+        """
+        self.beginResetModel()
+        try:
+            self.table = table
+            self.matches = matches
+        finally:
+            self.endResetModel()
+
+
+    def node_from_row(self, row):
+        """ Returns the node index of the match in a row.
+        """
+        return self.matches[row]
+
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        """ Returns the number of matches.
+        """
+        return 0 if parent.isValid() else len(self.matches)
+
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        """ Returns the node text and position of a match.
+        """
+        if not index.isValid():
+            return None
+
+        node_idx = self.matches[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            pos_str = self.table.pos_str(node_idx)
+            node_str = self.table.node_str(node_idx, MAX_VALUE_LENGTH)
+            return "{}  ({})".format(node_str, pos_str) if pos_str else node_str
+        elif role == QtCore.Qt.ToolTipRole:
+            return self.table.span_str(node_idx)
+        return None
+
+
+
+class QueryPanel(QtWidgets.QWidget):
+    """ Query box with the list of matches.
+
+        The query is run when Enter is pressed. Selecting a match emits sigNodeFound, so that the
+        tree can make the node current and the editor highlight its span.
+    """
+    sigNodeFound = QtCore.Signal(int) # Emitted with the node index of the selected match.
+
+    def __init__(self, parent=None):
+        """ Constructor
+        """
+        super(QueryPanel, self).__init__(parent=parent)
+
+        self._query_index = None
+
+        self.line_edit = QtWidgets.QLineEdit()
+        self.line_edit.setPlaceholderText("Query, e.g.: For Call[func=Attribute][func.attr=execute]")
+        self.line_edit.setClearButtonEnabled(True)
+        self.line_edit.setToolTip(
+            "Selects nodes like CSS selectors. Examples:\n"
+            "  ClassDef Lambda - a Lambda anywhere below a ClassDef\n"
+            "  For > Expr - an Expr directly in a For\n"
+            "  Call[func.attr=execute] - a node whose func has an attr 'execute'\n"
+            "  FunctionDef[name~='^test_'] - a name matching a regular expression\n"
+            "  body:Return, orelse:* - a Return in a body, or any node in an orelse")
+        self.line_edit.returnPressed.connect(self.run_query)
+
+        self.status_label = QtWidgets.QLabel()
+
+        self.results_model = QueryResultsModel(self)
+        self.results_view = QtWidgets.QListView()
+        self.results_view.setModel(self.results_model)
+        self.results_view.setUniformItemSizes(True) # Don't ask the size of every row.
+        self.results_view.selectionModel().currentChanged.connect(self._current_match_changed)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(2, 2, 2, 2)
+        layout.addWidget(self.line_edit)
+        layout.addWidget(self.status_label)
+        layout.addWidget(self.results_view)
+
+
+    def set_index(self, query_index):
+        """ Sets the QueryIndex that is used for querying. Use None if no file is loaded.
+
+            The current query, if any, is run again.
+        """
+        self._query_index = query_index
+        self.run_query()
+
+
+    def open_panel(self):
+        """ Gives the keyboard focus to the query box.
+        """
+        self.line_edit.setFocus()
+        self.line_edit.selectAll()
+
+
+    @QtCore.Slot()
+    def run_query(self):
+        """ Runs the query and shows the matches.
+        """
+        text = self.line_edit.text().strip()
+        if self._query_index is None or not text:
+            self.results_model.set_matches(None, [])
+            self.status_label.setText("")
+            return
+
+        start_time = time.time()
+        try:
+            matches = self._query_index.query(text)
+        except QuerySyntaxError as ex:
+            self.results_model.set_matches(None, [])
+            self.status_label.setText(str(ex))
+            return
+
+        duration = time.time() - start_time
+        logger.debug("Query {!r}: {} matches in {:.3f} s".format(text, len(matches), duration))
+        self.results_model.set_matches(self._query_index.table, matches)
+        self.status_label.setText("{} matches ({:.2f} s)".format(len(matches), duration))
+
+
+    def _current_match_changed(self, current, _previous):
+        """ Emits sigNodeFound with the node of the selected match.
+        """
+        if current.isValid():
+            self.sigNodeFound.emit(self.results_model.node_from_row(current.row()))
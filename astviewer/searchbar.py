@@ -0,0 +1,200 @@
+""" Contains the search bar that finds nodes by their Field, Class or Value text.
+"""
+from __future__ import print_function
+
+import logging
+
+from astviewer.qtpy import QtCore, QtWidgets
+
+logger = logging.getLogger(__name__)
+
+SEARCH_STEP_DURATION = 0.008 # Seconds of searching between two passes of the event loop.
+
+# The widget inherits from a Qt class, therefore it has many
+# ancestors public methods and attributes.
+# pylint: disable=R0901, R0902, R0904, W0201, R0913
+
+
+class SearchBar(QtWidgets.QWidget):
+    """ Search box with type-ahead, next/previous buttons and a match counter.
+
+        The search starts when the text changes and is done in steps by a SearchJob, so that
+        typing is never blocked. The first match is made current as soon as it is found.
+    """
+    sigNodeFound = QtCore.Signal(int) # Emitted with the node index of the match to go to.
+    sigClosed = QtCore.Signal()
+
+    def __init__(self, parent=None):
+        """ Constructor
+        """
+        super(SearchBar, self).__init__(parent=parent)
+
+        self._search_index = None
+        self._job = None
+        self._current = -1        # Position of the current match in the matches of the job
+        self._select_first = True # Go to the first match when it is found
+
+        self._search_timer = QtCore.QTimer(self)
+        self._search_timer.setInterval(0)
+        self._search_timer.timeout.connect(self._continue_search)
+
+        self.line_edit = QtWidgets.QLineEdit()
+        self.line_edit.setPlaceholderText("Search field, class or value")
+        self.line_edit.setClearButtonEnabled(True)
+        self.line_edit.textChanged.connect(self._start_search)
+
+        self.previous_button = QtWidgets.QToolButton()
+        self.previous_button.setArrowType(QtCore.Qt.UpArrow)
+        self.previous_button.setToolTip("Previous match (Shift+Enter)")
+        self.previous_button.clicked.connect(self.find_previous)
+
+        self.next_button = QtWidgets.QToolButton()
+        self.next_button.setArrowType(QtCore.Qt.DownArrow)
+        self.next_button.setToolTip("Next match (Enter)")
+        self.next_button.clicked.connect(self.find_next)
+
+        self.count_label = QtWidgets.QLabel()
+        self.count_label.setMinimumWidth(120)
+
+        close_button = QtWidgets.QToolButton()
+        close_button.setText("x")
+        close_button.setAutoRaise(True)
+        close_button.setToolTip("Close (Esc)")
+        close_button.clicked.connect(self.close_bar)
+
+        layout = QtWidgets.QHBoxLayout(self)
+        layout.setContentsMargins(2, 2, 2, 2)
+        layout.addWidget(self.line_edit)
+        layout.addWidget(self.previous_button)
+        layout.addWidget(self.next_button)
+        layout.addWidget(self.count_label)
+        layout.addWidget(close_button)
+
+
+    @property
+    def matches(self):
+        """ The node indices of the matches that have been found so far.
+        """
+        return () if self._job is None else self._job.matches
+
+
+    def set_index(self, search_index):
+        """ Sets the SearchIndex that is used for searching. Use None if no file is loaded.
+
+            The current query is searched again but the current node isn't changed.
+        """
+        self._search_index = search_index
+        self._job = None
+        self._start_search(self.line_edit.text(), select_first=False)
+
+
+    def open_bar(self):
+        """ Shows the search bar and gives the keyboard focus to the search box.
+        """
+        self.show()
+        self.line_edit.setFocus()
+        self.line_edit.selectAll()
+
+
+    def close_bar(self):
+        """ Hides the search bar. The search results are kept for find next/previous.
+        """
+        self.hide()
+        self.sigClosed.emit()
+
+
+    @QtCore.Slot()
+    def find_next(self):
+        """ Goes to the next match. Wraps around when all matches have been found.
+        """
+        matches = self.matches
+        if self._current + 1 < len(matches):
+            self._go_to(self._current + 1)
+        elif matches and self._job.done:
+            self._go_to(0)
+
+
+    @QtCore.Slot()
+    def find_previous(self):
+        """ Goes to the previous match. Wraps around when all matches have been found.
+        """
+        matches = self.matches
+        if self._current > 0:
+            self._go_to(self._current - 1)
+        elif matches and self._job.done:
+            self._go_to(len(matches) - 1)
+
+
+    def _go_to(self, position):
+        """ Makes a match the current match and emits sigNodeFound.
+        """
+        self._current = position
+        self._update_count_label()
+        self.sigNodeFound.emit(self._job.matches[position])
+
+
+    def _start_search(self, text, select_first=True):
+        """ Starts searching for the text. Is called for every key stroke.
+
+            The matching texts of the previous query are reused when the text has been extended.
+        """
+        self._search_timer.stop()
+        self._current = -1
+        self._select_first = select_first
+        if self._search_index is None or not text:
+            self._job = None
+            self._update_count_label()
+            return
+
+        self._job = self._search_index.search(text, previous_job=self._job)
+        self._continue_search()
+
+
+    def _continue_search(self):
+        """ Searches for a short while. Reschedules itself until the search is done.
+        """
+        job = self._job
+        if job is None:
+            self._search_timer.stop()
+            return
+
+        done = job.run(max_duration=SEARCH_STEP_DURATION)
+        if self._select_first and self._current < 0 and job.matches:
+            self._go_to(0)
+        self._update_count_label()
+
+        if done:
+            self._search_timer.stop()
+        elif not self._search_timer.isActive():
+            self._search_timer.start()
+
+
+    def _update_count_label(self):
+        """ Shows the position of the current match and the number of matches.
+        """
+        job = self._job
+        if job is None:
+            text = ""
+        elif not job.matches:
+            text = "No matches" if job.done else "Searching..."
+        else:
+            text = "{} of {}{}".format(self._current + 1 if self._current >= 0 else '-',
+                                       len(job.matches), '' if job.done else '+')
+        self.count_label.setText(text)
+
+
+    def keyPressEvent(self, event):
+        """ Enter goes to the next match, Shift+Enter to the previous, Escape closes the bar.
+
+            The search box doesn't handle these keys, so they arrive here.
+        """
+        key = event.key()
+        if key in (QtCore.Qt.Key_Return, QtCore.Qt.Key_Enter):
+            if event.modifiers() & QtCore.Qt.ShiftModifier:
+                self.find_previous()
+            else:
+                self.find_next()
+        elif key == QtCore.Qt.Key_Escape:
+            self.close_bar()
+        else:
+            super(SearchBar, self).keyPressEvent(event)
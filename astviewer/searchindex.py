@@ -0,0 +1,276 @@
+""" Contains the search index: finds the nodes whose Field, Class or Value text contains a string.
+
+    A module has only a few dozen distinct class and field names, and far fewer distinct values
+    than nodes. The index therefore stores the distinct texts, lower-cased, in one string that is
+    separated by newlines. A query is a substring search in that string, which is done in C by
+    str.find. Every text has a posting list with the depth-first ranks of the nodes that show
+    it, so the matching nodes follow from merging the posting lists of the matching texts.
+
+    Searching is done by a SearchJob in small steps, so that a GUI can interleave it with
+    handling events and show the first results while the rest are still being found.
+
+    IMPORTANT: this module must not import Qt so that it can be used without a display.
+"""
+from __future__ import print_function
+
+import heapq, logging, time
+
+from array import array
+from bisect import bisect_right
+
+from astviewer.nodetable import KIND_LIST, NO_FIELD, NO_NODE, NO_VALUE, INT_TYPE_CODE, \
+    PROGRESS_INTERVAL, iter_preorder, value_repr
+
+logger = logging.getLogger(__name__)
+
+NO_TEXT = -1
+
+MAX_MERGED_TEXTS = 256 # If more texts match, the nodes are scanned instead of merging postings.
+STEP_INTERVAL = 1024   # Number of texts or nodes that are processed between two time checks.
+
+
+
+class SearchIndex(object):
+    """ Index of the Field, Class and Value texts of the nodes in a NodeTable.
+
+        The texts of the Node column are not indexed separately; they consist of the field
+        label and the class or value.
+    """
+    def __init__(self, table, progress=None):
+        """ Constructor. Builds the index.
+
+            :param table: NodeTable
+            :param progress: optional function that is called as progress(n_done, n_total) every
+                PROGRESS_INTERVAL nodes. It may raise an exception to abort the build.
+        """
+        self.table = table
+        self.order = array(INT_TYPE_CODE)  # node index, per depth-first rank
+        self.texts = []                    # the distinct texts, lower-cased
+        self.postings = []                 # array of ranks of the nodes, per text
+        self.value_text = array(INT_TYPE_CODE, [NO_TEXT]) * len(table) # text id, per node
+        self._blob = ''
+        self._offsets = array('q')         # offset of each text in the blob
+        self._build(progress)
+
+
+    def __len__(self):
+        """ Returns the number of distinct texts.
+        """
+        return len(self.texts)
+
+
+    def nbytes(self):
+        """ Returns the (approximate) number of bytes used by the index.
+
+            The texts are counted twice: in the list and in the blob.
+        """
+        arrays = [self.order, self.value_text, self._offsets] + self.postings
+        return sum(len(arr) * arr.itemsize for arr in arrays) + 2 * len(self._blob)
+
+
+    def _build(self, progress):
+        """ Builds the depth-first order, the texts and the posting lists.
+        """
+        table = self.table
+        n_nodes = len(table)
+
+        # Class and field names get the first text ids, so that their id follows from the
+        # class_id and field_id columns.
+        self.texts = [name.lower() for name in table.class_names]
+        self.field_text_offset = len(self.texts)
+        self.texts.extend(name.lower() for name in table.field_names)
+        self.value_text_offset = len(self.texts)
+        postings = [array(INT_TYPE_CODE) for _ in self.texts]
+        value_ids = {}
+
+        order = self.order
+        class_id, field_id, value_idx = table.class_id, table.field_id, table.value_idx
+        values, parent = table.values, table.parent
+        list_classes = set(cid for cid, kind in enumerate(table.class_kinds) if kind == KIND_LIST)
+        field_text_offset = self.field_text_offset
+        value_text = self.value_text
+
+        for rank, node_idx in enumerate(iter_preorder(table)):
+            order.append(node_idx)
+            postings[class_id[node_idx]].append(rank)
+
+            # The elements of a list have the field of the list; they are labeled 'field[row]'.
+            parent_idx = parent[node_idx]
+            if (field_id[node_idx] != NO_FIELD and parent_idx != NO_NODE and
+                    class_id[parent_idx] not in list_classes):
+                postings[field_text_offset + field_id[node_idx]].append(rank)
+
+            if value_idx[node_idx] != NO_VALUE:
+                text = value_repr(values[value_idx[node_idx]])
+                text_id = value_ids.get(text)
+                if text_id is None:
+                    text_id = value_ids[text] = len(self.texts)
+                    self.texts.append(text.lower())
+                    postings.append(array(INT_TYPE_CODE))
+                postings[text_id].append(rank)
+                value_text[node_idx] = text_id
+
+            if progress is not None and rank % PROGRESS_INTERVAL == 0:
+                progress(rank, n_nodes)
+
+        self.postings = postings
+
+        # The reprs of the values escape newlines, so a newline never occurs inside a text.
+        offsets = self._offsets
+        pos = 0
+        for text in self.texts:
+            offsets.append(pos)
+            pos += len(text) + 1
+        offsets.append(pos)
+        self._blob = '\n'.join(self.texts) + '\n'
+
+
+    def node_texts(self, node_idx):
+        """ Returns the ids of the class, field and value texts of a node (NO_TEXT if undefined).
+        """
+        table = self.table
+        field_text = NO_TEXT
+        parent_idx = table.parent[node_idx]
+        if (table.field_id[node_idx] != NO_FIELD and parent_idx != NO_NODE and
+                table.kind(parent_idx) != KIND_LIST):
+            field_text = self.field_text_offset + table.field_id[node_idx]
+        return table.class_id[node_idx], field_text, self.value_text[node_idx]
+
+
+    def iter_matching_texts(self, query):
+        """ Yields the ids of the texts that contain the query (lower-cased) in increasing order.
+        """
+        blob, offsets = self._blob, self._offsets
+        pos = blob.find(query)
+        while pos >= 0:
+            text_id = bisect_right(offsets, pos) - 1
+            yield text_id
+            pos = blob.find(query, offsets[text_id + 1])
+
+
+    def search(self, query, previous_job=None):
+        """ Returns a SearchJob that finds the nodes of which a text contains the query.
+
+            The search is case insensitive.
+
+            :param query: the string to search for
+            :param previous_job: the job of the previous query (e.g. before the user typed the
+                last character). If that job has found all its matching texts and the new query
+                contains its query, only those texts are searched.
+        """
+        return SearchJob(self, query, previous_job=previous_job)
+
+
+
+class SearchJob(object):
+    """ Finds the nodes that match a query in steps of limited duration.
+
+        Call run() until it returns True. The matches attribute contains the node indices that
+        have been found so far, in depth-first order.
+    """
+    def __init__(self, index, query, previous_job=None):
+        """ Constructor. Does not search yet.
+        """
+        self.index = index
+        self.query = query.lower()
+        self.matches = array(INT_TYPE_CODE)
+        self.text_ids = None  # Matching texts, set when they have all been found.
+        self.done = not self.query
+        self._steps = None if self.done else self._iter_steps(previous_job)
+
+
+    def run(self, max_duration=0.01):
+        """ Searches for at most about max_duration seconds.
+
+            :return: True if the search has finished.
+        """
+        if self.done:
+            return True
+
+        end_time = time.time() + max_duration
+        for _ in self._steps:
+            if time.time() >= end_time:
+                return False
+
+        self.done = True
+        self._steps = None
+        return True
+
+
+    def run_to_end(self):
+        """ Searches until all matches are found. Returns the matches.
+        """
+        while not self.run(max_duration=1.0):
+            pass
+        return self.matches
+
+
+    def _iter_steps(self, previous_job):
+        """ Generator that does the search. Yields regularly so that it can be interrupted.
+        """
+        index = self.index
+        query = self.query
+        text_ids = []
+        if (previous_job is not None and previous_job.index is index and
+                previous_job.text_ids is not None and previous_job.query in query):
+            texts = index.texts
+            for count, text_id in enumerate(previous_job.text_ids):
+                if query in texts[text_id]:
+                    text_ids.append(text_id)
+                if count % STEP_INTERVAL == 0:
+                    yield
+        else:
+            for text_id in index.iter_matching_texts(query):
+                text_ids.append(text_id)
+                if len(text_ids) % STEP_INTERVAL == 0:
+                    yield
+        self.text_ids = text_ids
+        yield
+
+        if len(text_ids) <= MAX_MERGED_TEXTS:
+            steps = self._merge_postings(text_ids)
+        else:
+            steps = self._scan_nodes(text_ids)
+        for step in steps:
+            yield step
+
+
+    def _merge_postings(self, text_ids):
+        """ Finds the matching nodes by merging the posting lists of the matching texts.
+        """
+        order, matches = self.index.order, self.matches
+        postings = self.index.postings
+        last_rank = NO_NODE
+        for count, rank in enumerate(heapq.merge(*[postings[text_id] for text_id in text_ids])):
+            if rank != last_rank: # A node can match with several of its texts.
+                matches.append(order[rank])
+                last_rank = rank
+            if count % STEP_INTERVAL == 0:
+                yield
+
+
+    def _scan_nodes(self, text_ids):
+        """ Finds the matching nodes by checking the texts of all nodes in depth-first order.
+
+            This is faster than merging when a short query matches many texts.
+        """
+        index = self.index
+        table = index.table
+        selected = bytearray(len(index.texts))
+        for text_id in text_ids:
+            selected[text_id] = 1
+
+        class_id, field_id = table.class_id, table.field_id
+        value_text = index.value_text
+        field_text_offset = index.field_text_offset
+        matches = self.matches
+        for rank, node_idx in enumerate(index.order):
+            if selected[class_id[node_idx]] or (
+                    value_text[node_idx] != NO_TEXT and selected[value_text[node_idx]]):
+                matches.append(node_idx)
+            elif field_id[node_idx] != NO_FIELD and selected[field_text_offset + field_id[node_idx]]:
+                _class_text, field_text, _value_text = index.node_texts(node_idx)
+                if field_text != NO_TEXT:
+                    matches.append(node_idx)
+            if rank % STEP_INTERVAL == 0:
+                yield
@@ -0,0 +1,460 @@
+""" Contains the read-only source viewer for very large files.
+
+    The SourceEditor is a QPlainTextEdit, which holds the whole text in its document and lays out
+    all its lines. For files of many megabytes, or generated files with very long lines, that
+    takes too much time and memory. The SourceViewer keeps the source as UTF-8 bytes, preferably
+    in a memory map of the file, and an array with the offsets of the line starts. It only
+    decodes and paints the parts of the lines that are visible.
+
+    A memory map can't be read beyond the end of its file, so the map must be closed when the
+    file is truncated (see is_truncated). Editors that save by renaming a new file are safe.
+"""
+from __future__ import print_function
+
+import logging, mmap, os, re, sys
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from astviewer.lineindex import line_offsets
+from astviewer.profiling import profiler
+from astviewer.qtpy import QtCore, QtGui, QtWidgets
+
+logger = logging.getLogger(__name__)
+
+TAB_SIZE = 8
+MAX_CACHED_LINES = 64 # Number of line maps that are kept
+CHECKPOINT_STEP = 1024 # Number of characters between two checkpoints of a LineMap
+
+# Bytes that aren't valid UTF-8 are decoded as lone surrogates, so that every byte can be mapped to
+# a character and back. They are shown as replacement characters.
+_ESCAPED_BYTE_RE = re.compile('[\udc80-\udcff]')
+
+# The widget inherits from a Qt class, therefore it has many
+# ancestors public methods and attributes.
+# pylint: disable=R0901, R0902, R0904, W0201, R0913
+
+
+def expand_tabs(text, start_col):
+    """ Expands the tabs of a text that starts at screen column start_col.
+    """
+    if '\t' not in text:
+        return text
+    pad = start_col % TAB_SIZE
+    return (' ' * pad + text).expandtabs(TAB_SIZE)[pad:]
+
+
+
+class LineMap(object):
+    """ Converts between the byte and screen columns of a line.
+
+        The map stores the byte and screen column of every CHECKPOINT_STEP-th character of the
+        line. A conversion then only decodes the bytes between two checkpoints, so its cost
+        doesn't depend on the length of the line. The map of an ASCII line without tabs is
+        empty, because its byte and screen columns are the same.
+    """
+    def __init__(self, line_bytes):
+        """ Constructor. Decodes the line once to find the checkpoints.
+        """
+        self.n_bytes = len(line_bytes)
+        self.byte_cols = None    # Byte column of the checkpoints, the last one is the line end
+        self.display_cols = None # Screen column of the checkpoints
+        if line_bytes.isascii() and b'\t' not in line_bytes:
+            self.n_display_cols = self.n_bytes
+            return
+
+        text = line_bytes.decode('utf-8', 'surrogateescape')
+        byte_cols, display_cols = array('q'), array('q')
+        byte_col = display_col = 0
+        for start in range(0, len(text), CHECKPOINT_STEP):
+            byte_cols.append(byte_col)
+            display_cols.append(display_col)
+            chunk = text[start:start + CHECKPOINT_STEP]
+            byte_col += len(chunk.encode('utf-8', 'surrogateescape'))
+            display_col += len(expand_tabs(chunk, display_col))
+        byte_cols.append(byte_col)
+        display_cols.append(display_col)
+        self.byte_cols, self.display_cols = byte_cols, display_cols
+        self.n_display_cols = display_col
+
+
+    @property
+    def simple(self):
+        """ True if the byte and screen columns of the line are the same.
+        """
+        return self.byte_cols is None
+
+
+
+class SourceViewer(QtWidgets.QAbstractScrollArea):
+    """ Read-only viewer that only renders the visible part of the source.
+
+        Has the select_text, get_last_pos and sigTextClicked interface of the SourceEditor; the
+        columns are UTF-8 byte offsets, like those of the ast. The viewer assumes a fixed-pitch
+        font: wide characters may make the highlighting less precise.
+    """
+    sigTextClicked = QtCore.Signal(int, int)
+
+    def __init__(self, parent=None):
+        """ Constructor
+        """
+        super(SourceViewer, self).__init__(parent=parent)
+
+        self._data = b''
+        self._mmap = None
+        self._file = None
+        self._offsets = line_offsets(b'')
+        self._max_line_length = 0
+        self._line_maps = OrderedDict() # LineMap per line index of the recently used lines
+        self._selection = None # ((line, col), (line, col)) with byte columns, or None
+        self._update_metrics()
+
+        font = QtGui.QFont()
+        font.setFamily('Courier')
+        font.setFixedPitch(True)
+        if sys.platform.startswith('linux'):
+            font.setPointSize(12)
+        self.setFont(font)
+
+        self.selection_color = QtGui.QColor('#FFE000')
+        self.verticalScrollBar().setSingleStep(1)
+        self.horizontalScrollBar().setSingleStep(1)
+
+
+    def sizeHint(self):
+        """ The recommended size for the widget.
+        """
+        size = QtCore.QSize()
+        size.setWidth(700)
+        size.setHeight(700)
+        return size
+
+
+    def _update_metrics(self):
+        """ Sets the line height and character width from the font.
+        """
+        metrics = QtGui.QFontMetrics(self.font())
+        self._line_height = max(metrics.lineSpacing(), 1)
+        self._char_width = max(metrics.averageCharWidth(), 1)
+        self._ascent = metrics.ascent()
+
+
+    def clear(self):
+        """ Removes the source and closes the memory map (if any).
+        """
+        self._set_data(b'')
+
+
+    def setPlainText(self, text):
+        """ Shows the text. The text is stored as UTF-8 bytes.
+        """
+        self._set_data(text.encode('utf-8', 'surrogatepass'))
+
+
+    def load_file(self, file_name):
+        """ Shows the contents of a UTF-8 file. The file is memory mapped, not read.
+
+            :return: True if successful, False if the file could not be mapped.
+        """
+        try:
+            file_obj = open(file_name, 'rb')
+        except (IOError, OSError) as ex:
+            logger.warning("Unable to open {}: {}".format(file_name, ex))
+            return False
+
+        try:
+            data = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error) as ex: # An empty file can't be mapped.
+            logger.debug("Unable to map {}: {}".format(file_name, ex))
+            data = file_obj.read()
+            file_obj.close()
+            file_obj = None
+
+        self._set_data(data, file_obj)
+        return True
+
+
+    def _set_data(self, data, file_obj=None):
+        """ Replaces the bytes that are shown. Closes the memory map of the previous file.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+        if self._file is not None:
+            self._file.close()
+
+        self._mmap = data if isinstance(data, mmap.mmap) else None
+        self._file = file_obj
+        self._data = data
+        self._line_maps.clear()
+        self._selection = None
+
+        with profiler.phase('viewer: line offsets', items=len(data)):
+            self._offsets = line_offsets(data)
+
+        if data[:3] == b'\xef\xbb\xbf': # Skip the UTF-8 byte order mark.
+            self._offsets[0] = 3
+
+        offsets = self._offsets
+        max_length = max(offsets[idx + 1] - offsets[idx] for idx in range(len(offsets) - 1))
+        self._max_line_length = max_length
+        self._update_scroll_bars()
+        self.verticalScrollBar().setValue(0)
+        self.horizontalScrollBar().setValue(0)
+        self.viewport().update()
+
+
+    def is_truncated(self):
+        """ Returns True if the viewer maps a file that has become smaller than the map.
+
+            The map must then be closed before it is read again.
+        """
+        if self._mmap is None:
+            return False
+        try:
+            return os.fstat(self._file.fileno()).st_size < len(self._mmap)
+        except (IOError, OSError):
+            return True
+
+
+    @property
+    def n_lines(self):
+        """ The number of lines.
+        """
+        return len(self._offsets) - 1
+
+
+    def _line_range(self, line_idx):
+        """ Returns the (start, end) offsets of a line in the data, without the line break.
+        """
+        start, end = self._offsets[line_idx], self._offsets[line_idx + 1] - 1
+        if end > start and self._data[end - 1:end] == b'\r':
+            end -= 1
+        return (start, end)
+
+
+    def _line_bytes(self, line_idx):
+        """ Returns the bytes of a line without the line break.
+        """
+        start, end = self._line_range(line_idx)
+        return self._data[start:end]
+
+
+    def _decode(self, line_idx, start_col, end_col):
+        """ Decodes the bytes of a line from byte column start_col to end_col.
+        """
+        start, end = self._line_range(line_idx)
+        return self._data[start + start_col:min(start + end_col, end)] \
+            .decode('utf-8', 'surrogateescape')
+
+
+    def _line_map(self, line_idx):
+        """ Returns the LineMap of a line. The maps of the recently used lines are cached.
+        """
+        line_map = self._line_maps.pop(line_idx, None)
+        if line_map is None:
+            with profiler.phase('viewer: line map'):
+                line_map = LineMap(self._line_bytes(line_idx))
+        self._line_maps[line_idx] = line_map
+        if len(self._line_maps) > MAX_CACHED_LINES:
+            self._line_maps.popitem(last=False)
+        return line_map
+
+
+    def _display_text(self, line_idx, first_col, n_cols):
+        """ Returns the text that is shown from screen column first_col, at most n_cols long.
+        """
+        line_map = self._line_map(line_idx)
+        if line_map.simple:
+            return self._decode(line_idx, first_col, first_col + n_cols)
+
+        byte_cols, display_cols = line_map.byte_cols, line_map.display_cols
+        first = max(bisect_right(display_cols, first_col) - 1, 0)
+        last = min(bisect_left(display_cols, first_col + n_cols), len(display_cols) - 1)
+        start_col = display_cols[first]
+        text = expand_tabs(self._decode(line_idx, byte_cols[first], byte_cols[last]), start_col)
+        text = text[first_col - start_col:first_col - start_col + n_cols]
+        return _ESCAPED_BYTE_RE.sub('\ufffd', text)
+
+
+    def _display_col(self, line_idx, byte_col):
+        """ Returns the screen column of a byte column. Tabs are expanded.
+        """
+        line_map = self._line_map(line_idx)
+        byte_col = min(max(byte_col, 0), line_map.n_bytes)
+        if line_map.simple:
+            return byte_col
+
+        # A column in the middle of a character is moved back to the start of the character.
+        line_start = self._offsets[line_idx]
+        while 0 < byte_col < line_map.n_bytes and 0x80 <= self._data[line_start + byte_col] < 0xC0:
+            byte_col -= 1
+
+        checkpoint = bisect_right(line_map.byte_cols, byte_col) - 1
+        start_col = line_map.display_cols[checkpoint]
+        text = self._decode(line_idx, line_map.byte_cols[checkpoint], byte_col)
+        return start_col + len(expand_tabs(text, start_col))
+
+
+    def _byte_col_at_display_col(self, line_idx, display_col):
+        """ Returns the byte column of the character that is shown at a screen column.
+        """
+        line_map = self._line_map(line_idx)
+        display_col = max(display_col, 0)
+        if line_map.simple:
+            return min(display_col, line_map.n_bytes)
+
+        byte_cols, display_cols = line_map.byte_cols, line_map.display_cols
+        checkpoint = bisect_right(display_cols, display_col) - 1
+        if checkpoint == len(display_cols) - 1:
+            return line_map.n_bytes # After the end of the line
+
+        text = self._decode(line_idx, byte_cols[checkpoint], byte_cols[checkpoint + 1])
+        col = display_cols[checkpoint]
+        for char_idx, char in enumerate(text):
+            col = (col // TAB_SIZE + 1) * TAB_SIZE if char == '\t' else col + 1
+            if col > display_col:
+                return byte_cols[checkpoint] + \
+                    len(text[:char_idx].encode('utf-8', 'surrogateescape'))
+        return byte_cols[checkpoint + 1]
+
+
+    def _visible_lines(self):
+        """ Returns the number of lines that fit in the viewport.
+        """
+        return max(self.viewport().height() // self._line_height, 1)
+
+
+    def _update_scroll_bars(self):
+        """ Sets the ranges of the scroll bars to the number of lines and the longest line.
+        """
+        visible_lines = self._visible_lines()
+        self.verticalScrollBar().setRange(0, max(self.n_lines - visible_lines, 0))
+        self.verticalScrollBar().setPageStep(visible_lines)
+
+        visible_cols = max(self.viewport().width() // self._char_width, 1)
+        self.horizontalScrollBar().setRange(0, max(self._max_line_length - visible_cols, 0))
+        self.horizontalScrollBar().setPageStep(visible_cols)
+
+
+    def resizeEvent(self, event):
+        """ Updates the scroll bars when the viewport size changes.
+        """
+        super(SourceViewer, self).resizeEvent(event)
+        self._update_scroll_bars()
+
+
+    def changeEvent(self, event):
+        """ Updates the font metrics when the font changes.
+        """
+        super(SourceViewer, self).changeEvent(event)
+        if event.type() == QtCore.QEvent.FontChange:
+            self.viewport().setFont(self.font())
+            self._update_metrics()
+            self._update_scroll_bars()
+
+
+    def paintEvent(self, _event):
+        """ Paints the visible lines and the selection.
+        """
+        painter = QtGui.QPainter(self.viewport())
+        palette = self.palette()
+        painter.fillRect(self.viewport().rect(), palette.base())
+        painter.setPen(palette.text().color())
+
+        first_line = self.verticalScrollBar().value()
+        first_col = self.horizontalScrollBar().value()
+        visible_cols = self.viewport().width() // self._char_width + 2
+        char_width, line_height = self._char_width, self._line_height
+
+        last_line = min(first_line + self._visible_lines() + 1, self.n_lines)
+        for line_idx in range(first_line, last_line):
+            y = (line_idx - first_line) * line_height
+            sel_range = self._selected_display_cols(line_idx)
+            if sel_range is not None:
+                sel_start, sel_end = sel_range
+                painter.fillRect(QtCore.QRect((sel_start - first_col) * char_width, y,
+                                              max(sel_end - sel_start, 1) * char_width,
+                                              line_height), self.selection_color)
+
+            visible_text = self._display_text(line_idx, first_col, visible_cols)
+            if visible_text:
+                painter.drawText(0, y + self._ascent, visible_text)
+        painter.end()
+
+
+    def _selected_display_cols(self, line_idx):
+        """ Returns the (start, end) screen columns of the selection in a line, or None.
+        """
+        if self._selection is None:
+            return None
+        (from_line, from_col), (to_line, to_col) = self._selection
+        line = line_idx + 1
+        if line < from_line or line > to_line:
+            return None
+
+        start = 0 if line > from_line else self._display_col(line_idx, from_col)
+        end = (self._line_map(line_idx).n_display_cols + 1 if line < to_line
+               else self._display_col(line_idx, to_col))
+        return (start, end)
+
+
+    def mousePressEvent(self, mouseEvent):
+        """ On mouse press, the sigTextClicked(line_nr, column_nr) is emitted.
+
+            The column is a UTF-8 byte offset, like the column offsets of the ast.
+        """
+        if mouseEvent.button() != QtCore.Qt.LeftButton or self.n_lines == 0:
+            return
+        line_idx = min(self.verticalScrollBar().value() + mouseEvent.pos().y() // self._line_height,
+                       self.n_lines - 1)
+        display_col = (self.horizontalScrollBar().value() +
+                       (mouseEvent.pos().x() + self._char_width // 2) // self._char_width)
+        byte_col = self._byte_col_at_display_col(line_idx, display_col)
+        self.sigTextClicked.emit(line_idx + 1, byte_col)
+
+
+    def select_text(self, from_pos, to_line_pos):
+        """ Selects a text in the range from_line:col ... to_line:col
+
+            from_pos and to_line_pos should be a (line, column) tuple, where the column is a
+            UTF-8 byte offset.
+            If from_pos is None, the selection starts at the beginning of the document.
+            If to_line_pos is None, the selection goes to the end of the document.
+        """
+        if from_pos is None:
+            from_pos = (1, 0)
+        if to_line_pos is None:
+            to_line_pos = self.get_last_pos()
+
+        if from_pos == to_line_pos:
+            self._selection = None
+        else:
+            self._selection = (from_pos, to_line_pos)
+            self._ensure_visible(from_pos)
+        self.viewport().update()
+
+
+    def _ensure_visible(self, pos):
+        """ Scrolls so that a (line, byte col) position is visible. The line is centered if it
+            wasn't visible.
+        """
+        line_idx = min(max(pos[0] - 1, 0), max(self.n_lines - 1, 0))
+        visible_lines = self._visible_lines()
+        v_bar = self.verticalScrollBar()
+        if not v_bar.value() <= line_idx < v_bar.value() + visible_lines:
+            v_bar.setValue(line_idx - visible_lines // 2)
+
+        if self.n_lines:
+            display_col = self._display_col(line_idx, pos[1])
+            visible_cols = max(self.viewport().width() // self._char_width, 1)
+            h_bar = self.horizontalScrollBar()
+            if not h_bar.value() <= display_col < h_bar.value() + visible_cols:
+                h_bar.setValue(display_col - visible_cols // 4)
+
+
+    def get_last_pos(self):
+        """ Gets the linenr and column of the last character. The column is a UTF-8 byte offset.
+        """
+        start, end = self._line_range(self.n_lines - 1)
+        return (self.n_lines, end - start)
@@ -0,0 +1,205 @@
+""" Contains the span index: finds the deepest node that covers a (line, col) position.
+
+    The index is a nested containment list (NCList). The spans are sorted and grouped so that no
+    span in a list contains another span of the same list; contained spans are stored in the
+    sublist of their container. Within a list both the start and end positions are then sorted,
+    so that the spans that cover a position can be found by binary search. A lookup takes
+    O(log n) for trees where the spans are properly nested, which is the usual case.
+
+    IMPORTANT: this module must not import Qt so that it can be used without a display.
+"""
+from __future__ import print_function
+
+import logging
+
+from array import array
+from bisect import bisect_left
+
+from astviewer.nodetable import NO_NODE, NO_POS, iter_postorder
+
+logger = logging.getLogger(__name__)
+
+_COL_BITS = 32
+
+
+def pos_key(line, col):
+    """ Combines a (line, col) position into a single integer that has the same ordering.
+    """
+    return (line << _COL_BITS) | col
+
+
+
+class SpanIndex(object):
+    """ Nested containment list of the highlight spans of the nodes in a NodeTable.
+
+        Only nodes that have a position themselves and a non-empty span are indexed; these are
+        the nodes that SyntaxTreeWidget.find_item can return.
+    """
+    ARRAYS = ('starts', 'ends', 'nodes', 'ranks', 'sub_first', 'sub_count')
+
+    def __init__(self, table=None):
+        """ Constructor. Builds the index.
+
+            :param table: NodeTable. If None, an empty index is created.
+        """
+        self.starts = array('q')       # start position keys, per list entry
+        self.ends = array('q')         # end position keys, per list entry
+        self.nodes = array('i')        # node index, per list entry
+        self.ranks = array('i')        # rank of the node in depth-first post-order, per list entry
+        self.sub_first = array('i')    # first entry of the sublist, per list entry
+        self.sub_count = array('i')    # length of the sublist, per list entry
+        self.top_count = 0             # the top-level list is stored at entries [0, top_count)
+        if table is not None:
+            self._build(table)
+
+
+    def __len__(self):
+        """ Returns the number of indexed spans.
+        """
+        return len(self.nodes)
+
+
+    def nbytes(self):
+        """ Returns the (approximate) number of bytes used by the arrays of the index.
+        """
+        return sum(len(arr) * arr.itemsize for arr in (getattr(self, a) for a in self.ARRAYS))
+
+
+    def get_state(self):
+        """ Returns the contents of the index as a dictionary of built-in types.
+
+            The result can be serialized with marshal. Use SpanIndex.from_state to restore it.
+        """
+        state = dict((name, getattr(self, name).tobytes()) for name in self.ARRAYS)
+        state['top_count'] = self.top_count
+        return state
+
+
+    @classmethod
+    def from_state(cls, state):
+        """ Creates an index from the result of get_state.
+        """
+        span_index = cls()
+        for name in cls.ARRAYS:
+            getattr(span_index, name).frombytes(state[name])
+        span_index.top_count = state['top_count']
+        return span_index
+
+
+    def _build(self, table):
+        """ Builds the nested containment list.
+        """
+        start_line, start_col = table.start_line, table.start_col
+        end_line, end_col = table.end_line, table.end_col
+
+        ranks = self._post_order_ranks(table)
+
+        starts = {}
+        ends = {}
+        for node_idx in range(len(table)):
+            if table.line[node_idx] == NO_POS or start_line[node_idx] == NO_POS:
+                continue
+            start = pos_key(start_line[node_idx], start_col[node_idx])
+            end = pos_key(end_line[node_idx], end_col[node_idx])
+            if start < end:
+                starts[node_idx] = start
+                ends[node_idx] = end
+
+        # Sort on start position, larger spans first. Equal spans are sorted on node index so that
+        # ancestors (which have a lower index in a breadth-first table) contain their descendants.
+        order = sorted(starts, key=lambda idx: (starts[idx], -ends[idx], idx))
+
+        # Find the container of each span: the last span on the stack that contains it.
+        containers = []
+        stack = []
+        for entry, node_idx in enumerate(order):
+            end = ends[node_idx]
+            while stack and ends[order[stack[-1]]] < end:
+                stack.pop()
+            containers.append(stack[-1] if stack else NO_NODE)
+            stack.append(entry)
+
+        # Lay out the lists contiguously. The top-level list comes first, followed by the sublists
+        # in order of their container.
+        n_entries = len(order)
+        sub_count = [0] * n_entries
+        top_count = 0
+        for container in containers:
+            if container == NO_NODE:
+                top_count += 1
+            else:
+                sub_count[container] += 1
+
+        sub_first = [0] * n_entries
+        offset = top_count
+        for entry in range(n_entries):
+            sub_first[entry] = offset
+            offset += sub_count[entry]
+
+        location = [0] * n_entries   # position in the flat layout, per sorted entry
+        fill = list(sub_first)
+        top_fill = 0
+        for entry, container in enumerate(containers):
+            if container == NO_NODE:
+                location[entry] = top_fill
+                top_fill += 1
+            else:
+                location[entry] = fill[container]
+                fill[container] += 1
+
+        flat_nodes = [0] * n_entries
+        flat_sub_first = [0] * n_entries
+        flat_sub_count = [0] * n_entries
+        for entry, loc in enumerate(location):
+            flat_nodes[loc] = order[entry]
+            flat_sub_first[loc] = sub_first[entry]
+            flat_sub_count[loc] = sub_count[entry]
+
+        self.nodes = array('i', flat_nodes)
+        self.starts = array('q', [starts[idx] for idx in flat_nodes])
+        self.ends = array('q', [ends[idx] for idx in flat_nodes])
+        self.ranks = array('i', [ranks[idx] for idx in flat_nodes])
+        self.sub_first = array('i', flat_sub_first)
+        self.sub_count = array('i', flat_sub_count)
+        self.top_count = top_count
+
+
+    @staticmethod
+    def _post_order_ranks(table):
+        """ Returns a list with the rank of each node in a depth-first post-order traversal.
+        """
+        ranks = [0] * len(table)
+        for rank, node_idx in enumerate(iter_postorder(table)):
+            ranks[node_idx] = rank
+        return ranks
+
+
+    def find_node(self, position):
+        """ Finds the deepest node whose span covers the position.
+
+            A span covers a position if start_pos < position < end_pos. If several spans cover
+            the position, the node that comes first in depth-first post-order is returned, which
+            is the node that SyntaxTreeWidget.find_item finds. If the spans are properly nested,
+            this is the deepest node.
+
+            :param position: (line_nr, column_nr) tuple
+            :return: the node index or NO_NODE if no node covers the position.
+        """
+        key = pos_key(*position)
+        starts, ends, ranks = self.starts, self.ends, self.ranks
+
+        best_entry = -1
+        todo = [(0, self.top_count)]  # (first entry, entry count) of the lists to search
+        while todo:
+            first, count = todo.pop()
+            # The last entry that starts before the position. The entries before it that end after
+            # the position form a contiguous run because the end positions are sorted as well.
+            entry = bisect_left(starts, key, first, first + count) - 1
+            while entry >= first and ends[entry] > key:
+                if best_entry < 0 or ranks[entry] < ranks[best_entry]:
+                    best_entry = entry
+                if self.sub_count[entry]:
+                    todo.append((self.sub_first[entry], self.sub_count[entry]))
+                entry -= 1
+
+        return NO_NODE if best_entry < 0 else self.nodes[best_entry]
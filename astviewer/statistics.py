@@ -0,0 +1,78 @@
+""" Summary statistics and span diagnostics of a node table.
+
+    IMPORTANT: this module must not import Qt so that it can be used without a display.
+"""
+from __future__ import print_function
+
+import logging
+
+from collections import OrderedDict
+
+from astviewer.nodetable import KIND_AST, KIND_LIST, KIND_PRIMITIVE, NO_NODE, NO_POS, \
+    iter_preorder_with_depth
+
+logger = logging.getLogger(__name__)
+
+
+
+def table_statistics(table):
+    """ Returns an OrderedDict with node counts and span diagnostics of the table.
+
+        The keys are:
+            nodes: total number of nodes
+            ast_nodes, list_nodes, primitive_nodes: number of nodes per kind
+            max_depth: depth of the deepest node (the root has depth 0)
+            positioned_nodes: number of nodes that have a line:col position
+            unordered_positions: number of positioned nodes that come before the previous
+                positioned node when walking the tree depth-first (see issue #1 and
+                testprogs/invalid_highlights.py)
+            empty_spans: number of positioned nodes whose span is empty
+            spans_outside_parent: number of nodes whose span is not contained in the span of
+                their parent
+            table_bytes: approximate size of the table columns in bytes
+    """
+    n_kinds = [0, 0, 0]
+    max_depth = 0
+    n_positioned = n_unordered = n_empty = n_outside = 0
+
+    line, col = table.line, table.col
+    start_line, start_col = table.start_line, table.start_col
+    end_line, end_col = table.end_line, table.end_col
+    parent = table.parent
+
+    prev_pos = None
+    for idx, depth in iter_preorder_with_depth(table):
+        n_kinds[table.kind(idx)] += 1
+        max_depth = max(max_depth, depth)
+
+        start = (start_line[idx], start_col[idx])
+        end = (end_line[idx], end_col[idx])
+
+        if line[idx] != NO_POS:
+            n_positioned += 1
+            pos = (line[idx], col[idx])
+            if prev_pos is not None and pos < prev_pos:
+                n_unordered += 1
+            prev_pos = pos
+            if start_line[idx] == NO_POS or end_line[idx] == NO_POS or not start < end:
+                n_empty += 1
+
+        parent_idx = parent[idx]
+        if parent_idx != NO_NODE and start_line[idx] != NO_POS and end_line[idx] != NO_POS:
+            parent_start = (start_line[parent_idx], start_col[parent_idx])
+            parent_end = (end_line[parent_idx], end_col[parent_idx])
+            if start < parent_start or end > parent_end:
+                n_outside += 1
+
+    stats = OrderedDict()
+    stats['nodes'] = len(table)
+    stats['ast_nodes'] = n_kinds[KIND_AST]
+    stats['list_nodes'] = n_kinds[KIND_LIST]
+    stats['primitive_nodes'] = n_kinds[KIND_PRIMITIVE]
+    stats['max_depth'] = max_depth
+    stats['positioned_nodes'] = n_positioned
+    stats['unordered_positions'] = n_unordered
+    stats['empty_spans'] = n_empty
+    stats['spans_outside_parent'] = n_outside
+    stats['table_bytes'] = table.nbytes()
+    return stats
@@ -2,73 +2,192 @@
 """
 from __future__ import print_function
 
-import ast, logging
+import logging
 import os.path
+import time
 
+from astviewer.compact import CompactLayout
+from astviewer.expander import TreeExpander, iter_nodes_to_expand, EXPAND_ALL, EXPAND_DEPTH, \
+    EXPAND_RESET, EXPAND_ROWS, CHECK_INTERVAL, SLICE_DURATION
 from astviewer.iconfactory import IconFactory
-from astviewer.misc import class_name, check_class
-from astviewer.qtpy import QtCore, QtGui, QtWidgets
+from astviewer.misc import check_class
+from astviewer.nodetable import KIND_AST, KIND_LIST, KIND_PRIMITIVE, NO_NODE, NO_POS, \
+    depth_limit, iter_postorder
+from astviewer.profiling import profiler, COUNT_FIND_ITEM_VISITS, COUNT_ITEMS_CREATED, \
+    COUNT_SPAN_LOOKUPS
+from astviewer.qtpy import QtCore, QtWidgets
+from astviewer.spanindex import SpanIndex
 from astviewer.toggle_column_mixin import ToggleColumnTreeWidget
-from astviewer.version import DEBUGGING
+from astviewer.treediff import TreeDiff
 
 logger = logging.getLogger(__name__)
 
-IDX_LINE, IDX_COL = 0, 1
-ROLE_POS = QtCore.Qt.UserRole
-ROLE_START_POS = QtCore.Qt.UserRole
-ROLE_END_POS   = QtCore.Qt.UserRole + 1
+ROLE_NODE = QtCore.Qt.UserRole # Index of the node in the NodeTable
+ROLE_CHUNK = QtCore.Qt.UserRole + 1 # Number of the chunk of a chunk item
+
+# The rows of lists with more rows are grouped in chunks of CHUNK_SIZE rows (e.g. '[0..999]'),
+# like debuggers show big arrays. The rows of a chunk are only made when it is expanded.
+CHUNK_SIZE = 1000
+
+# Values with a longer repr are cut off in the tree. The full value is shown on request.
+MAX_VALUE_LENGTH = 200
+
+# Qt walks the ancestors of an item recursively (in C++) when it is made current, which overflows
+# the stack for extremely deep trees. Nodes that are nested deeper are not shown in the trees;
+# selecting one selects its deepest shown ancestor instead.
+MAX_VIEW_DEPTH = 10000
+
+# The widget makes the items of the nodes up to this depth (the root and the top-level statements)
+# when it is populated. The deeper items are made in time slices afterwards.
+FIRST_SCREEN_DEPTH = 2
+
+KIND_GLYPHS = {KIND_AST: IconFactory.AST_NODE,
+               KIND_LIST: IconFactory.LIST_NODE,
+               KIND_PRIMITIVE: IconFactory.PY_NODE}
 
 # The widget inherits from a Qt class, therefore it has many
 # ancestors public methods and attributes.
 # pylint: disable=R0901, R0902, R0904, W0201, R0913
 
 
-def cmpIdx(idx0, idx1):
-    """ Returns negative if idx0 < idx1, zero if idx0 == idx1 and strictly positive if idx0 > idx1.
-
-        If an idx0 or idx1 equals -1 or None, it is interpreted as the last element in a list
-        and thus larger than a positive integer
+def column_text(table, node_idx, column, compact_layout=None):
+    """ Returns the text of a node in a column of the tree. Long values are cut off.
 
-        :param idx0: positive int, -1 or None
-        :param idx2: positive int, -1 or None
-        :return: int
+        :param compact_layout: the CompactLayout of the table if the tree is in compact mode.
+            The children that are folded into the node are then added to the Node column.
     """
-    assert idx0 is None or idx0 == -1 or idx0 >=0, \
-        "Idx0 should be None, -1 or >= 0. Got: {!r}".format(idx0)
-    assert idx1 is None or idx1 == -1 or idx1 >=0, \
-        "Idx1 should be None, -1 or >= 0. Got: {!r}".format(idx1)
-
-    # Handle -1 the same way as None
-    if idx0 == -1:
-        idx0 = None
-    if idx1 == -1:
-        idx1 = None
-
-    if idx0 == idx1:
-        return 0
-    elif idx1 is None:
-        return -1
-    elif idx0 is None:
-        return 1
+    if column == SyntaxTreeWidget.COL_NODE:
+        node_str = table.node_str(node_idx, MAX_VALUE_LENGTH)
+        if compact_layout is None:
+            return node_str
+        return node_str + compact_layout.folded_str(node_idx)
+    elif column == SyntaxTreeWidget.COL_FIELD:
+        return table.field_label(node_idx)
+    elif column == SyntaxTreeWidget.COL_CLASS:
+        return table.class_name(node_idx)
+    elif column == SyntaxTreeWidget.COL_VALUE:
+        return table.value_str(node_idx, MAX_VALUE_LENGTH)
+    elif column == SyntaxTreeWidget.COL_POS:
+        return table.pos_str(node_idx)
+    elif column == SyntaxTreeWidget.COL_HIGHLIGHT:
+        return table.span_str(node_idx)
     else:
-        return -1 if idx0 < idx1 else 1
+        raise ValueError("Unexpected column: {}".format(column))
 
-    
-def cmpPos(pos0, pos1):
-    """ Returns negative if pos0 < pos1, zero if pos0 == pos1 and strictly positive if pos0 > pos1.
 
-        If an index equals -1 or None, it is interpreted as the last element in a list and
-        therefore larger than a positive integer
+def column_tooltip(table, node_idx, column):
+    """ Returns the tooltip of a node in a column of the tree. Returns None if there is none.
+    """
+    if column == SyntaxTreeWidget.COL_NODE and node_idx == 0:
+        return os.path.realpath(table.root_label)
+    elif column in (SyntaxTreeWidget.COL_NODE, SyntaxTreeWidget.COL_FIELD,
+                    SyntaxTreeWidget.COL_CLASS, SyntaxTreeWidget.COL_VALUE):
+        return column_text(table, node_idx, column)
+    return None
+
 
-        :param pos0: positive int, -1 or None
-        :param pos2: positive int, -1 or None
-        :return: int
+def row_count(table, node_idx, compact_layout=None):
+    """ Returns the number of rows under a node (without grouping them in chunks).
     """
-    cmpLineNr = cmpIdx(pos0[0], pos1[0])
-    if cmpLineNr != 0:
-        return cmpLineNr
-    else:
-        return cmpIdx(pos0[1], pos1[1])
+    if compact_layout is None:
+        return table.child_count[node_idx]
+    return compact_layout.row_count(node_idx)
+
+
+def child_node(table, node_idx, row, compact_layout=None):
+    """ Returns the node index of the child in a row under a node (without chunks).
+    """
+    if compact_layout is None:
+        return table.first_child[node_idx] + row
+    return compact_layout.child(node_idx, row)
+
+
+def node_row(table, node_idx, compact_layout=None):
+    """ Returns the row of a node within its parent (without chunks).
+    """
+    if compact_layout is None:
+        return table.row(node_idx)
+    return compact_layout.row(node_idx)
+
+
+def find_chunked_lists(table, n_nodes, compact_layout=None):
+    """ Returns the set of the lists whose rows are grouped in chunks.
+
+        :param n_nodes: only the nodes with a lower index are shown (see MAX_VIEW_DEPTH).
+    """
+    return set(idx for idx, count in enumerate(table.child_count[:n_nodes])
+               if count > CHUNK_SIZE and table.kind(idx) == KIND_LIST and
+               table.first_child[idx] < n_nodes and
+               row_count(table, idx, compact_layout) > CHUNK_SIZE)
+
+
+def chunk_label(first_row, n_rows):
+    """ Returns the text of the Node column of a chunk, e.g. '[1000..1999]'.
+    """
+    return "[{}..{}]".format(first_row, first_row + n_rows - 1)
+
+
+
+class SyntaxTreeDelegate(QtWidgets.QStyledItemDelegate):
+    """ Paints the items of the SyntaxTreeWidget from the node table.
+
+        The items only store their node index. The texts and the icon (which is shared by all
+        nodes of a kind) are looked up when an item is painted, and the long texts are elided by
+        the style at that time. Tooltips are only made when a QEvent.ToolTip asks for them.
+    """
+    def __init__(self, tree):
+        """ Constructor
+
+            :param tree: the SyntaxTreeWidget. Is also the parent QObject.
+        """
+        super(SyntaxTreeDelegate, self).__init__(tree)
+        self._tree = tree
+        icon_factory = IconFactory.singleton()
+        self._kind_icons = dict((kind, icon_factory.getIcon(glyph))
+                                for kind, glyph in KIND_GLYPHS.items())
+
+
+    def _node_idx(self, index):
+        """ Returns the node index of the row of a model index. Returns None if there is none.
+        """
+        if self._tree.table is None:
+            return None
+        return index.sibling(index.row(), SyntaxTreeWidget.COL_NODE).data(ROLE_NODE)
+
+
+    def initStyleOption(self, option, index):
+        """ Fills the style option with the text and icon of the node.
+        """
+        super(SyntaxTreeDelegate, self).initStyleOption(option, index)
+        node_idx = self._node_idx(index)
+        if node_idx is None:
+            return
+
+        table = self._tree.table
+        column = index.column()
+        option.text = column_text(table, node_idx, column, self._tree.compact_layout)
+        option.features |= QtWidgets.QStyleOptionViewItem.HasDisplay
+        if column == SyntaxTreeWidget.COL_NODE:
+            option.icon = self._kind_icons[table.kind(node_idx)]
+            option.features |= QtWidgets.QStyleOptionViewItem.HasDecoration
+
+
+    def helpEvent(self, event, view, option, index):
+        """ Shows the tooltip of a node.
+        """
+        if event.type() != QtCore.QEvent.ToolTip:
+            return super(SyntaxTreeDelegate, self).helpEvent(event, view, option, index)
+
+        node_idx = self._node_idx(index)
+        tooltip = None if node_idx is None else \
+            column_tooltip(self._tree.table, node_idx, index.column())
+        if tooltip:
+            QtWidgets.QToolTip.showText(event.globalPos(), tooltip, view)
+        else:
+            QtWidgets.QToolTip.hideText()
+            event.ignore()
+        return True
+
 
 
 class SyntaxTreeWidget(ToggleColumnTreeWidget):
@@ -96,10 +215,29 @@ class SyntaxTreeWidget(ToggleColumnTreeWidget):
         tree_header.setStretchLastSection(False)
 
         self.icon_factory = IconFactory.singleton()
+        self.setItemDelegate(SyntaxTreeDelegate(self))
 
         self.row_size_hint = QtCore.QSize()
         self.row_size_hint.setHeight(20)
         self.setIconSize(QtCore.QSize(20, 20))
+        self.icon_factory.prerenderIcons(self.iconSize() * self.devicePixelRatioF())
+
+        self.table = None
+        self.span_index = None
+        self.compact = False       # If True, populate leaves out the nodes of a CompactLayout
+        self.compact_layout = None # The CompactLayout of the table in compact mode
+        self._items = []           # Items per node; None if not shown, see MAX_VIEW_DEPTH
+        self._chunked = set()      # Lists whose rows are grouped in chunks, see CHUNK_SIZE
+        self.expander = TreeExpander(self)
+        self.itemExpanded.connect(self._fill_chunk)
+
+        # Populating in time slices, see populate.
+        self._shown_nodes = None   # The nodes that get an item when the tree is populated
+        self._n_populated = 0      # Number of shown nodes that have been handled so far
+        self._pending_expanded = None # 1 for nodes that are expanded when their item is made
+        self._populate_timer = QtCore.QTimer(self)
+        self._populate_timer.setInterval(0)
+        self._populate_timer.timeout.connect(self._populate_slice)
 
 
     def sizeHint(self):
@@ -114,231 +252,420 @@ class SyntaxTreeWidget(ToggleColumnTreeWidget):
     @QtCore.Slot()
     def expand_reset(self, tree_item=None):
         """ Expands/collapses all nodes as they were at program start up.
+
+            If tree_item is None, the whole tree is reset in time slices by the expander.
+            Otherwise the (collapsed) items of the subtree of tree_item are expanded immediately.
         """
         if tree_item is None:
-            tree_item = self.invisibleRootItem()
+            self.expander.start(EXPAND_RESET)
+            return
 
-        field = tree_item.text(SyntaxTreeWidget.COL_FIELD)
-        klass = tree_item.text(SyntaxTreeWidget.COL_CLASS)
+        top_idx = tree_item.data(SyntaxTreeWidget.COL_NODE, ROLE_NODE)
+        for node_idx in iter_nodes_to_expand(self.table, EXPAND_RESET, top_idx=top_idx):
+            self.set_node_expanded(node_idx, True)
 
-        tree_item.setExpanded(field == 'body' or
-                              klass in ('Module', 'ClassDef'))
 
-        # Expand children recursively
-        for childIdx in range(tree_item.childCount()):
-            self.expand_reset(tree_item.child(childIdx))
+    @QtCore.Slot()
+    def expand_all(self):
+        """ Expands all nodes in time slices.
+        """
+        self.expander.start(EXPAND_ALL)
 
 
-    @QtCore.Slot(int, int)
-    def select_node(self, line_nr, column_nr):
-        """ Selects the node given a line and column number.
+    def expand_to_depth(self, depth):
+        """ Expands the nodes so that the nodes up to depth levels below the root are visible.
         """
-        found_item = self.find_item(self.invisibleRootItem(), (line_nr, column_nr))
-        self.setCurrentItem(found_item) # Unselects if found_item is None
+        self.expander.start(EXPAND_DEPTH, depth)
 
 
-    def get_item_span(self, tree_item):
-        """ Returns (start_pos, end_pos) tuple where start_pos and end_pos, in turn, are (line, col)
-            tuples
+    def expand_to_rows(self, n_rows):
+        """ Expands the nodes breadth-first for as long as there are at most n_rows visible rows.
         """
-        start_pos = tree_item.data(SyntaxTreeWidget.COL_HIGHLIGHT, ROLE_START_POS)
-        end_pos = tree_item.data(SyntaxTreeWidget.COL_HIGHLIGHT, ROLE_END_POS)
-        return (start_pos, end_pos)
+        self.expander.start(EXPAND_ROWS, n_rows)
 
 
-    def find_item(self, tree_item, position):
-        """ Finds the deepest node item that highlights the position at line_nr column_nr, and
-            has a position defined itself.
-
-            :param tree_item: look within this QTreeWidgetItem and its child items
-            :param position: (line_nr, column_nr) tuple
+    @QtCore.Slot()
+    def collapse_all(self):
+        """ Stops the expander and collapses all nodes.
         """
-        check_class(position, tuple)
-        item_pos = tree_item.data(SyntaxTreeWidget.COL_POS, ROLE_POS)
-        item_start_pos = tuple(tree_item.data(SyntaxTreeWidget.COL_HIGHLIGHT, ROLE_START_POS))
-        item_end_pos = tuple(tree_item.data(SyntaxTreeWidget.COL_HIGHLIGHT, ROLE_END_POS))
-
-        # See if one of the children matches
-        for childIdx in range(tree_item.childCount()):
-            child_item = tree_item.child(childIdx)
-            found_node = self.find_item(child_item, position)
-            if found_node is not None:
-                return found_node
-
-        # If start_pos < position < end_pos the current node matches.
-        if item_start_pos is not None and item_end_pos is not None:
-            if item_pos is not None and item_start_pos < position < item_end_pos:
-                return tree_item
+        self.expander.cancel()
+        self.collapseAll()
 
-        # No matching node found in this subtree
-        return None
+
+    def collapseAll(self):
+        """ Collapses all items, including the ones that haven't been made yet.
+        """
+        if self._pending_expanded is not None:
+            self._pending_expanded = bytearray(len(self._items))
+        super(SyntaxTreeWidget, self).collapseAll()
 
 
-    def populate(self, syntax_tree, last_pos, root_label=''):
-        """ Populates the tree widget.
+    def set_node_expanded(self, node_idx, expanded):
+        """ Expands or collapses the item of a node. Does nothing if the node isn't shown.
 
-            :param syntax_tree: result of the ast.parse() function
-            :param file_name: used to set the label of the root_node
+            While the tree is being populated, the state of nodes without an item is stored and
+            applied when their item is made.
         """
-        self.clear()
+        if node_idx >= len(self._items):
+            return
+        node_item = self._items[node_idx]
+        if node_item is not None:
+            node_item.setExpanded(expanded)
+        elif self._pending_expanded is not None:
+            self._pending_expanded[node_idx] = expanded
 
-        def add_node(ast_node, parent_item, field_label):
-            """ Helper function that recursively adds nodes.
 
-                :param parent_item: The parent QTreeWidgetItem to which this node will be added
-                :param field_label: Labels how this node is known to the parent
-                :return: the QTreeWidgetItem that corresonds to the root item of the AST
-            """
-            node_item = QtWidgets.QTreeWidgetItem(parent_item)
+    @QtCore.Slot(int, int)
+    def select_node(self, line_nr, column_nr):
+        """ Selects the node given a line and column number.
+        """
+        if self.span_index is None:
+            self.setCurrentItem(None)
+            return
 
-            # Recursively descent the AST
-            if isinstance(ast_node, ast.AST):
-                value_str = ''
-                node_str = "{} = {}".format(field_label, class_name(ast_node))
-                node_item.setIcon(SyntaxTreeWidget.COL_NODE,
-                                  self.icon_factory.getIcon(IconFactory.AST_NODE))
+        with profiler.phase('tree: select_node'):
+            profiler.count(COUNT_SPAN_LOOKUPS)
+            node_idx = self.span_index.find_node((line_nr, column_nr))
+            found_item = None if node_idx == NO_NODE else self._node_item(node_idx)
+            self.setCurrentItem(found_item) # Unselects if found_item is None
 
-                if hasattr(ast_node, 'lineno'):
-                    node_item.setData(SyntaxTreeWidget.COL_POS, ROLE_POS,
-                                      (ast_node.lineno, ast_node.col_offset))
 
-                for key, val in ast.iter_fields(ast_node):
-                    add_node(val, node_item, key)
+    def set_current_node(self, node_idx):
+        """ Makes the item of a node the current item. Expands its ancestors to make it visible.
+        """
+        node_item = self._node_item(node_idx)
+        parent_item = node_item.parent()
+        while parent_item is not None:
+            parent_item.setExpanded(True)
+            parent_item = parent_item.parent()
+        self.setCurrentItem(node_item)
+        self.scrollToItem(node_item)
 
-            elif isinstance(ast_node, (list, tuple)):
-                value_str = ''
-                node_str = "{} = {}".format(field_label, class_name(ast_node))
-                node_item.setIcon(SyntaxTreeWidget.COL_NODE,
-                                  self.icon_factory.getIcon(IconFactory.LIST_NODE))
 
-                for idx, elem in enumerate(ast_node):
-                    add_node(elem, node_item, "{}[{:d}]".format(field_label, idx))
-            else:
-                value_str = repr(ast_node)
-                node_str = "{} = {}".format(field_label, value_str)
-                node_item.setIcon(SyntaxTreeWidget.COL_NODE,
-                                  self.icon_factory.getIcon(IconFactory.PY_NODE))
+    def current_node(self):
+        """ Returns the node index of the current item, or NO_NODE if there is none.
+        """
+        current_item = self.currentItem()
+        if current_item is None:
+            return NO_NODE
+        node_idx = current_item.data(SyntaxTreeWidget.COL_NODE, ROLE_NODE)
+        return NO_NODE if node_idx is None else node_idx
 
-            node_item.setText(SyntaxTreeWidget.COL_NODE, node_str)
-            node_item.setText(SyntaxTreeWidget.COL_FIELD, field_label)
-            node_item.setText(SyntaxTreeWidget.COL_CLASS, class_name(ast_node))
-            node_item.setText(SyntaxTreeWidget.COL_VALUE, value_str)
 
-            node_item.setToolTip(SyntaxTreeWidget.COL_NODE, node_str)
-            node_item.setToolTip(SyntaxTreeWidget.COL_FIELD, field_label)
-            node_item.setToolTip(SyntaxTreeWidget.COL_CLASS, class_name(ast_node))
-            node_item.setToolTip(SyntaxTreeWidget.COL_VALUE, value_str)
+    def get_item_span(self, tree_item):
+        """ Returns (start_pos, end_pos) tuple where start_pos and end_pos, in turn, are (line, col)
+            tuples
+        """
+        node_idx = tree_item.data(SyntaxTreeWidget.COL_NODE, ROLE_NODE)
+        if node_idx is None or self.table is None:
+            return (None, None)
+        return self.table.span(node_idx)
 
-            # To force icon size in Python 2 (not needed)
-            #node_item.setSizeHint(SyntaxTreeWidget.COL_NODE, self.row_size_hint)
 
-            return node_item
+    def find_item(self, tree_item, position):
+        """ Finds the deepest node item that highlights the position at line_nr column_nr, and
+            has a position defined itself.
 
-        # End of helper function
+            This visits all items. Use the span_index to find a node in O(log n) time.
 
-        root_item = add_node(syntax_tree, self, root_label)
-        root_item.setToolTip(SyntaxTreeWidget.COL_NODE, os.path.realpath(root_label))
+            :param tree_item: look within this QTreeWidgetItem and its child items
+            :param position: (line_nr, column_nr) tuple
+        """
+        check_class(position, tuple)
+        node_idx = tree_item.data(SyntaxTreeWidget.COL_NODE, ROLE_NODE)
+        if node_idx is None or self.table is None:
+            return None
+
+        # The children are visited before their parent, so the deepest match is found first.
+        table = self.table
+        n_visited = 0
+        for idx in iter_postorder(table, node_idx):
+            n_visited += 1
+            # If start_pos < position < end_pos the node matches.
+            if table.line[idx] != NO_POS:
+                item_start_pos, item_end_pos = table.span(idx)
+                if item_start_pos is not None and item_end_pos is not None:
+                    if item_start_pos < position < item_end_pos:
+                        profiler.count(COUNT_FIND_ITEM_VISITS, n_visited)
+                        return self._node_item(idx)
 
-        self._populate_highlighting_pass_1(self.invisibleRootItem(), last_pos)
-        self._populate_highlighting_pass_2(self.invisibleRootItem())
-        self._populate_text_from_data(self.invisibleRootItem())
+        # No matching node found in this subtree
+        profiler.count(COUNT_FIND_ITEM_VISITS, n_visited)
+        return None
 
-        return root_item
 
+    def clear(self):
+        """ Removes all items and the node table.
+        """
+        super(SyntaxTreeWidget, self).clear()
+        self.table = None
+        self.span_index = None
+        self.compact_layout = None
+        self._items = []
+        self._chunked = set()
+        self._stop_populating()
+        self.expander.cancel()
+
+
+    def populate(self, table, span_index=None):
+        """ Populates the tree widget. In compact mode the hidden nodes don't get an item. The
+            items of the rows of chunked lists are made when their chunk is expanded.
+
+            Only the items of the root and the top-level statements are made right away, so that
+            the tree can be shown immediately, also for large modules. The other items are made
+            in time slices between which the event loop runs.
+
+            :param table: NodeTable with the nodes of the syntax tree
+            :param span_index: SpanIndex of the table. Will be built if None.
+            :return: the QTreeWidgetItem that corresponds to the root node
+        """
+        self.clear()
+        self.table = table
+        self.span_index = SpanIndex(table) if span_index is None else span_index
+        self.compact_layout = CompactLayout(table) if self.compact else None
+
+        # The nodes are stored breadth-first with contiguous children, so the parent item always
+        # exists and the children are added in the right order.
+        n_nodes = depth_limit(table, MAX_VIEW_DEPTH)
+        n_first = min(depth_limit(table, FIRST_SCREEN_DEPTH), n_nodes)
+        if self.compact_layout is None:
+            self._shown_nodes = range(n_nodes)
+        else:
+            layout = self.compact_layout
+            self._shown_nodes = layout.shown_nodes[:layout.n_shown_before[n_nodes]]
+            n_first = layout.n_shown_before[n_first]
+        self._chunked = find_chunked_lists(table, n_nodes, self.compact_layout)
+        self._items = [None] * n_nodes
+        self._n_populated = 0
+        self._pending_expanded = bytearray(n_nodes)
+
+        self._populate_slice(max_duration=None, end_pos=n_first)
+        if self.populating:
+            self._populate_timer.start()
+        return self._items[0] if self._items else None
+
+
+    @property
+    def populating(self):
+        """ True while not all items have been made by populate.
+        """
+        return self._shown_nodes is not None
 
-    def _populate_highlighting_pass_1(self, tree_item, last_pos):
-        """ Fills the highlight span for items that have a position defined. (pass 1)
 
-            Walk depth-first and backwards through the nodes, so that we can keep track of the
-            end of the span (last_pos)
+    def finish_populating(self):
+        """ Makes the remaining items without returning to the event loop.
         """
-        max_last_pos = last_pos # The maximum last_pos at this level of recursion.
-
-        for childIdx in range(tree_item.childCount(), 0, -1):
-            child_item = tree_item.child(childIdx-1)
-            children_last_pos = self._populate_highlighting_pass_1(child_item, last_pos)
-
-            # Decorator nodes seem to be out-of order in the tree. They occur after the body but
-            # their line number is smaller. This messes up the highlight spans so we don't
-            # propagate their value
-            if tree_item.text(SyntaxTreeWidget.COL_FIELD) != u'decorator_list':
-                last_pos = children_last_pos
-
-        pos = tree_item.data(SyntaxTreeWidget.COL_POS, ROLE_POS)
-        if pos is not None:
-            last_pos = pos
-
-        assert last_pos is not None
-        assert max_last_pos is not None
-        cmp = cmpPos(last_pos, max_last_pos)
-        if cmp < 0:
-            tree_item.setData(SyntaxTreeWidget.COL_HIGHLIGHT, ROLE_START_POS, last_pos)
-            tree_item.setData(SyntaxTreeWidget.COL_HIGHLIGHT, ROLE_END_POS, max_last_pos)
-        elif cmp > 0:
-            # The node positions (line-nr, col) are not always in increasing order when traversing
-            # the tree. This may result in highlight spans where the start pos is larger than the
-            # end pos.
-            logger.info("Nodes out of order. Invalid highlighting {}:{} : {}:{} ({})"
-                        .format(last_pos[0], last_pos[1], max_last_pos[0], max_last_pos[1],
-                                tree_item.text(SyntaxTreeWidget.COL_NODE)))
-            tree_item.setData(SyntaxTreeWidget.COL_HIGHLIGHT, ROLE_START_POS, last_pos)
-            tree_item.setData(SyntaxTreeWidget.COL_HIGHLIGHT, ROLE_END_POS, max_last_pos)
-            if DEBUGGING:
-                tree_item.setForeground(SyntaxTreeWidget.COL_HIGHLIGHT,
-                                        QtGui.QBrush(QtGui.QColor('red')))
-        else:
-            pass # No new position found in the children. These nodes will be filled in later.
+        if self.populating:
+            self._populate_slice(max_duration=None)
 
-        return last_pos
 
+    def _populate_slice(self, max_duration=SLICE_DURATION, end_pos=None):
+        """ Makes the items of the next shown nodes during at most about max_duration seconds (no
+            maximum if None).
 
-    @QtCore.Slot()
-    def _populate_highlighting_pass_2(self, tree_item, parent_start_pos=None, parent_end_pos=None):
-        """ Fill in the nodes that don't have a highlighting from their parent
+            :param end_pos: if not None, stops after this number of shown nodes has been handled.
         """
-        start_pos = tree_item.data(SyntaxTreeWidget.COL_HIGHLIGHT, ROLE_START_POS)
-        end_pos = tree_item.data(SyntaxTreeWidget.COL_HIGHLIGHT, ROLE_END_POS)
+        table, items, chunked = self.table, self._items, self._chunked
+        shown_nodes, pending_expanded = self._shown_nodes, self._pending_expanded
+        end_pos = len(shown_nodes) if end_pos is None else min(end_pos, len(shown_nodes))
+        end_time = None if max_duration is None else time.time() + max_duration
+
+        pos = self._n_populated
+        n_created = 0
+        with profiler.phase('tree: populate'):
+            while pos < end_pos:
+                if (end_time is not None and pos % CHECK_INTERVAL == 0 and
+                        time.time() >= end_time):
+                    break
+                node_idx = shown_nodes[pos]
+                pos += 1
+                parent_idx = table.parent[node_idx]
+                if parent_idx == NO_NODE:
+                    parent_item = self
+                else:
+                    parent_item = items[parent_idx]
+                    if parent_item is None or parent_idx in chunked:
+                        continue # The node is in a chunk, which is filled when expanded.
+                if items[node_idx] is not None:
+                    continue # Made when its chunk was filled.
+
+                node_item = QtWidgets.QTreeWidgetItem(parent_item)
+                node_item.setData(SyntaxTreeWidget.COL_NODE, ROLE_NODE, node_idx)
+                items[node_idx] = node_item
+                if node_idx in chunked:
+                    self._add_chunk_items(node_idx, node_item)
+                if pending_expanded[node_idx]:
+                    node_item.setExpanded(True)
+
+                n_created += 1
+
+        self._n_populated = pos
+        profiler.count(COUNT_ITEMS_CREATED, n_created)
+        if pos == len(shown_nodes):
+            self._stop_populating()
+
+
+    def _stop_populating(self):
+        """ Stops making items in time slices.
+        """
+        self._populate_timer.stop()
+        self._shown_nodes = None
+        self._pending_expanded = None
 
-        # If the highlight span is still undefined use the value from the parent.
-        if start_pos is None and end_pos is None:
-            start_pos = parent_start_pos
-            end_pos = parent_end_pos
-            tree_item.setData(SyntaxTreeWidget.COL_HIGHLIGHT, ROLE_START_POS, start_pos)
-            tree_item.setData(SyntaxTreeWidget.COL_HIGHLIGHT, ROLE_END_POS, end_pos)
 
-        # Populate children recursively
-        for childIdx in range(tree_item.childCount()):
-            self._populate_highlighting_pass_2(tree_item.child(childIdx), start_pos, end_pos)
+    def repopulate(self, table, span_index=None):
+        """ Replaces the node table with a new version of the same module (e.g. after the file
+            has been reloaded).
 
+            The items of the top-level statements that haven't changed are kept, so that they
+            keep their expansion and selection state. Only the items of the changed statements
+            are rebuilt. If the tables can't be compared, the tree is populated and expanded as
+            at start up.
 
-    def _populate_text_from_data(self, tree_item):
-        """ Fills the pos and highlight columns given the underlying data.
+            :param table: NodeTable with the nodes of the syntax tree
+            :param span_index: SpanIndex of the table. Will be built if None.
+            :return: the QTreeWidgetItem that corresponds to the root node
         """
-        # Update the pos column
-        pos = tree_item.data(SyntaxTreeWidget.COL_POS, ROLE_POS)
-        if pos is None:
-            text = ""
-        else:
-            text = "{0[0]}:{0[1]}".format(pos)
-
-        tree_item.setText(SyntaxTreeWidget.COL_POS, text)
-
-        # Update the highlight column
-        start_pos = tree_item.data(SyntaxTreeWidget.COL_HIGHLIGHT, ROLE_START_POS)
-        end_pos = tree_item.data(SyntaxTreeWidget.COL_HIGHLIGHT, ROLE_END_POS)
+        # Items are only reused if neither table is cut off at MAX_VIEW_DEPTH.
+        diff = None
+        if self.table is not None and not self.populating and \
+                len(self._items) == len(self.table) and \
+                depth_limit(table, MAX_VIEW_DEPTH) == len(table):
+            diff = TreeDiff(self.table, table)
+
+        # The statements are updated as the children of the body item, so not if they are chunked.
+        if diff is not None and diff.compatible and \
+                (diff.old_body in self._chunked or table.child_count[diff.new_body] > CHUNK_SIZE):
+            diff = None
+        if diff is None or not diff.compatible or diff.n_reused == 0:
+            logger.debug("Rebuilding all items.")
+            root_item = self.populate(table, span_index=span_index)
+            self.expand_reset()
+            return root_item
+
+        with profiler.phase('tree: repopulate', items=len(table)):
+            return self._repopulate(diff, span_index)
+
+
+    def _repopulate(self, diff, span_index):
+        """ Updates the items given the differences between the current and the new table.
+        """
+        table = diff.new_table
+        old_items = self._items
+        body_item = old_items[diff.old_body]
+        for old_stmt_idx in self.table.children(diff.old_body):
+            if diff.node_map[old_stmt_idx] == NO_NODE:
+                body_item.removeChild(old_items[old_stmt_idx])
+
+        self.table = table
+        self.span_index = SpanIndex(table) if span_index is None else span_index
+        self.compact_layout = CompactLayout(table) if self.compact else None
+        self._chunked = find_chunked_lists(table, len(table), self.compact_layout)
+
+        # Rebind the items that are kept to their new node index. The nodes of unchanged
+        # statements are hidden in compact mode, or in a chunk that hasn't been filled, if and
+        # only if they were before.
+        items = [None] * len(table)
+        for old_idx, new_idx in enumerate(diff.node_map):
+            node_item = old_items[old_idx]
+            if new_idx != NO_NODE and node_item is not None:
+                items[new_idx] = node_item
+                node_item.setData(SyntaxTreeWidget.COL_NODE, ROLE_NODE, new_idx)
+
+        for row, (new_stmt_idx, old_stmt_idx) in enumerate(diff.new_statements):
+            if old_stmt_idx == NO_NODE:
+                stmt_item = self._create_subtree_items(new_stmt_idx, items)
+                body_item.insertChild(row, stmt_item)
+                self.expand_reset(stmt_item)
+
+        self._items = items
+        self.viewport().update() # The texts of items with an unchanged node index may differ.
+        return items[0]
+
+
+    def _node_item(self, node_idx):
+        """ Returns the item of a node. If the node isn't shown, the item of its deepest ancestor
+            that is shown is returned. Fills the chunks that contain the node.
+        """
+        table, layout, items = self.table, self.compact_layout, self._items
+        while node_idx >= len(items) or (layout is not None and layout.hidden[node_idx]):
+            node_idx = table.parent[node_idx]
+
+        if self.populating:
+            # Make the items up to the node. The shown nodes are sorted by node index.
+            self._populate_slice(max_duration=None, end_pos=node_idx + 1 if layout is None
+                                 else layout.n_shown_before[node_idx] + 1)
+
+        if items[node_idx] is None:
+            # Fill the chunks of the node and its ancestors, starting at the top.
+            in_chunk = []
+            idx = node_idx
+            while idx != NO_NODE:
+                parent_idx = table.parent[idx]
+                if parent_idx in self._chunked:
+                    in_chunk.append(idx)
+                idx = parent_idx
+            for idx in reversed(in_chunk):
+                if items[idx] is None:
+                    parent_idx = table.parent[idx]
+                    chunk_nr = node_row(table, idx, layout) // CHUNK_SIZE
+                    self._fill_chunk(items[parent_idx].child(chunk_nr))
+        return items[node_idx]
+
+
+    def _add_chunk_items(self, list_idx, list_item):
+        """ Adds the (empty) chunk items to the item of a chunked list.
+        """
+        n_rows = row_count(self.table, list_idx, self.compact_layout)
+        for first_row in range(0, n_rows, CHUNK_SIZE):
+            chunk_item = QtWidgets.QTreeWidgetItem(list_item)
+            chunk_item.setText(SyntaxTreeWidget.COL_NODE,
+                               chunk_label(first_row, min(CHUNK_SIZE, n_rows - first_row)))
+            chunk_item.setData(SyntaxTreeWidget.COL_NODE, ROLE_CHUNK, first_row // CHUNK_SIZE)
+            chunk_item.setChildIndicatorPolicy(QtWidgets.QTreeWidgetItem.ShowIndicator)
 
-        text = ""
 
-        if start_pos is not None:
-            text += "{0[0]}:{0[1]}".format(start_pos)
+    def _fill_chunk(self, chunk_item):
+        """ Creates the items of the rows of a chunk, unless they already exist.
+        """
+        chunk_nr = chunk_item.data(SyntaxTreeWidget.COL_NODE, ROLE_CHUNK)
+        if chunk_nr is None or chunk_item.childCount() > 0:
+            return # Not a chunk item, or it has been filled already.
 
-        if end_pos is not None:
-            text += " : {0[0]}:{0[1]}".format(end_pos)
+        table, layout = self.table, self.compact_layout
+        list_idx = chunk_item.parent().data(SyntaxTreeWidget.COL_NODE, ROLE_NODE)
+        first_row = chunk_nr * CHUNK_SIZE
+        last_row = min(first_row + CHUNK_SIZE, row_count(table, list_idx, layout))
+        with profiler.phase('tree: fill chunk'):
+            child_items = [self._create_subtree_items(child_node(table, list_idx, row, layout),
+                                                      self._items)
+                           for row in range(first_row, last_row)]
+            chunk_item.addChildren(child_items)
 
-        tree_item.setText(SyntaxTreeWidget.COL_HIGHLIGHT, text)
 
-        # Recursively populate
-        for childIdx in range(tree_item.childCount()):
-            child_item = tree_item.child(childIdx)
-            self._populate_text_from_data(child_item)
+    def _create_subtree_items(self, node_idx, items):
+        """ Creates the items of the subtree of a node and stores them in the items list.
 
+            :return: the item of the node. It has no parent yet.
+        """
+        top_item = QtWidgets.QTreeWidgetItem()
+        top_item.setData(SyntaxTreeWidget.COL_NODE, ROLE_NODE, node_idx)
+        items[node_idx] = top_item
+        profiler.count(COUNT_ITEMS_CREATED)
+
+        layout = self.compact_layout
+        stack = [node_idx]
+        while stack:
+            parent_idx = stack.pop()
+            if parent_idx in self._chunked:
+                self._add_chunk_items(parent_idx, items[parent_idx])
+                continue
+            for child_idx in self.table.children(parent_idx):
+                if child_idx >= len(items) or (layout is not None and layout.hidden[child_idx]):
+                    continue
+                child_item = QtWidgets.QTreeWidgetItem(items[parent_idx])
+                child_item.setData(SyntaxTreeWidget.COL_NODE, ROLE_NODE, child_idx)
+                items[child_idx] = child_item
+                profiler.count(COUNT_ITEMS_CREATED)
+                stack.append(child_idx)
+        return top_item
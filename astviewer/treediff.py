@@ -0,0 +1,143 @@
+""" Compares the node tables of two versions of a module, statement by statement.
+
+    Used when a file is reloaded, so that the tree only has to rebuild the rows of the top-level
+    statements that have changed.
+
+    IMPORTANT: this module must not import Qt so that it can be used without a display.
+"""
+from __future__ import print_function
+
+import difflib, hashlib, logging
+
+from array import array
+
+from astviewer.nodetable import INT_TYPE_CODE, KIND_LIST, NO_NODE, iter_preorder
+
+logger = logging.getLogger(__name__)
+
+
+
+def subtree_hash(table, node_idx):
+    """ Returns a hash of the structure of the subtree of a node.
+
+        The hash includes the classes, field names and primitive values of the nodes, but not their
+        positions. A statement that has only moved therefore has the same hash.
+        The label of the node itself (e.g. 'body[3]') is not included either.
+    """
+    hasher = hashlib.sha1()
+    class_names, field_names = table.class_names, table.field_names
+    class_id, field_id, child_count = table.class_id, table.field_id, table.child_count
+
+    for idx in iter_preorder(table, node_idx):
+        hasher.update(u"{}\0{}\0{}\0{}\n".format(
+            class_names[class_id[idx]], field_names[field_id[idx]] if idx != node_idx else '',
+            child_count[idx], table.value_str(idx)).encode('utf-8', 'surrogatepass'))
+
+    return hasher.digest()
+
+
+def find_body(table):
+    """ Returns the index of the list node that holds the top-level statements.
+
+        Returns NO_NODE if the root node is not a module with a body (e.g. when parsed with
+        mode='eval').
+    """
+    if len(table) == 0:
+        return NO_NODE
+    for child_idx in table.children(0):
+        if table.field_names[table.field_id[child_idx]] == 'body' and \
+                table.kind(child_idx) == KIND_LIST:
+            return child_idx
+    return NO_NODE
+
+
+
+class TreeDiff(object):
+    """ The differences between the old and new node table of a module.
+
+        Top-level statements are considered unchanged if their subtree hash is equal, the other
+        children of the root node must be equal, otherwise the diff is not compatible and the
+        tree must be rebuilt completely.
+
+        Attributes:
+            compatible: False if the tables can't be compared statement by statement.
+            node_map: array that maps the old node indices to the new node indices. Nodes of
+                statements that have changed map to NO_NODE.
+            old_body, new_body: the index of the body list node in the old and new table.
+            new_statements: list with a (new_stmt_idx, old_stmt_idx) tuple for each top-level
+                statement in the new table. old_stmt_idx is NO_NODE if the statement has changed.
+    """
+    def __init__(self, old_table, new_table):
+        """ Constructor. Compares the tables.
+        """
+        self.old_table = old_table
+        self.new_table = new_table
+        self.node_map = array(INT_TYPE_CODE, [NO_NODE]) * len(old_table)
+        self.old_body = find_body(old_table)
+        self.new_body = find_body(new_table)
+        self.new_statements = []
+        self.compatible = False
+
+        if self.old_body == NO_NODE or self.new_body == NO_NODE:
+            return
+
+        old_root_children = list(old_table.children(0))
+        new_root_children = list(new_table.children(0))
+        if len(old_root_children) != len(new_root_children) or \
+                old_table.class_name(0) != new_table.class_name(0):
+            return
+
+        for old_idx, new_idx in zip(old_root_children, new_root_children):
+            if old_idx == self.old_body:
+                if new_idx != self.new_body:
+                    return
+            elif subtree_hash(old_table, old_idx) != subtree_hash(new_table, new_idx):
+                return
+
+        self.compatible = True
+        self.node_map[0] = 0
+        self.node_map[self.old_body] = self.new_body
+        for old_idx, new_idx in zip(old_root_children, new_root_children):
+            if old_idx != self.old_body:
+                self._map_subtree(old_idx, new_idx)
+
+        self._diff_statements()
+
+
+    @property
+    def n_reused(self):
+        """ The number of top-level statements that are unchanged.
+        """
+        return sum(1 for _new_idx, old_idx in self.new_statements if old_idx != NO_NODE)
+
+
+    def _diff_statements(self):
+        """ Matches the top-level statements of the old and new table by their hashes.
+        """
+        old_statements = list(self.old_table.children(self.old_body))
+        new_statements = list(self.new_table.children(self.new_body))
+        old_hashes = [subtree_hash(self.old_table, idx) for idx in old_statements]
+        new_hashes = [subtree_hash(self.new_table, idx) for idx in new_statements]
+
+        old_matches = [NO_NODE] * len(new_statements)
+        matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+        for old_start, new_start, size in matcher.get_matching_blocks():
+            for offset in range(size):
+                old_idx = old_statements[old_start + offset]
+                new_idx = new_statements[new_start + offset]
+                old_matches[new_start + offset] = old_idx
+                self._map_subtree(old_idx, new_idx)
+
+        self.new_statements = list(zip(new_statements, old_matches))
+        logger.debug("Reusing {} of {} statements".format(self.n_reused, len(new_statements)))
+
+
+    def _map_subtree(self, old_idx, new_idx):
+        """ Maps the nodes of two subtrees that have the same structure.
+        """
+        old_table, new_table, node_map = self.old_table, self.new_table, self.node_map
+        stack = [(old_idx, new_idx)]
+        while stack:
+            old_idx, new_idx = stack.pop()
+            node_map[old_idx] = new_idx
+            stack.extend(zip(old_table.children(old_idx), new_table.children(new_idx)))
@@ -0,0 +1,477 @@
+""" Contains the lazy tree model and the tree view that displays it.
+
+    Contrary to the SyntaxTreeWidget, which creates a QTreeWidgetItem for every node up front, the
+    rows of the SyntaxTreeModel are only created when the view asks for them; that is, when the
+    user expands their parent. Display texts, tooltips and icons are produced by data() on demand.
+
+    The model indices refer to the nodes of a NodeTable: their internal id is the node index.
+    The rows of the chunks of a long list (see CHUNK_SIZE) have an internal id with the
+    CHUNK_ID_FLAG bit set, which holds the node index of the list and the number of the chunk.
+"""
+from __future__ import print_function
+
+import logging
+
+from astviewer.compact import CompactLayout
+from astviewer.expander import TreeExpander, iter_nodes_to_expand, EXPAND_ALL, EXPAND_DEPTH, \
+    EXPAND_RESET, EXPAND_ROWS
+from astviewer.iconfactory import IconFactory
+from astviewer.nodetable import NO_NODE, depth_limit
+from astviewer.profiling import profiler, COUNT_SPAN_LOOKUPS
+from astviewer.qtpy import QtCore, QtWidgets
+from astviewer.spanindex import SpanIndex
+from astviewer.toggle_column_mixin import ToggleColumnTreeView
+from astviewer.tree import SyntaxTreeWidget, CHUNK_SIZE, KIND_GLYPHS, MAX_VIEW_DEPTH, \
+    ROLE_NODE, child_node, chunk_label, column_text, column_tooltip, find_chunked_lists, \
+    node_row, row_count
+from astviewer.treediff import TreeDiff
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ID_FLAG = 1 << 62 # Set in the internal ids of the rows of chunks
+CHUNK_NR_BITS = 24      # Number of bits of the chunk number in the internal id
+
+# The widget inherits from a Qt class, therefore it has many
+# ancestors public methods and attributes.
+# pylint: disable=R0901, R0902, R0904, W0201, R0913
+
+
+def _chunk_id(list_idx, chunk_nr):
+    """ Returns the internal id of the row of a chunk.
+    """
+    return CHUNK_ID_FLAG | (list_idx << CHUNK_NR_BITS) | chunk_nr
+
+
+def _split_id(internal_id):
+    """ Returns a (node_idx, chunk_nr) tuple given the internal id of a model index.
+
+        The chunk_nr is None if the row is a node. Otherwise node_idx is the chunked list.
+    """
+    if internal_id & CHUNK_ID_FLAG:
+        return ((internal_id & ~CHUNK_ID_FLAG) >> CHUNK_NR_BITS,
+                internal_id & ((1 << CHUNK_NR_BITS) - 1))
+    return internal_id, None
+
+
+
+class SyntaxTreeModel(QtCore.QAbstractItemModel):
+    """ Item model that exposes a NodeTable and creates its rows on demand.
+    """
+    HEADER_LABELS = SyntaxTreeWidget.HEADER_LABELS
+    (COL_NODE, COL_FIELD, COL_CLASS, COL_VALUE, COL_POS, COL_HIGHLIGHT) = range(len(HEADER_LABELS))
+
+    def __init__(self, parent=None):
+        """ Constructor
+        """
+        super(SyntaxTreeModel, self).__init__(parent=parent)
+        self.table = None
+        self.n_shown = 0 # Nodes with a lower index are shown, see MAX_VIEW_DEPTH
+        self.compact_layout = None # The CompactLayout of the table in compact mode
+        self.chunked = set()       # Lists whose rows are grouped in chunks
+        self.icon_factory = IconFactory.singleton()
+
+
+    def set_table(self, table, compact=False):
+        """ Resets the model so that it contains the nodes of the table.
+
+            :param table: NodeTable with the nodes of the syntax tree. If None the model is cleared.
+            :param compact: if True, the nodes that are hidden by a CompactLayout have no rows.
+        """
+        self.beginResetModel()
+        try:
+            self.table = table
+            if table is None:
+                self.n_shown, self.compact_layout, self.chunked = 0, None, set()
+            else:
+                self.n_shown = depth_limit(table, MAX_VIEW_DEPTH)
+                self.compact_layout = CompactLayout(table) if compact else None
+                self.chunked = find_chunked_lists(table, self.n_shown, self.compact_layout)
+        finally:
+            self.endResetModel()
+
+
+    def replace_table(self, table, node_map):
+        """ Replaces the table by a new version of the same module without resetting the model.
+
+            The persistent indices (used by the view for the current item, the selection and the
+            expanded nodes) are moved to the corresponding node of the new table. Persistent indices of nodes
+            that no longer exist become invalid. The model stays in compact mode if it was.
+
+            :param table: the new NodeTable
+            :param node_map: array that maps the node indices of the current table to the node
+                indices of the new table (NO_NODE if a node no longer exists). See TreeDiff.
+        """
+        self.layoutAboutToBeChanged.emit()
+        try:
+            old_indices = self.persistentIndexList()
+            self.table = table
+            self.n_shown = depth_limit(table, MAX_VIEW_DEPTH)
+            self.compact_layout = None if self.compact_layout is None else CompactLayout(table)
+            self.chunked = find_chunked_lists(table, self.n_shown, self.compact_layout)
+
+            new_indices = []
+            for old_index in old_indices:
+                old_idx, chunk_nr = _split_id(old_index.internalId())
+                new_idx = node_map[old_idx]
+                if new_idx == NO_NODE or new_idx != self.shown_node(new_idx):
+                    new_indices.append(QtCore.QModelIndex())
+                elif chunk_nr is None:
+                    new_indices.append(self.index_from_node(new_idx, old_index.column()))
+                elif new_idx in self.chunked and chunk_nr < self._n_chunks(new_idx):
+                    new_indices.append(self.createIndex(chunk_nr, old_index.column(),
+                                                        _chunk_id(new_idx, chunk_nr)))
+                else:
+                    new_indices.append(QtCore.QModelIndex())
+            self.changePersistentIndexList(old_indices, new_indices)
+        finally:
+            self.layoutChanged.emit()
+
+
+    def root_index(self):
+        """ Returns the QModelIndex of the root node. Invalid if the model is empty.
+        """
+        if not self.table:
+            return QtCore.QModelIndex()
+        return self.createIndex(0, 0, 0)
+
+
+    def shown_node(self, node_idx):
+        """ Returns the node itself if it's shown, otherwise its deepest ancestor that is shown.
+        """
+        layout = self.compact_layout
+        while node_idx >= self.n_shown or (layout is not None and layout.hidden[node_idx]):
+            node_idx = self.table.parent[node_idx]
+        return node_idx
+
+
+    def index_from_node(self, node_idx, column=0):
+        """ Returns the QModelIndex of a node in the table.
+
+            If the node isn't shown, the index of its deepest ancestor that is shown is returned.
+        """
+        node_idx = self.shown_node(node_idx)
+        row = node_row(self.table, node_idx, self.compact_layout)
+        if self.table.parent[node_idx] in self.chunked:
+            row %= CHUNK_SIZE
+        return self.createIndex(row, column, node_idx)
+
+
+    def node_from_index(self, index):
+        """ Returns the node index given a QModelIndex. Returns None for the invisible root and
+            for the rows of chunks.
+        """
+        if not index.isValid():
+            return None
+        node_idx, chunk_nr = _split_id(index.internalId())
+        return node_idx if chunk_nr is None else None
+
+
+    def _n_chunks(self, list_idx):
+        """ Returns the number of chunks of a chunked list.
+        """
+        n_rows = row_count(self.table, list_idx, self.compact_layout)
+        return (n_rows + CHUNK_SIZE - 1) // CHUNK_SIZE
+
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        """ Returns the index of the item in the model specified by the given row, column and
+            parent index.
+        """
+        if not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, 0)
+
+        parent_idx, chunk_nr = _split_id(parent.internalId())
+        if chunk_nr is None and parent_idx in self.chunked:
+            return self.createIndex(row, column, _chunk_id(parent_idx, row))
+
+        list_row = row if chunk_nr is None else chunk_nr * CHUNK_SIZE + row
+        return self.createIndex(row, column,
+                                child_node(self.table, parent_idx, list_row, self.compact_layout))
+
+
+    def parent(self, index):
+        """ Returns the parent of the model item with the given index.
+        """
+        if not index.isValid():
+            return QtCore.QModelIndex()
+
+        node_idx, chunk_nr = _split_id(index.internalId())
+        if chunk_nr is not None:
+            return self.index_from_node(node_idx) # The chunked list
+
+        parent_idx = self.table.parent[node_idx]
+        if parent_idx == NO_NODE:
+            return QtCore.QModelIndex()
+        elif parent_idx in self.chunked:
+            chunk_nr = node_row(self.table, node_idx, self.compact_layout) // CHUNK_SIZE
+            return self.createIndex(chunk_nr, 0, _chunk_id(parent_idx, chunk_nr))
+        return self.index_from_node(parent_idx)
+
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        """ Returns the number of rows under the given parent.
+        """
+        if parent.column() > 0 or not self.table:
+            return 0
+        if not parent.isValid():
+            return 1
+
+        parent_idx, chunk_nr = _split_id(parent.internalId())
+        if chunk_nr is not None:
+            n_rows = row_count(self.table, parent_idx, self.compact_layout)
+            return min(CHUNK_SIZE, n_rows - chunk_nr * CHUNK_SIZE)
+        if self.table.first_child[parent_idx] >= self.n_shown:
+            return 0 # The children are too deep, see MAX_VIEW_DEPTH.
+        if parent_idx in self.chunked:
+            return self._n_chunks(parent_idx)
+        return row_count(self.table, parent_idx, self.compact_layout)
+
+
+    def columnCount(self, _parent=QtCore.QModelIndex()):
+        """ Returns the number of columns.
+        """
+        return len(self.HEADER_LABELS)
+
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        """ Returns the header labels.
+        """
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.HEADER_LABELS[section]
+        return None
+
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        """ Returns the data stored under the given role for the item referred to by the index.
+        """
+        if not index.isValid():
+            return None
+
+        col = index.column()
+        node_idx, chunk_nr = _split_id(index.internalId())
+        if chunk_nr is not None:
+            if role == QtCore.Qt.DisplayRole and col == self.COL_NODE:
+                return chunk_label(chunk_nr * CHUNK_SIZE, self.rowCount(index))
+            return None
+
+        if role == QtCore.Qt.DisplayRole:
+            return column_text(self.table, node_idx, col, self.compact_layout)
+        elif role == QtCore.Qt.ToolTipRole:
+            return column_tooltip(self.table, node_idx, col)
+        elif role == QtCore.Qt.DecorationRole and col == self.COL_NODE:
+            return self.icon_factory.getIcon(KIND_GLYPHS[self.table.kind(node_idx)])
+        elif role == ROLE_NODE:
+            return node_idx
+        return None
+
+
+
+class SyntaxTreeView(ToggleColumnTreeView):
+    """ Tree view that displays the AST using the lazy SyntaxTreeModel.
+
+        Has the same columns and header behavior as the SyntaxTreeWidget.
+    """
+    HEADER_LABELS = SyntaxTreeModel.HEADER_LABELS
+    (COL_NODE, COL_FIELD, COL_CLASS, COL_VALUE, COL_POS, COL_HIGHLIGHT) = range(len(HEADER_LABELS))
+
+    def __init__(self, parent=None):
+        """ Constructor
+        """
+        super(SyntaxTreeView, self).__init__(parent=parent)
+
+        self._model = SyntaxTreeModel(parent=self)
+        self.setModel(self._model)
+        self.span_index = None
+        self.compact = False # If True, populate leaves out the nodes of a CompactLayout
+        self.expander = TreeExpander(self)
+
+        self.setAlternatingRowColors(True)
+        self.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.setUniformRowHeights(True)
+        self.setAnimated(False)
+
+        tree_header = self.header()
+        self.add_header_context_menu(checked={'Node': True}, checkable={'Node': True},
+                                     enabled={'Node': False})
+
+        # Don't stretch last column, it doesn't play nice when columns hidden and then shown again.
+        tree_header.setStretchLastSection(False)
+        self.setIconSize(QtCore.QSize(20, 20))
+        self.icon_factory = IconFactory.singleton()
+        self.icon_factory.prerenderIcons(self.iconSize() * self.devicePixelRatioF())
+
+
+    def sizeHint(self):
+        """ The recommended size for the widget.
+        """
+        size = QtCore.QSize()
+        size.setWidth(600)
+        size.setHeight(700)
+        return size
+
+
+    def clear(self):
+        """ Removes all nodes from the tree.
+        """
+        self._model.set_table(None)
+        self.span_index = None
+        self.expander.cancel()
+
+
+    @property
+    def table(self):
+        """ The NodeTable that is displayed (None if the view is empty).
+        """
+        return self._model.table
+
+
+    @property
+    def compact_layout(self):
+        """ The CompactLayout of the table in compact mode (None otherwise).
+        """
+        return self._model.compact_layout
+
+
+    def populate(self, table, span_index=None):
+        """ Populates the tree view. Rows are created when their parent is expanded.
+
+            In compact mode the hidden nodes don't get a row.
+
+            :param table: NodeTable with the nodes of the syntax tree
+            :param span_index: SpanIndex of the table. Will be built if None.
+            :return: the QModelIndex of the root node
+        """
+        self.span_index = SpanIndex(table) if span_index is None else span_index
+        with profiler.phase('tree: populate', items=len(table)):
+            self._model.set_table(table, compact=self.compact)
+        return self._model.root_index()
+
+
+    def repopulate(self, table, span_index=None):
+        """ Replaces the node table with a new version of the same module (e.g. after the file
+            has been reloaded).
+
+            The rows of the top-level statements that haven't changed keep their expansion and
+            selection state. If the tables can't be compared, the tree is populated and expanded as
+            at start up.
+
+            :param table: NodeTable with the nodes of the syntax tree
+            :param span_index: SpanIndex of the table. Will be built if None.
+            :return: the QModelIndex of the root node
+        """
+        diff = None if self.table is None else TreeDiff(self.table, table)
+        if diff is None or not diff.compatible or diff.n_reused == 0:
+            logger.debug("Resetting the model.")
+            root_index = self.populate(table, span_index=span_index)
+            self.expand_reset()
+            return root_index
+
+        self.span_index = SpanIndex(table) if span_index is None else span_index
+        with profiler.phase('tree: repopulate', items=len(table)):
+            self._model.replace_table(table, diff.node_map)
+
+        body_index = self._model.index_from_node(diff.new_body)
+        if self.isExpanded(body_index):
+            for new_stmt_idx, old_stmt_idx in diff.new_statements:
+                if old_stmt_idx == NO_NODE:
+                    self.expand_reset(self._model.index_from_node(new_stmt_idx))
+        return self._model.root_index()
+
+
+    @QtCore.Slot()
+    def expand_reset(self, index=None):
+        """ Expands/collapses the nodes as they were at program start up.
+
+            If index is None, the whole tree is reset in time slices by the expander. Otherwise
+            the (collapsed) nodes of the subtree of index are expanded immediately.
+
+            Only descends into nodes that are expanded so that no rows are created for the
+            collapsed parts of the tree.
+        """
+        if index is None:
+            self.expander.start(EXPAND_RESET)
+            return
+
+        top_idx = self._model.node_from_index(index)
+        for node_idx in iter_nodes_to_expand(self.table, EXPAND_RESET, top_idx=top_idx):
+            self.set_node_expanded(node_idx, True)
+
+
+    @QtCore.Slot()
+    def expand_all(self):
+        """ Expands all nodes in time slices. This creates the rows of all nodes.
+        """
+        self.expander.start(EXPAND_ALL)
+
+
+    def expand_to_depth(self, depth):
+        """ Expands the nodes so that the nodes up to depth levels below the root are visible.
+        """
+        self.expander.start(EXPAND_DEPTH, depth)
+
+
+    def expand_to_rows(self, n_rows):
+        """ Expands the nodes breadth-first for as long as there are at most n_rows visible rows.
+        """
+        self.expander.start(EXPAND_ROWS, n_rows)
+
+
+    @QtCore.Slot()
+    def collapse_all(self):
+        """ Stops the expander and collapses all nodes.
+        """
+        self.expander.cancel()
+        self.collapseAll()
+
+
+    def set_node_expanded(self, node_idx, expanded):
+        """ Expands or collapses the row of a node. Does nothing if the node isn't shown.
+        """
+        if node_idx < self._model.n_shown:
+            self.setExpanded(self._model.index_from_node(node_idx), expanded)
+
+
+    @QtCore.Slot(int, int)
+    def select_node(self, line_nr, column_nr):
+        """ Selects the node given a line and column number.
+        """
+        profiler.count(COUNT_SPAN_LOOKUPS)
+        node_idx = NO_NODE if self.span_index is None else \
+            self.span_index.find_node((line_nr, column_nr))
+
+        if node_idx == NO_NODE:
+            self.selectionModel().clearCurrentIndex()
+            self.clearSelection()
+        else:
+            self.setCurrentIndex(self._model.index_from_node(node_idx))
+
+
+    def set_current_node(self, node_idx):
+        """ Makes the node the current index. Expands its ancestors to make it visible.
+        """
+        index = self._model.index_from_node(node_idx)
+        parent_index = index.parent() # Includes the chunks
+        while parent_index.isValid():
+            self.expand(parent_index)
+            parent_index = parent_index.parent()
+        self.setCurrentIndex(index)
+        self.scrollTo(index)
+
+
+    def current_node(self):
+        """ Returns the node index of the current index, or NO_NODE if there is none.
+        """
+        node_idx = self._model.node_from_index(self.currentIndex())
+        return NO_NODE if node_idx is None else node_idx
+
+
+    def get_item_span(self, index):
+        """ Returns (start_pos, end_pos) tuple where start_pos and end_pos, in turn, are (line, col)
+            tuples
+        """
+        node_idx = self._model.node_from_index(index)
+        if node_idx is None:
+            return (None, None)
+        return self.table.span(node_idx)
@@ -0,0 +1,174 @@
+""" Contains the threads that parse the source code in the background.
+"""
+from __future__ import print_function
+
+import logging, multiprocessing, traceback
+
+from astviewer.parsing import parse_module, NestingTooDeepError, PHASE_PARSE
+from astviewer.profiling import profiler
+from astviewer.qtpy import QtCore
+from astviewer.workspace import load_module
+
+logger = logging.getLogger(__name__)
+
+
+
+class ParseCancelled(Exception):
+    """ Raised in the parse thread to abort parsing when the job has been cancelled.
+    """
+    pass
+
+
+
+class ParseThread(QtCore.QThread):
+    """ Thread that parses source code and builds the node table, span index and search index.
+
+        Only Qt-free work is done in the thread. When the thread has finished, the result is
+        available in the parsed_module attribute, or the error and stack_trace attributes are set
+        if parsing failed. The GUI should populate the tree in a slot connected to finished().
+    """
+    sigProgress = QtCore.Signal(str, int) # phase, percentage done (-1 if unknown)
+
+    def __init__(self, source_code, file_name, mode, cache=None, parent=None):
+        """ Constructor
+
+            :param source_code: the source as string, or as UTF-8 bytes (see parse_module).
+            :param cache: optional ParseCache that is used to skip parsing of known sources.
+        """
+        super(ParseThread, self).__init__(parent=parent)
+        self.source_code = source_code
+        self.file_name = file_name
+        self.mode = mode
+        self.cache = cache
+
+        self.parsed_module = None
+        self.error = None
+        self.stack_trace = ''
+        self._cancelled = False
+
+
+    @property
+    def cancelled(self):
+        """ True if cancel() has been called.
+        """
+        return self._cancelled
+
+
+    def cancel(self):
+        """ Requests the thread to stop. The thread stops at the next progress report.
+        """
+        self._cancelled = True
+
+
+    def run(self):
+        """ Parses the source code. Is executed in the thread.
+        """
+        logger.debug("Parse thread started for: {}".format(self.file_name))
+        try:
+            with profiler.phase('parse thread'):
+                try:
+                    self.parsed_module = parse_module(
+                        self.source_code, file_name=self.file_name, mode=self.mode,
+                        progress=self._report_progress, cache=self.cache, search=True)
+                except NestingTooDeepError as ex:
+                    logger.debug("Parsing in a worker process: {}".format(ex))
+                    self.parsed_module = self._parse_in_process()
+        except ParseCancelled:
+            logger.debug("Parsing canceled: {}".format(self.file_name))
+        except Exception as ex:
+            self.error = ex
+            self.stack_trace = traceback.format_exc()
+        finally:
+            self.source_code = None # The thread is done with it.
+
+
+    def _parse_in_process(self):
+        """ Parses the source code with a deep parse in a worker process. The recursion limit
+            of the GUI process must not be raised, see parsing.PARSE_RECURSION_LIMIT.
+
+            :raises ParseCancelled: if the job is cancelled while waiting for the result.
+        """
+        self._report_progress(PHASE_PARSE, 0, 0)
+        pool = multiprocessing.get_context('spawn').Pool(1)
+        try:
+            result = pool.apply_async(parse_module, (self.source_code, ),
+                                      dict(file_name=self.file_name, mode=self.mode,
+                                           cache=self.cache, search=True, deep=True))
+            while True:
+                try:
+                    return result.get(timeout=WorkspaceLoadThread.POLL_INTERVAL)
+                except multiprocessing.TimeoutError:
+                    self._report_progress(PHASE_PARSE, 0, 0)
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+    def _report_progress(self, phase, n_done, n_total):
+        """ Emits the progress signal. Raises ParseCancelled if the job was cancelled.
+        """
+        if self._cancelled:
+            raise ParseCancelled()
+        percentage = int(100 * n_done / n_total) if n_total else -1
+        self.sigProgress.emit(phase, percentage)
+
+
+
+class WorkspaceLoadThread(QtCore.QThread):
+    """ Thread that reads and parses files in a pool of worker processes.
+
+        Parsing is CPU bound, so only processes can parse several files at the same time. The
+        thread waits for their results and emits sigModuleLoaded for each file, in the order in
+        which they are done.
+    """
+    sigModuleLoaded = QtCore.Signal(str, object, str) # file name, WorkspaceModule, error
+
+    POLL_INTERVAL = 0.1 # Seconds between checks for cancellation while waiting for a result
+
+    def __init__(self, file_names, mode, cache=None, n_processes=None, parent=None):
+        """ Constructor
+
+            :param file_names: the files to load
+            :param cache: optional ParseCache that is used to skip parsing of known sources.
+            :param n_processes: number of worker processes. Default: the number of CPU cores,
+                but not more than the number of files.
+        """
+        super(WorkspaceLoadThread, self).__init__(parent=parent)
+        self.file_names = list(file_names)
+        self.mode = mode
+        self.cache = cache
+        if n_processes is None:
+            n_processes = multiprocessing.cpu_count()
+        self.n_processes = max(1, min(n_processes, len(self.file_names)))
+        self._cancelled = False
+
+
+    def cancel(self):
+        """ Requests the thread to stop. The worker processes are terminated.
+        """
+        self._cancelled = True
+
+
+    def run(self):
+        """ Loads the files. Is executed in the thread.
+        """
+        logger.debug("Loading {} files in {} processes."
+                     .format(len(self.file_names), self.n_processes))
+        jobs = [(file_name, self.mode, self.cache) for file_name in self.file_names]
+        # Forking a threaded (Qt) process is unsafe: the workers would inherit the locks that
+        # other threads hold at that moment (e.g. the parse lock), and block on them forever.
+        pool = multiprocessing.get_context('spawn').Pool(self.n_processes)
+        try:
+            results = pool.imap_unordered(load_module, jobs)
+            n_done = 0
+            while n_done < len(jobs) and not self._cancelled:
+                try:
+                    file_name, module, error = results.next(timeout=self.POLL_INTERVAL)
+                except multiprocessing.TimeoutError:
+                    continue
+                n_done += 1
+                self.sigModuleLoaded.emit(file_name, module, error)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,141 @@
+""" Contains the workspace: the parse results of the files that are open in the viewer.
+
+    The parsed modules are kept in a least recently used (LRU) list with a memory budget.
+    Switching to a file whose module is still in the list skips reading and parsing it. When the
+    modules take more memory than the budget, the least recently used ones are dropped. Their
+    files are then read and parsed again when they are shown.
+
+    IMPORTANT: this module must not import Qt so that it can be used in worker processes.
+"""
+from __future__ import print_function
+
+import logging, sys
+
+from collections import OrderedDict
+
+from astviewer.loader import read_source_file
+from astviewer.nodetable import NO_NODE
+from astviewer.parsing import parse_module
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 512 * 1024**2
+
+
+
+class WorkspaceModule(object):
+    """ A file of the workspace with its parse result and the view state of the file.
+    """
+    def __init__(self, source_file, parsed_module):
+        """ Constructor
+
+            :param source_file: the SourceFile. Its data attribute should be None.
+            :param parsed_module: the ParsedModule, including its search index.
+        """
+        self.source_file = source_file
+        self.parsed_module = parsed_module
+        self.current_node = NO_NODE  # The current node of the tree when the file was left
+        self.scroll_pos = 0          # The scroll position of the editor when the file was left
+
+
+    @property
+    def file_name(self):
+        """ The name of the file.
+        """
+        return self.source_file.file_name
+
+
+    def nbytes(self):
+        """ Returns the (approximate) number of bytes used by the source and parse result.
+        """
+        return sys.getsizeof(self.source_file.text) + self.parsed_module.nbytes()
+
+
+
+class ModuleLRU(object):
+    """ The workspace modules, by file name, ordered from least to most recently used.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        """ Constructor
+
+            :param max_bytes: the memory budget. The most recently used module is always kept,
+                even if it is larger than the budget.
+        """
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._modules = OrderedDict() # (WorkspaceModule, n_bytes) tuple per file name
+
+
+    def __len__(self):
+        """ Returns the number of modules.
+        """
+        return len(self._modules)
+
+
+    def __contains__(self, file_name):
+        """ Returns True if the module of the file is in the list.
+        """
+        return file_name in self._modules
+
+
+    def get(self, file_name):
+        """ Returns the module of the file and marks it as most recently used.
+
+            Returns None if the module isn't in the list.
+        """
+        entry = self._modules.pop(file_name, None)
+        if entry is None:
+            return None
+        self._modules[file_name] = entry
+        return entry[0]
+
+
+    def put(self, module):
+        """ Adds or replaces the module of a file, and drops the least recently used modules
+            while the memory budget is exceeded.
+        """
+        self.remove(module.file_name)
+        n_bytes = module.nbytes()
+        self._modules[module.file_name] = (module, n_bytes)
+        self.n_bytes += n_bytes
+
+        while self.n_bytes > self.max_bytes and len(self._modules) > 1:
+            file_name, (_module, n_bytes) = self._modules.popitem(last=False)
+            self.n_bytes -= n_bytes
+            logger.debug("Dropped module of {} ({} bytes) from the workspace."
+                         .format(file_name, n_bytes))
+
+
+    def remove(self, file_name):
+        """ Removes the module of a file if it's in the list.
+        """
+        entry = self._modules.pop(file_name, None)
+        if entry is not None:
+            self.n_bytes -= entry[1]
+
+
+    def clear(self):
+        """ Removes all modules.
+        """
+        self._modules.clear()
+        self.n_bytes = 0
+
+
+
+def load_module(job):
+    """ Reads and parses a file. Is executed in the worker processes.
+
+        :param job: (file_name, mode, cache) tuple. The cache is a ParseCache or None.
+        :return: (file_name, WorkspaceModule, error) tuple. The module is None if the file could
+            not be read or parsed; the error then describes why.
+    """
+    file_name, mode, cache = job
+    try:
+        source_file = read_source_file(file_name)
+        parsed_module = parse_module(source_file.parse_source, file_name=file_name, mode=mode,
+                                     cache=cache, search=True, deep=True)
+    except Exception as ex:
+        return (file_name, None, "{}: {}".format(type(ex).__name__, ex))
+
+    source_file.data = None # Only needed for parsing.
+    return (file_name, WorkspaceModule(source_file, parsed_module), '')
@@ -0,0 +1,2 @@
+""" Benchmarks of AstViewer. See run_benchmarks.py
+"""
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+""" Benchmarks of the parse, tree, span and editor hot paths.
+
+    Runs every benchmark on synthetic modules of configurable size and nesting, and optionally
+    on the largest modules of the standard library. Qt runs with the offscreen platform so no
+    display is needed. The results are written to a JSON file that can be compared against a
+    stored baseline:
+
+        %> python benchmarks/run_benchmarks.py --output results.json
+        %> python benchmarks/run_benchmarks.py --baseline results.json
+
+    The exit code is 1 if a benchmark is slower than the baseline by more than the tolerance.
+"""
+from __future__ import print_function
+
+import argparse, ast, json, logging, os, platform, random, sys, time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import make_module
+
+from astviewer.editor import SourceEditor
+from astviewer.nodetable import build_node_table, NO_POS
+from astviewer.parsing import get_last_pos
+from astviewer.qtpy import QtWidgets
+from astviewer.query import QueryIndex
+from astviewer.spanindex import SpanIndex
+from astviewer.tree import SyntaxTreeWidget
+from astviewer.treemodel import SyntaxTreeView
+from astviewer.version import PROGRAM_VERSION
+
+logger = logging.getLogger(__name__)
+
+RESULTS_FORMAT_VERSION = 1
+DEFAULT_SIZES = (1000, 10000)  # Number of lines of the synthetic modules
+DEFAULT_TOLERANCE = 0.25       # Fraction a benchmark may be slower than the baseline
+N_LOOKUPS = 1000               # Number of positions for the lookup benchmarks
+N_FIND_ITEM_LOOKUPS = 20       # find_item visits all items, so use fewer positions
+QUERIES = ('FunctionDef Call', 'If > Expr Call[func=Name]', "Name[id~='^a']", 'FunctionDef > *')
+
+
+
+def time_function(function, repeat, number=1):
+    """ Calls the function number times, repeat times, and returns the durations per call.
+    """
+    durations = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for _ in range(number):
+            function()
+        durations.append((time.perf_counter() - start_time) / number)
+    return durations
+
+
+def random_positions(table, count, seed=0):
+    """ Returns a list of random (line, col) positions within the spans of the table.
+    """
+    rng = random.Random(seed)
+    positioned = [idx for idx in range(len(table)) if table.line[idx] != NO_POS]
+    positions = []
+    for _ in range(count):
+        start_pos, end_pos = table.span(rng.choice(positioned))
+        positions.append(start_pos if rng.random() < 0.5 else end_pos)
+    return positions
+
+
+def random_spans(table, count, seed=0):
+    """ Returns a list of random (start_pos, end_pos) spans of the table.
+    """
+    rng = random.Random(seed)
+    positioned = [idx for idx in range(len(table)) if table.line[idx] != NO_POS]
+    return [table.span(rng.choice(positioned)) for _ in range(count)]
+
+
+
+class BenchmarkRunner(object):
+    """ Runs the benchmarks on a list of cases and collects the results.
+    """
+    def __init__(self, repeat):
+        """ Constructor
+
+            :param repeat: number of times each benchmark is repeated. The minimum is reported.
+        """
+        self.repeat = repeat
+        self.results = []
+        self.app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+    def record(self, case, name, durations, per='call', count=1):
+        """ Adds a result and prints it.
+
+            :param count: number of operations per duration. The durations are divided by it.
+        """
+        durations = sorted(duration / count for duration in durations)
+        result = {'case': case, 'name': name, 'per': per, 'repeat': len(durations),
+                  'min': durations[0], 'median': durations[len(durations) // 2]}
+        self.results.append(result)
+        print("  {:<28s} {:>12.6f} s/{}".format(name, result['min'], per))
+
+
+    def run_case(self, case, source):
+        """ Runs all benchmarks on the source of one case.
+        """
+        print("{} ({} lines, {} bytes)".format(case, source.count('\n'), len(source)))
+        repeat = self.repeat
+
+        self.record(case, 'get_last_pos', time_function(lambda: get_last_pos(source), repeat))
+        self.record(case, 'ast_parse', time_function(lambda: ast.parse(source), repeat))
+
+        syntax_tree = ast.parse(source)
+        last_pos = get_last_pos(source)
+        self.record(case, 'build_table', time_function(
+            lambda: build_node_table(syntax_tree, last_pos), repeat))
+        self.record(case, 'build_table_heuristic_spans', time_function(
+            lambda: build_node_table(syntax_tree, last_pos, exact_spans=False), repeat))
+        table = build_node_table(syntax_tree, last_pos)
+        del syntax_tree
+        print("  ({} nodes)".format(len(table)))
+
+        self.record(case, 'span_index', time_function(lambda: SpanIndex(table), repeat))
+        span_index = SpanIndex(table)
+
+        positions = random_positions(table, N_LOOKUPS)
+        self.record(case, 'find_node', time_function(
+            lambda: [span_index.find_node(pos) for pos in positions], repeat),
+            per='lookup', count=len(positions))
+
+        self.record(case, 'query_index', time_function(lambda: QueryIndex(table), repeat))
+        query_index = QueryIndex(table)
+        self.record(case, 'query', time_function(
+            lambda: [query_index.query(query) for query in QUERIES], repeat),
+            per='query', count=len(QUERIES))
+
+        # The tree widget
+        widget = SyntaxTreeWidget()
+        self.record(case, 'widget_populate', time_function(lambda: widget.populate(table), repeat))
+        root_item = widget.populate(table)
+        self.record(case, 'widget_expand_reset', time_function(
+            lambda: (widget.expand_reset(), widget.expander.finish()), repeat))
+        self.record(case, 'widget_expand_all', time_function(
+            lambda: (widget.expand_all(), widget.expander.finish()), repeat))
+
+        find_positions = positions[:N_FIND_ITEM_LOOKUPS]
+        self.record(case, 'widget_find_item', time_function(
+            lambda: [widget.find_item(root_item, pos) for pos in find_positions], repeat),
+            per='lookup', count=len(find_positions))
+        widget.clear()
+        widget.deleteLater()
+
+        # The lazy tree view
+        view = SyntaxTreeView()
+        self.record(case, 'view_populate', time_function(lambda: view.populate(table), repeat))
+        self.record(case, 'view_expand_reset', time_function(
+            lambda: (view.expand_reset(), view.expander.finish()), repeat))
+        view.clear()
+        view.deleteLater()
+
+        # The source editor
+        editor = SourceEditor()
+        self.record(case, 'editor_set_text', time_function(
+            lambda: editor.setPlainText(source), repeat))
+        self.record(case, 'editor_get_last_pos', time_function(editor.get_last_pos, repeat))
+
+        spans = random_spans(table, N_LOOKUPS)
+        self.record(case, 'editor_select_text', time_function(
+            lambda: [editor.select_text(start, end) for start, end in spans], repeat),
+            per='selection', count=len(spans))
+        editor.deleteLater()
+
+        self.app.processEvents()
+
+
+def stdlib_cases(count):
+    """ Yields (case, source) tuples of the largest modules of the standard library.
+    """
+    stdlib_dir = os.path.dirname(os.__file__)
+    sizes = []
+    for file_name in os.listdir(stdlib_dir):
+        if file_name.endswith('.py'):
+            file_path = os.path.join(stdlib_dir, file_name)
+            sizes.append((os.path.getsize(file_path), file_name, file_path))
+
+    for _size, file_name, file_path in sorted(sizes, reverse=True)[:count]:
+        with open(file_path, 'rb') as source_file:
+            yield 'stdlib/{}'.format(file_name), source_file.read().decode('utf-8')
+
+
+def compare_results(results, baseline, tolerance):
+    """ Compares the results with the baseline results. Prints a table of ratios.
+
+        :return: list of (case, name, ratio) tuples of the benchmarks that are slower than the
+            baseline by more than the tolerance.
+    """
+    baseline_by_key = {(res['case'], res['name']): res for res in baseline['results']}
+    regressions = []
+    print("\n{:<32s} {:<28s} {:>8s}".format('Case', 'Benchmark', 'Ratio'))
+    for result in results:
+        key = (result['case'], result['name'])
+        if key not in baseline_by_key:
+            continue
+        ratio = result['min'] / max(baseline_by_key[key]['min'], 1e-12)
+        slower = ratio > 1.0 + tolerance
+        print("{:<32s} {:<28s} {:>8.2f}{}".format(key[0], key[1], ratio,
+                                                 '  REGRESSION' if slower else ''))
+        if slower:
+            regressions.append((key[0], key[1], ratio))
+    return regressions
+
+
+def main():
+    """ Main program
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='*', default=list(DEFAULT_SIZES),
+        help="Number of lines of the synthetic modules. Default: {}".format(DEFAULT_SIZES))
+    parser.add_argument('--nesting', type=int, default=3,
+        help="Maximum nesting of the compound statements in the synthetic modules.")
+    parser.add_argument('--stdlib', type=int, default=0, metavar='N',
+        help="Also run the benchmarks on the N largest modules of the standard library.")
+    parser.add_argument('--repeat', type=int, default=3,
+        help="Number of repetitions. The minimum duration is used for the comparison.")
+    parser.add_argument('-o', '--output', help="JSON file where the results are written.")
+    parser.add_argument('-b', '--baseline', help="JSON file with results to compare against.")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+        help="Fraction a benchmark may be slower than the baseline. Default: {}"
+             .format(DEFAULT_TOLERANCE))
+    args = parser.parse_args()
+
+    logging.basicConfig(level='WARNING')
+
+    runner = BenchmarkRunner(repeat=args.repeat)
+    for n_lines in args.sizes:
+        source = make_module(n_lines, nesting=args.nesting)
+        runner.run_case('synthetic/{}-lines/nesting-{}'.format(n_lines, args.nesting), source)
+
+    for case, source in stdlib_cases(args.stdlib):
+        runner.run_case(case, source)
+
+    output = {
+        'format_version': RESULTS_FORMAT_VERSION,
+        'program_version': PROGRAM_VERSION,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'results': runner.results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2, sort_keys=True)
+        print("\nResults written to: {}".format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('python_version') != output['python_version']:
+            print("Warning: baseline was made with Python {}"
+                  .format(baseline.get('python_version')))
+
+        regressions = compare_results(runner.results, baseline, args.tolerance)
+        if regressions:
+            print("\n{} benchmark(s) slower than the baseline.".format(len(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+""" Generates synthetic Python modules of configurable size and nesting for the benchmarks.
+
+    The modules are deterministic for a given seed so that benchmark results can be compared
+    between runs.
+"""
+from __future__ import print_function
+
+import random
+
+INDENT = '    '
+
+# Some identifiers and strings contain non-ASCII characters so that the UTF-8 byte columns of
+# the ast differ from the character columns of the editor.
+NAMES = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta', 'jota', 'kappa',
+         'lam', 'mu', 'nu', 'xi', 'omicron', 'pi', 'rho', 'sigma', 'tau', 'ups', 'phi', 'chi',
+         'psi', 'omega', u'été', u'naïve', u'πι']
+STRINGS = ['hello', 'world', u'café', u'日本', 'spam and eggs', '']
+
+
+
+class ModuleGenerator(object):
+    """ Generates the source code of a synthetic module.
+    """
+    def __init__(self, seed=0, nesting=3, block_size=4):
+        """ Constructor
+
+            :param seed: seed of the random generator
+            :param nesting: maximum depth of nested compound statements (if/for/while/with/try)
+                inside a function.
+            :param block_size: number of statements in a block
+        """
+        self.rng = random.Random(seed)
+        self.nesting = nesting
+        self.block_size = block_size
+
+
+    def name(self):
+        """ Returns a random identifier.
+        """
+        return self.rng.choice(NAMES)
+
+
+    def expression(self, depth=0):
+        """ Returns a random expression.
+        """
+        choice = self.rng.randint(0, 9 if depth < 3 else 2)
+        if choice == 0:
+            return self.name()
+        elif choice == 1:
+            return str(self.rng.randint(0, 1000))
+        elif choice == 2:
+            return repr(self.rng.choice(STRINGS))
+        elif choice in (3, 4):
+            return "{} {} {}".format(self.expression(depth + 1), self.rng.choice('+-*%'),
+                                     self.expression(depth + 1))
+        elif choice == 5:
+            args = ", ".join(self.expression(depth + 1) for _ in range(self.rng.randint(0, 3)))
+            return "{}({})".format(self.name(), args)
+        elif choice == 6:
+            return "[{}]".format(", ".join(self.expression(depth + 1) for _ in range(3)))
+        elif choice == 7:
+            return "{{{}: {}}}".format(repr(self.rng.choice(STRINGS)), self.expression(depth + 1))
+        elif choice == 8:
+            return "{}.{}[{}]".format(self.name(), self.name(), self.expression(depth + 1))
+        else:
+            return "({} if {} else {})".format(self.expression(depth + 1), self.name(),
+                                               self.expression(depth + 1))
+
+
+    def block(self, lines, indent, depth):
+        """ Appends a block of statements to lines.
+        """
+        for _ in range(self.block_size):
+            prefix = INDENT * indent
+            if depth < self.nesting and self.rng.random() < 0.3:
+                kind = self.rng.randint(0, 3)
+                if kind == 0:
+                    lines.append("{}if {} > {}:".format(prefix, self.name(), self.expression()))
+                elif kind == 1:
+                    lines.append("{}for {} in {}:".format(prefix, self.name(), self.expression()))
+                elif kind == 2:
+                    lines.append("{}while {}:".format(prefix, self.expression()))
+                else:
+                    lines.append("{}with {}({}) as {}:".format(prefix, self.name(),
+                                                               self.expression(), self.name()))
+                self.block(lines, indent + 1, depth + 1)
+            elif self.rng.random() < 0.1:
+                lines.append("{}return {}".format(prefix, self.expression()))
+                break
+            else:
+                lines.append("{}{} = {}".format(prefix, self.name(), self.expression()))
+
+
+    def function(self, lines, indent=0):
+        """ Appends a function definition to lines.
+        """
+        args = ", ".join(sorted(set(self.name() for _ in range(self.rng.randint(0, 3)))))
+        lines.append("{}def {}_{}({}):".format(INDENT * indent, self.name(),
+                                                self.rng.randint(0, 10**6), args))
+        lines.append('{}""" Docstring of a generated function. """'.format(INDENT * (indent + 1)))
+        self.block(lines, indent + 1, 0)
+        lines.append("")
+
+
+    def module(self, n_lines):
+        """ Returns the source of a module with at least n_lines lines.
+
+            Functions are grouped in classes; some functions are at the top level.
+        """
+        lines = ['""" Generated module. """', 'import os, sys', '']
+        while len(lines) < n_lines:
+            if self.rng.random() < 0.3:
+                lines.append("class {}_{}(object):".format(self.name().capitalize(),
+                                                           self.rng.randint(0, 10**6)))
+                for _ in range(self.rng.randint(1, 5)):
+                    self.function(lines, indent=1)
+            else:
+                self.function(lines)
+        return "\n".join(lines) + "\n"
+
+
+
+def make_module(n_lines, nesting=3, block_size=4, seed=0):
+    """ Returns the source of a synthetic module with at least n_lines lines.
+    """
+    return ModuleGenerator(seed=seed, nesting=nesting, block_size=block_size).module(n_lines)
@@ -36,7 +36,7 @@ setup(name = 'astviewer',
         'Topic :: Utilities'],
     packages = ['astviewer', 'astviewer.qtpy', 'astviewer.qtpy._patch'],
     package_data = {'astviewer': ['icons/*']}, # don't use data_files, it installs relative to the intallation dir (e.g. /usr/local)
-    scripts = ['pyastviewer'],
+    scripts = ['pyastviewer', 'pyastbatch'],
     #requires = ['pyqt']
 )
 